@@ -28,11 +28,16 @@ USE franklin;
 
 -- -------------------------------------------------------------------------------------------------
 -- MARC 21 leader information from the interchange.  There is a 1:1 correspondence between
--- MARC_Leader rows and bibliographic entities.
+-- MARC_Leader rows and bibliographic entities.  Digest is MARC.record.digest() of the record as
+-- stored, i.e., without its 9xx tags, so that a record can be checked for changes without reading
+-- it.  Databases created before it was added need bib_digest.sql.
 --
 CREATE TABLE IF NOT EXISTS MARC_leader (
        ctl_num	    CHAR(32)          NOT NULL UNIQUE KEY,
-       val	    CHAR(25)
+       val	    CHAR(25),
+       digest       CHAR(32),
+
+       INDEX ( `ctl_num`, `digest` )
 ) ENGINE = 'InnoDB';
 
 
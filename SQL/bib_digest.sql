@@ -0,0 +1,10 @@
+USE franklin;
+
+-- -------------------------------------------------------------------------------------------------
+-- Add the record digest to MARC_leader in a database created before it was part of bib.sql.  Run
+-- once.  Rows are left NULL; the loader fills them in as it meets the records (load_marc.py
+-- --update), and updates and edits fill in those of the records they write.
+--
+ALTER TABLE MARC_leader
+      ADD COLUMN digest CHAR(32),
+      ADD INDEX ( `ctl_num`, `digest` );
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              load_marc.py
+#  Description:       Bulk load of MARC record files into the catalog
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:05:55 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Bulk load of MARC record files into the catalog
+
+   Each file may be Z39.2 (ISO 2709) or MARC-XML; the format is sniffed from the first byte.  Records
+   are parsed as a stream, stripped of 9xx tags, timestamped, and stored in batches with one commit
+   per batch.  Records already in the catalog are reported and skipped, as are records without a
+   control number and Z39.2 records in MARC-8, which have to be converted to Unicode first.
+
+   With --update, records already in the catalog are compared with the stored ones by digest
+   instead, a batch at a time.  Those that are the same are skipped quietly, and those that
+   differ replace the stored ones.  Stored records that have no digest yet, because they were
+   stored before there were any, are read and compared in full, and if they're the same only the
+   digest is written.
+
+   After each commit the number of records consumed from the file is saved in a state file next to
+   it (<file>.load).  With --resume, a run picks up after the last committed batch instead of
+   starting over.
+
+     load_marc.py [--batch-size N] [--resume] [--update] FILE ...
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append( '../lib' )
+
+import config
+from MARC              import XML, Z392
+from db.mysql          import MARC
+from db                import CRUD
+
+db_name = 'franklin'
+
+BATCH_SIZE   = 500
+STATE_SUFFIX = '.load'
+
+
+def iter_records( path: str, on_reject = None ):
+    """Generate the records in the file at <path>, whichever format it's in.  <on_reject> is called
+    for Z39.2 records that can't be read because they're in MARC-8.
+
+    """
+    with open( path, 'rb' ) as f:
+        head = f.read( 64 ).lstrip()
+    if head[:1] == b'<':
+        return XML.iter_records( path )
+    else:
+        return Z392.iter_file( path, on_reject = on_reject )
+
+
+def read_state( path: str ) -> int:
+    """Return the number of records from <path> committed by a previous run, or 0.  A state file left
+    by a run against a different version of the file is ignored.
+
+    """
+    try:
+        with open( path + STATE_SUFFIX ) as f:
+            state = json.load( f )
+        if state[ 'size' ] == os.path.getsize( path ):
+            return state[ 'offset' ]
+        print( '{}: file changed since last run, starting over'.format( path ) )
+    except ( OSError, ValueError, KeyError ):
+        pass
+    return 0
+
+
+def write_state( path: str, offset: int ):
+    """Record that the first <offset> records of <path> are committed."""
+    tmp = path + STATE_SUFFIX + '.tmp'
+    with open( tmp, 'w' ) as f:
+        json.dump( { 'size' : os.path.getsize( path ), 'offset' : offset }, f )
+    os.replace( tmp, path + STATE_SUFFIX )
+
+
+class loader( object ):
+    """Accumulates records into batches and stores them, keeping count of what happened."""
+
+    def __init__( self, db: MARC.MARC, batch_size: int, update: bool = False ):
+        self.db         = db
+        self.batch_size = batch_size
+        self.update     = update
+        self.stored     = 0
+        self.updated    = 0
+        self.unchanged  = 0
+        self.conflicts  = 0
+        self.duplicates = 0
+        self.unusable   = 0
+
+
+    def store( self, batch: list ):
+        """Store the ( ctl_num, record ) pairs in <batch>, reporting those already in the catalog."""
+        if len( batch ) == 0: return
+
+        # Weed out records that are already stored, and repeats within the batch.  When updating,
+        # stored records whose content differs are set aside to replace the stored ones.  Control
+        # numbers are compared the way the database compares them, by ctl_key().
+        #
+        stored = { MARC.ctl_key( ctl_num ) : v for ctl_num, v in
+                   self.db.get_digests( [ ctl_num for ctl_num, rec in batch ] ).items() }
+        seen = set()
+        fresh = {}
+        changed = {}
+        undigested = {}
+        for ctl_num, rec in batch:
+            key = MARC.ctl_key( ctl_num )
+            if key in seen:
+                print( '{}: repeated in batch'.format( ctl_num ) )
+                self.duplicates += 1
+                continue
+            seen.add( key )
+            if key not in stored:
+                fresh[ ctl_num ] = rec
+            elif not self.update:
+                print( '{}: already in catalog'.format( ctl_num ) )
+                self.duplicates += 1
+            elif stored[ key ][ 0 ] is None:
+                undigested[ ctl_num ] = rec
+            elif stored[ key ][ 0 ] == rec.digest():
+                self.unchanged += 1
+            else:
+                changed[ ctl_num ] = rec
+
+        # Rather than rewrite those without a digest, which would bump their 005, compare them with
+        # the stored records and fill in the digest of those that are the same.
+        #
+        if len( undigested ) > 0:
+            digests = { MARC.ctl_key( r.ctl_num() ) : r.digest()
+                        for r in self.db.read_many( list( undigested ) ) }
+            for ctl_num, rec in undigested.items():
+                digest = rec.digest()
+                if digests.get( MARC.ctl_key( ctl_num ) ) == digest:
+                    self.db.fill_digest( ctl_num, digest )
+                    self.unchanged += 1
+                else:
+                    changed[ ctl_num ] = rec
+            self.db.db.commit()
+
+        for ctl_num, rec in changed.items():
+            try:
+                self.db.update( rec, ctl_num, version = stored[ MARC.ctl_key( ctl_num ) ][ 1 ] )
+                self.updated += 1
+            except CRUD.conflict:
+                print( '{}: changed in catalog while loading, not updated'.format( ctl_num ) )
+                self.conflicts += 1
+            except ( CRUD.not_found, ValueError ) as e:
+                print( '{}: not updated: {}'.format( ctl_num, e ) )
+                self.unusable += 1
+
+        # Somebody else may have stored one of these in the meantime.  If so, fall back to storing
+        # them one at a time.
+        #
+        try:
+            self.db.create_many( list( fresh.values() ) )
+            self.stored += len( fresh )
+        except CRUD.duplicate:
+            for ctl_num, rec in fresh.items():
+                try:
+                    self.db.create( rec )
+                    self.stored += 1
+                except CRUD.duplicate:
+                    print( '{}: already in catalog'.format( ctl_num ) )
+                    self.duplicates += 1
+
+
+    def load( self, path: str, resume: bool = False ):
+        """Load all the records in the file at <path>."""
+        skip = read_state( path ) if resume else 0
+        if skip > 0:
+            print( '{}: resuming after record {}'.format( path, skip ) )
+
+        offset = 0
+        batch = []
+
+        # MARC-8 records are dropped by the reader, but they still count toward the offset.
+        def reject( data, e ):
+            nonlocal offset
+            offset += 1
+            if offset <= skip: return
+            print( '{}: record {} not loaded: {}'.format( path, offset, e ) )
+            self.unusable += 1
+
+        for rec in iter_records( path, reject ):
+            offset += 1
+            if offset <= skip: continue
+
+            rec.strip_900s()
+            rec.update_timestamp()
+            try:
+                batch.append( ( rec.ctl_num(), rec ) )
+            except ( AttributeError, KeyError ):
+                print( '{}: record {} has no control number'.format( path, offset ) )
+                self.unusable += 1
+
+            if len( batch ) >= self.batch_size:
+                self.store( batch )
+                write_state( path, offset )
+                batch = []
+
+        self.store( batch )
+        write_state( path, offset )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser( description = 'Load MARC record files into the catalog.' )
+    parser.add_argument( 'files', nargs = '+', metavar = 'FILE',
+                         help = 'Z39.2 or MARC-XML file' )
+    parser.add_argument( '--batch-size', type = int, default = BATCH_SIZE,
+                         help = 'records per commit (default {})'.format( BATCH_SIZE ) )
+    parser.add_argument( '--resume', action = 'store_true',
+                         help = 'skip records committed by an interrupted run' )
+    parser.add_argument( '--update', action = 'store_true',
+                         help = 'replace records in the catalog that differ, skip those that don\'t' )
+    args = parser.parse_args()
+
+    db = MARC.MARC( config.CREDENTIALS['database'][db_name] )
+    l = loader( db, args.batch_size, args.update )
+
+    start = time.time()
+    for path in args.files:
+        l.load( path, args.resume )
+    elapsed = time.time() - start
+
+    total = l.stored + l.updated + l.unchanged + l.conflicts + l.duplicates + l.unusable
+    print( '{} stored, {} updated, {} unchanged, {} conflicts, {} duplicates, {} unusable '
+           'in {:.1f} s ({:.0f} records/sec)'.format(
+        l.stored,
+        l.updated,
+        l.unchanged,
+        l.conflicts,
+        l.duplicates,
+        l.unusable,
+        elapsed,
+        total / elapsed if elapsed > 0 else 0 ) )
+
+    sys.exit( 0 )
@@ -1,104 +1,124 @@
 #!/usr/bin/env python3
+"""Rebuild the search keywords in bib_keywords
 
-import re
+   The catalog keeps keywords up to date as records are created, edited, and deleted, so this is
+   only needed to catch changes made some other way.  With --since, only the records whose 005 is
+   at or after the given YYYYMMDDHHMMSS time stamp (or a prefix of one) are reindexed.
+
+   Without it, every keyword is regenerated from scratch.  Records are streamed from the catalog
+   in control number order and handed out in chunks to a pool of worker processes, which extract
+   the keywords.  The results are written in multi-row inserts to bib_keywords_new, which replaces
+   bib_keywords in one step when it's complete, so searches keep working throughout.  Records
+   changed or deleted while the rebuild was running are then brought up to date: those stamped
+   since shortly before it started, and those created too late for the scan to see, whose keywords
+   went into the table that was replaced.
+
+     rebuild_keywords.py [--since STAMP] [--workers N]
+
+"""
+
+import argparse
+import collections
+import itertools
+import multiprocessing
+import os
 import sys
-import MySQLdb as mdb
+from datetime import datetime, timedelta
 
 sys.path.append( '../lib' )
 
 import config
-from data_bib import data_bib
+from db.mysql import MARC
+from misc     import keywords
 
 db_name = 'franklin'
-db = data_bib( config.CREDENTIALS['database'][db_name] )
-
-SPLIT_REGEX = re.compile( r'[ ~\,\-]' )
-
-# May remove parts of words or entire words.  Since each regex is applied in turn, carefully order
-# the regexes so that the effects of applying one regex are properly susceptible to matching
-# subsequent expressions.
-DELETE_REGEXES = list( map( re.compile, [
-    r'\d{1,2}(/\d{1,2})?$',        # short digit strings
-    r"['\:\,\.\/\[\]\(\)]+",       # remove lots of punctuations
-    r'[\"]+',                      # ...and more punctuation
-    r'^[a-z0-9]{1}$',              # single alphanumeric characters
-    ] ) )
-
-# Remove entire literal strings, no regex matching
-DELETE_LITERALS = [
-    '!', "'", '&', '#', '-', '/', 'a', '1.', ':',
-    'and',
-    'etc',
-    'for',
-    'from',
-    'in',
-    'of',
-    'on',
-    'the',
-    'to',
-]
-
-
-def extract_keywords( str ):
-    """
-    Return a list of keyword/offset pairs for the keywords in str
-    """
-    result = []
-    words = re.split( SPLIT_REGEX, str.lower() )
-    offset = 0
-    for w in [ it for it in words if it not in DELETE_LITERALS ]:
-        for r in DELETE_REGEXES:
-            w = re.sub( r, '', w )
-        if w != '':
-            result.append( { 'word' : w, 'offset' : offset } )
-            offset = offset + 1
-    return [ it for it in result if it[ 'word' ] not in DELETE_LITERALS ]
-
-
-def store_keyword_tuples( ctl_num, words, namespace, instance = 0 ):
-    """
-    Store words in database under the key suggested by ctl_num, namespace, and instance
-    """
-    for w in words:
-        t = { 'ctl_num'    : ctl_num,
-              'keyword'    : w[ 'word' ],
-              'namespace'  : namespace,
-              'instance'   : instance,
-              'offset'     : w[ 'offset' ] }
-        try:
-            db.add_dict( 'bib_keywords', t )
-        except mdb.IntegrityError:
-            pass
+
+BATCH_SIZE = 500        # records per commit in --since mode, and per worker chunk otherwise
+
+# A record's 005 is stamped before its transaction commits, so a change stamped this long before
+# the rebuild started may still have been invisible to the scan.
+#
+IN_FLIGHT = timedelta( minutes = 10 )
+
+
+def chunks( it, size: int ):
+    """Generate lists of up to <size> consecutive items from <it>."""
+    it = iter( it )
+    while True:
+        chunk = list( itertools.islice( it, size ) )
+        if len( chunk ) == 0: return
+        yield chunk
+
+
+def extract_chunk( chunk: list ) -> list:
+    """Return the bib_keywords rows for a chunk of ( ctl_num, values ) pairs.  Runs in the workers."""
+    rows = []
+    for ctl_num, values in chunk:
+        rows.extend( ( ctl_num, ) + kw for kw in keywords.keyword_rows( values ) )
+    return rows
+
+
+def rebuild_all( db: MARC.MARC, workers: int ):
+    """Regenerate every keyword in the catalog into a new table and swap it in."""
+    start = ( datetime.now() - IN_FLIGHT ).strftime( '%Y%m%d%H%M%S' )
+    db.create_new_keywords()
+
+    def store( rows ):
+        db.insert_new_keywords( rows )
+        db.db.commit()
+
+    if workers <= 1:
+        for chunk in chunks( db.scan_keyword_values(), BATCH_SIZE ):
+            store( extract_chunk( chunk ) )
+    else:
+        # Keep only a few chunks in flight.  Pool.imap() would read the whole catalog into its
+        # task queue as fast as the scan could deliver it.
+        #
+        with multiprocessing.Pool( workers ) as pool:
+            pending = collections.deque()
+            for chunk in chunks( db.scan_keyword_values(), BATCH_SIZE ):
+                pending.append( pool.apply_async( extract_chunk, ( chunk, ) ) )
+                if len( pending ) >= 2 * workers:
+                    store( pending.popleft().get() )
+            while len( pending ) > 0:
+                store( pending.popleft().get() )
+
+    db.swap_new_keywords()
+
+    # Catch up with whatever happened during the rebuild.
+    db.delete_orphan_keywords()
+    db.db.commit()
+    reindex( db, sorted( set( db.changed_since( start ) ) | set( db.unindexed() ) ) )
+
+
+def rebuild_since( db: MARC.MARC, stamp: str ) -> int:
+    """Reindex the records changed at or after <stamp>.  Return how many there were."""
+    return reindex( db, db.changed_since( stamp ) )
+
+
+def reindex( db: MARC.MARC, ctl_nums: list ) -> int:
+    """Reindex the records with the given control numbers.  Return how many there were."""
+    for i in range( 0, len( ctl_nums ), BATCH_SIZE ):
+        for rec in db.read_many( ctl_nums[ i : i + BATCH_SIZE ] ):
+            db.reindex_keywords( rec )
+        db.db.commit()
+    return len( ctl_nums )
 
 
 if __name__ == "__main__":
 
-    # Clear current keyword entries; we will rebuild from scratch.
-    db.clear_keywords()
-
-    # @todo This isn't going to work right until the traversal is made to work right.  The titles
-    # will be missing subtitles because we can't join on a and b fields.  Authors will be mixed
-    # together.  Subjects will be mixed together.
-
-    for title in db.get_all_titles():
-        store_keyword_tuples(
-            title[ 0 ],
-            extract_keywords( title[ 1 ] ),
-            'T' )
-    db.commit()
-
-    for author in db.get_all_authors():
-        store_keyword_tuples(
-            author[ 0 ],
-            extract_keywords( author[ 2 ] ),
-            'A' )
-    db.commit()
-
-    for subject in db.get_all_subjects():
-        store_keyword_tuples(
-            subject[ 0 ],
-            extract_keywords( subject[ 2 ] ),
-            'S' )
-    db.commit()
+    parser = argparse.ArgumentParser( description = 'Rebuild the catalog search keywords.' )
+    parser.add_argument( '--since', metavar = 'STAMP',
+                         help = 'only reindex records changed at or after this 005 time stamp' )
+    parser.add_argument( '--workers', type = int, default = os.cpu_count(),
+                         help = 'keyword extraction processes for a full rebuild (default {})'.
+                         format( os.cpu_count() ) )
+    args = parser.parse_args()
+
+    db = MARC.MARC( config.CREDENTIALS['database'][db_name] )
+    if args.since is not None:
+        print( '{} records reindexed'.format( rebuild_since( db, args.since ) ) )
+    else:
+        rebuild_all( db, args.workers )
 
     sys.exit( 0 )
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              keyword_tokenize.py
+#  Description:       Throughput of keyword extraction from headings
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:46:14 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Throughput of keyword extraction from headings
+
+   Tokenizes <count> headings drawn at random from the subfield values in notes/lcbib.xml plus a
+   few diacritic-heavy ones (about 7% of them non-ASCII), each with a number appended so that no
+   two are alike, through misc.keywords.tokenize() one at a time and tokenize_many() in batches.
+
+   To compare with the old extract_keywords(), point --lib at the py/lib of a checkout from before
+   the tokenizer; whichever of the two the keywords module has is timed:
+
+     git worktree add /tmp/before 28179f1^
+     keyword_tokenize.py --lib /tmp/before/py/lib
+
+     keyword_tokenize.py [--lib DIR] [--count N]
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+
+SAMPLE = os.path.join( HERE, '..', '..', 'notes', 'lcbib.xml' )
+COUNT  = 1000000
+BATCH  = 1000           # headings per tokenize_many()
+
+DIACRITICS = [
+    'Dvořák, Antonín, 1841-1904.',
+    'Łódź (Poland) -- History -- 20th century.',
+    'Ærø og Þórr : sagaer /',
+    "L'École des femmes ; O'Brien's U.S. notes [1/2]",
+    'Москва -- История',
+]
+
+
+def headings( count: int ) -> list:
+    """Return <count> headings built from the sample record's subfield values."""
+    base = list( DIACRITICS )
+    for rec in XML.iter_records( SAMPLE ):
+        for tag in rec.tags:
+            base.extend( v for c, v in tag.fields if v )
+    random.seed( 0 )
+    return [ '{} {}'.format( random.choice( base ), random.randint( 1, 3000 ) )
+             for i in range( count ) ]
+
+
+def timed( name: str, run, count: int ):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print( '  {:18} {:.2f} s, {:.0f} headings/sec'.format( name, elapsed, count / elapsed ) )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser( description = 'Time keyword extraction.' )
+    parser.add_argument( '--lib', default = os.path.join( HERE, '..', 'lib' ),
+                         help = 'py/lib directory to import from (default this checkout)' )
+    parser.add_argument( '--count', type = int, default = COUNT,
+                         help = 'headings to tokenize (default {})'.format( COUNT ) )
+    args = parser.parse_args()
+
+    sys.path.insert( 0, os.path.abspath( args.lib ) )
+    from MARC import XML
+    from misc import keywords
+
+    H = headings( args.count )
+    non_ascii = sum( not h.isascii() for h in H )
+    print( 'misc.keywords from {}: {} headings, {:.1f}% non-ASCII'.format(
+        os.path.abspath( args.lib ), len( H ), 100 * non_ascii / len( H ) ) )
+
+    if hasattr( keywords, 'tokenize' ):
+        timed( 'tokenize()', lambda: [ keywords.tokenize( h ) for h in H ], len( H ) )
+        timed( 'tokenize_many()', lambda: [ keywords.tokenize_many( H[ i : i + BATCH ] )
+                                            for i in range( 0, len( H ), BATCH ) ], len( H ) )
+    else:
+        timed( 'extract_keywords()', lambda: [ keywords.extract_keywords( h ) for h in H ],
+               len( H ) )
+
+    sys.exit( 0 )
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              make_marc.py
+#  Description:       Synthetic Z39.2 dumps for benchmarks
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:37:09 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Synthetic Z39.2 dumps for benchmarks
+
+   Writes <count> small bibliographic records shaped like LC's: control fields, an ISBN, a
+   cataloging source, a main entry, a title with a little non-ASCII text, and a couple of subjects.
+   The records are encoded here by hand rather than with Z392.render_bytes(), so the readers being
+   benchmarked aren't reading back the output of their own module.
+
+     make_marc.py FILE [COUNT]
+
+"""
+
+import sys
+
+FT = b'\x1e'
+US = b'\x1f'
+RT = b'\x1d'
+
+COUNT = 100000
+
+
+def record( i: int ) -> bytes:
+    """Return synthetic record number <i> as a Z39.2 datagram."""
+    tags = [
+        ( '001', None, '{:08d}'.format( i ) ),
+        ( '005', None, '20130129114750.0' ),
+        ( '008', None, '120315s2012    moua          000 0 eng d' ),
+        ( '020', '  ', [ ( 'a', '978{:010d}'.format( i ) ) ] ),
+        ( '040', '  ', [ ( 'a', 'DLC' ), ( 'c', 'DLC' ) ] ),
+        ( '100', '1 ', [ ( 'a', 'Author, Ann {},'.format( i ) ), ( 'd', '1966-' ) ] ),
+        ( '245', '10', [ ( 'a', 'A title with ünïcode number {} /'.format( i ) ),
+                         ( 'c', 'Ann Author.' ) ] ),
+        ( '650', ' 0', [ ( 'a', 'Subject' ) ] ),
+        ( '650', ' 0', [ ( 'a', 'Other' ), ( 'z', 'Utah' ) ] ),
+        ]
+
+    dir = []
+    data = []
+    addr = 0
+    for tag, ind, val in tags:
+        if ind is None:
+            b = val.encode( 'utf-8' ) + FT
+        else:
+            b = ind.encode( 'ascii' ) + b''.join(
+                US + code.encode( 'ascii' ) + v.encode( 'utf-8' ) for code, v in val ) + FT
+        dir.append( '{}{:04d}{:05d}'.format( tag, len( b ), addr ).encode( 'ascii' ) )
+        data.append( b )
+        addr += len( b )
+
+    base = 24 + 12 * len( dir ) + 1
+    leader = '{:05d}cam a22{:05d} a 4500'.format( base + addr + 1, base ).encode( 'ascii' )
+    return b''.join( [ leader ] + dir + [ FT ] + data + [ RT ] )
+
+
+def write( path: str, count: int = COUNT ):
+    """Write <count> synthetic records to the file at <path>."""
+    with open( path, 'wb' ) as f:
+        for i in range( count ):
+            f.write( record( i ) )
+
+
+if __name__ == "__main__":
+
+    if len( sys.argv ) < 2:
+        sys.exit( 'usage: make_marc.py FILE [COUNT]' )
+    write( sys.argv[1], int( sys.argv[2] ) if len( sys.argv ) > 2 else COUNT )
+    sys.exit( 0 )
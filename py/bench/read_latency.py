@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              read_latency.py
+#  Description:       Latency of reading records from the catalog
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:44:05 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Latency of reading records from the catalog
+
+   Times db.mysql.MARC.read() one record at a time and read_many() in batches.  By default it runs
+   against the sqlite stand-in for MySQLdb (py/test/standin), loaded with <count> synthetic records
+   (see make_marc.py) plus notes/lcbib.xml and test.marc, and also reports how many statements each
+   read took.  With --mysql it reads records already in the catalog named in config.CREDENTIALS
+   instead, and writes nothing.
+
+     read_latency.py [--mysql] [--count N] [--reads N]
+
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+LIB  = os.path.join( HERE, '..', 'lib' )
+
+COUNT = 5000            # records loaded into the stand-in
+READS = 1000            # records read one at a time
+BATCH = 500             # records per read_many()
+
+
+def load_standin( path: str, count: int ) -> dict:
+    """Create a stand-in catalog in the file at <path> holding the sample records and return its
+    connection data.
+
+    """
+    sys.path.insert( 0, os.path.join( HERE, '..', 'test', 'standin' ) )
+    sys.path.append( LIB )
+    import MySQLdb
+    from MARC     import MARC, XML, Z392
+    from db.mysql import MARC as db
+
+    import make_marc
+
+    MySQLdb.create( 'bench', path )
+    conn_data = { 'host' : 'bench', 'user' : 'bench', 'pass' : '', 'db' : 'franklin' }
+
+    recs = list( Z392.iter_file( io.BytesIO( b''.join( make_marc.record( i )
+                                                       for i in range( count ) ) ) ) )
+    recs += XML.parse_file( os.path.join( HERE, '..', '..', 'notes', 'lcbib.xml' ) )
+    with open( os.path.join( HERE, '..', '..', 'test.marc' ) ) as f:
+        recs.append( MARC.record( f.read() ) )
+
+    catalog = db.MARC( dict( conn_data ) )
+    for i in range( 0, len( recs ), BATCH ):
+        for rec in recs[ i : i + BATCH ]:
+            rec.strip_900s()
+        catalog.create_many( recs[ i : i + BATCH ] )
+    catalog.close()
+    return conn_data
+
+
+def percentile( times: list, p: float ) -> float:
+    return sorted( times )[ min( len( times ) - 1, int( len( times ) * p ) ) ]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser( description = 'Time record reads.' )
+    parser.add_argument( '--mysql', action = 'store_true',
+                         help = 'read from the configured MySQL catalog instead of the stand-in' )
+    parser.add_argument( '--count', type = int, default = COUNT,
+                         help = 'records to load into the stand-in (default {})'.format( COUNT ) )
+    parser.add_argument( '--reads', type = int, default = READS,
+                         help = 'records to read one at a time (default {})'.format( READS ) )
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.mysql:
+        sys.path.append( LIB )
+        import config
+        conn_data = config.CREDENTIALS['database']['franklin']
+        log = None
+    else:
+        conn_data = load_standin( os.path.join( tmp.name, 'catalog.sqlite' ), args.count )
+        import MySQLdb
+        log = MySQLdb.log
+
+    from db.mysql import MARC as db
+    catalog = db.MARC( dict( conn_data ) )
+
+    total = catalog.db.single_value( 'SELECT COUNT(*) FROM MARC_leader;' )
+    ctl_nums = [ row[0] for row in catalog.db.row_array(
+        'SELECT ctl_num FROM MARC_leader LIMIT %s;', ( max( args.reads, BATCH ), ) ) ]
+    random.seed( 0 )
+    sample = [ random.choice( ctl_nums ) for i in range( args.reads ) ]
+
+    times = []
+    statements = []
+    for ctl_num in sample:
+        if log is not None: del log[:]
+        start = time.perf_counter()
+        catalog.read( ctl_num )
+        times.append( time.perf_counter() - start )
+        if log is not None: statements.append( len( log ) )
+
+    print( '{}: {} records'.format( 'MySQL' if args.mysql else 'sqlite stand-in', total ) )
+    print( '  read()       mean {:.3f} ms, median {:.3f} ms, p99 {:.3f} ms over {} reads'.format(
+        1000 * statistics.mean( times ), 1000 * statistics.median( times ),
+        1000 * percentile( times, 0.99 ), len( times ) ) )
+    if log is not None:
+        print( '               {} statements per read at most'.format( max( statements ) ) )
+
+    batch = ctl_nums[ :BATCH ]
+    start = time.perf_counter()
+    recs = catalog.read_many( batch )
+    elapsed = time.perf_counter() - start
+    print( '  read_many()  {} records in {:.1f} ms, {:.3f} ms per record'.format(
+        len( recs ), 1000 * elapsed, 1000 * elapsed / len( recs ) ) )
+
+    catalog.close()
+    db.driver.get_pool( conn_data ).close()
+    tmp.cleanup()
+    sys.exit( 0 )
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              record_memory.py
+#  Description:       Memory held per in-memory MARC record
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:41:34 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Memory held per in-memory MARC record
+
+   Reads records into a list and reports, by tracemalloc, the bytes allocated per record once
+   they're fully decoded: copies of the record in notes/lcbib.xml through the MARC-XML parser, and
+   synthetic records (see make_marc.py) through the Z39.2 parser.
+
+   To compare representations, point --lib at the py/lib of another checkout, e.g., from before
+   the __slots__ classes:
+
+     git worktree add /tmp/before 3296780^
+     record_memory.py --lib /tmp/before/py/lib
+
+     record_memory.py [--lib DIR] [--count N]
+
+"""
+
+import argparse
+import gc
+import io
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+
+SAMPLE = os.path.join( HERE, '..', '..', 'notes', 'lcbib.xml' )
+COUNT  = 20000
+
+
+def measure( make_records ) -> float:
+    """Return the bytes still allocated per record after <make_records>() returns a list of them."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        recs = make_records()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size / len( recs )
+
+
+def decoded( recs ) -> list:
+    """Force full decoding of each record, as a worker holding them would, and return them."""
+    out = []
+    for rec in recs:
+        rec.tags
+        rec.ctl_fields
+        out.append( rec )
+    return out
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser( description = 'Measure memory per MARC record.' )
+    parser.add_argument( '--lib', default = os.path.join( HERE, '..', 'lib' ),
+                         help = 'py/lib directory to import MARC from (default this checkout)' )
+    parser.add_argument( '--count', type = int, default = COUNT,
+                         help = 'records of each kind (default {})'.format( COUNT ) )
+    args = parser.parse_args()
+
+    sys.path.insert( 0, os.path.abspath( args.lib ) )
+    from MARC import XML, Z392
+
+    import make_marc
+
+    with open( SAMPLE, 'rb' ) as f:
+        sample = f.read()
+    xml_count = min( args.count, 2000 )         # each copy is parsed from scratch; keep it short
+    z392 = b''.join( make_marc.record( i ) for i in range( args.count ) )
+
+    print( 'MARC from {}'.format( os.path.abspath( args.lib ) ) )
+    print( '  MARC-XML (lcbib.xml)  {:8.0f} bytes/record'.format( measure(
+        lambda: decoded( rec for i in range( xml_count )
+                             for rec in XML.iter_records( io.BytesIO( sample ) ) ) ) ) )
+    print( '  Z39.2 (synthetic)     {:8.0f} bytes/record'.format( measure(
+        lambda: decoded( Z392.iter_file( io.BytesIO( z392 ) ) ) ) ) )
+
+    sys.exit( 0 )
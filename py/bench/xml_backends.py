@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              xml_backends.py
+#  Description:       Throughput of the MARC-XML parsing backends
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:40:41 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Throughput of the MARC-XML parsing backends
+
+   Replicates the record in notes/lcbib.xml into one SRU response of <count> records (50,000 by
+   default) in a temporary directory, checks that every backend in XML.BACKENDS builds the same
+   records from it, and times each of them over the whole file.  Backends whose parser isn't
+   installed (lxml) aren't in XML.BACKENDS and are skipped.
+
+     xml_backends.py [COUNT]
+
+"""
+
+import os
+import re
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( os.path.join( HERE, '..', 'lib' ) )
+
+from MARC import XML
+
+SAMPLE = os.path.join( HERE, '..', '..', 'notes', 'lcbib.xml' )
+COUNT  = 50000
+
+CTL_NUM = re.compile( r'(<controlfield tag="001">)[^<]*' )
+
+
+def replicate( path: str, count: int ):
+    """Write an SRU response holding <count> copies of the sample record to <path>.  Each copy gets
+    its own 001, so the copies can be told apart.
+
+    """
+    with open( SAMPLE, encoding = 'utf-8' ) as f:
+        sample = f.read()
+    start = sample.index( '<zs:record>' )
+    end   = sample.index( '</zs:record>' ) + len( '</zs:record>' )
+    head, record, tail = sample[ :start ], sample[ start:end ], sample[ end: ]
+    head = re.sub( r'<zs:numberOfRecords>\d+', '<zs:numberOfRecords>{}'.format( count ), head )
+
+    with open( path, 'w', encoding = 'utf-8' ) as f:
+        f.write( head )
+        for i in range( count ):
+            f.write( CTL_NUM.sub( r'\g<1>{:08d}'.format( i ), record ) )
+        f.write( tail )
+
+
+def content( rec ) -> tuple:
+    return ( rec.leader,
+             rec.ctl_fields,
+             [ ( t.tag, t.seq, t.ind, t.fields.fields ) for t in rec.tags ] )
+
+
+def main( count: int ):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join( d, 'lcbib-{}.xml'.format( count ) )
+        replicate( path, count )
+        print( '{} records, {:.1f} MB'.format( count, os.path.getsize( path ) / 1e6 ) )
+
+        # Every backend has to agree with the ElementTree fallback before its speed means anything.
+        reference = [ content( r ) for r in XML.iter_records( SAMPLE, 'etree' ) ]
+        for backend in XML.BACKENDS:
+            got = [ content( r ) for r in XML.iter_records( SAMPLE, backend ) ]
+            if got != reference:
+                sys.exit( '{}: records differ from etree'.format( backend ) )
+
+        for backend in XML.BACKENDS:
+            start = time.perf_counter()
+            n = 0
+            for rec in XML.iter_records( path, backend ):
+                n += 1
+            elapsed = time.perf_counter() - start
+            print( '  {:6} {} records in {:.2f} s, {:.0f} records/sec{}'.format(
+                backend, n, elapsed, n / elapsed,
+                ' (default)' if backend == XML.DEFAULT_BACKEND else '' ) )
+
+
+if __name__ == "__main__":
+
+    main( int( sys.argv[1] ) if len( sys.argv ) > 1 else COUNT )
+    sys.exit( 0 )
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              z392_read.py
+#  Description:       Throughput of the streaming Z39.2 reader
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:37:09 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Throughput of the streaming Z39.2 reader
+
+   Streams a Z39.2 dump through Z392.iter_file() twice: once touching only 001, 020, and 245, as
+   most consumers do, and once decoding every tag.  Without a file, a synthetic 100k-record dump is
+   generated in a temporary directory first.  Exits non-zero if the full decode falls short of
+   TARGET records/sec.
+
+     z392_read.py [FILE]
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'lib' ) )
+
+from MARC import Z392
+
+import make_marc
+
+TARGET = 10000          # records/sec, decoding every tag
+
+
+def run( path: str, touch ) -> tuple:
+    """Stream <path>, calling <touch> on each record.  Return ( records, seconds )."""
+    start = time.perf_counter()
+    n = 0
+    for rec in Z392.iter_file( path ):
+        touch( rec )
+        n += 1
+    return n, time.perf_counter() - start
+
+
+def some_tags( rec ):
+    rec.ctl_fields[ '001' ]
+    rec.find( '020' )
+    rec.find( '245' )
+
+def all_tags( rec ):
+    rec.tags
+
+
+def main( path: str ) -> bool:
+    print( '{}: {:.1f} MB'.format( path, os.path.getsize( path ) / 1e6 ) )
+    rate = 0
+    for name, touch in [ ( '001/020/245', some_tags ), ( 'every tag', all_tags ) ]:
+        n, elapsed = run( path, touch )
+        rate = n / elapsed
+        print( '  {:12} {} records in {:.2f} s, {:.0f} records/sec'.format(
+            name, n, elapsed, rate ) )
+
+    ok = rate >= TARGET
+    print( '  target {} records/sec: {}'.format( TARGET, 'met' if ok else 'MISSED' ) )
+    return ok
+
+
+if __name__ == "__main__":
+
+    if len( sys.argv ) > 1:
+        ok = main( sys.argv[1] )
+    else:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join( d, 'synthetic.mrc' )
+            make_marc.write( path )
+            ok = main( path )
+
+    sys.exit( 0 if ok else 1 )
@@ -9,25 +9,44 @@
 #-------------------------------------------------------------------------------
 """MARC 21 tags and records"""
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from sys import intern
 import re
 import hashlib
 
-class fieldlist( list ):
-    """List of fields in MARC 21 tag."""
+class fieldlist( object ):
+    """List of fields in MARC 21 tag.
+
+    Records are cached by the hundred thousand, so the representation is compact: subfield codes are
+    kept together in one string and their values in a parallel list, rather than as a list of
+    ( code, value ) pairs costing a tuple each.
+
+    """
+
+    __slots__ = ( 'codes', 'vals' )
 
     # MARC_record may occasionally override this.
     fld_delim = '|'
 
     def __init__( self ):
-        self.fields = []
+        self.codes = ''         # one character per subfield, in order
+        self.vals  = []         # values, parallel to self.codes
+
+
+    @property
+    def fields( self ) -> list:
+        """The subfields as a list of ( <code>, <val> ) tuples, in order.  This is a copy; modifying it
+        doesn't modify the field list.
+
+        """
+        return list( zip( self.codes, self.vals ) )
 
 
     def __len__( self ):
         """Override len() function to return the length of the included subfield list.
 
         """
-        return len( self.fields )
+        return len( self.vals )
 
 
     def __getitem__( self, code ):
@@ -35,15 +54,11 @@ class fieldlist( list ):
         value.
 
         """
-        val = None
-        for f in self.fields:
-            if f[ 0 ] == code:
-                val = f[ 1 ]
-                break
-        if val is None:
+        i = self.codes.find( code ) if len( code ) == 1 else -1
+        if i < 0 or self.vals[ i ] is None:
             raise KeyError( "subfield code '%s' not in '%s'"
-                            % ( code, self.__str__() ) )
-        return val
+                            % ( code, self.codes ) )
+        return self.vals[ i ]
 
 
     def __setitem__( self, code, val ):
@@ -52,67 +67,55 @@ class fieldlist( list ):
         isn't likely to do the right thing either since tags have imposed order.
 
         """
-        for i in range( len( self.fields ) ):
-            if self.fields[ i ][ 0 ] == code:
-                self.fields[ i ][ 1 ] = val
-                return
-        self.fields.append( code, val )
+        i = self.codes.find( code ) if len( code ) == 1 else -1
+        if i < 0:
+            self.append( code, val )
+        else:
+            self.vals[ i ] = val
 
 
-    class iterator():
-        def __init__( self, fields ):
-            self.fields = fields
-            self.pos = 0
-        def next( self ):
-            """Returns the tuple ( <code>, <val> ) in sequence."""
-            try:
-                val = self.fields[ self.pos ]
-                self.pos += 1
-            except IndexError:
-                raise StopIteration
-            return val
-        def __iter__( self ): return self;
-
-    def __iter__( self ): return self.iterator( self.fields )
+    def __iter__( self ):
+        """Iterate over the tuples ( <code>, <val> ) in sequence."""
+        return zip( self.codes, self.vals )
 
 
     def getall( self, code ):
         """Get all instances of a subfield code in order, as an ordered list of values."""
-        matches = [ f[1] for f in self.fields if f[0] == code ]
-        return matches
+        return [ v for c, v in zip( self.codes, self.vals ) if c == code ]
 
 
     def __str__( self ):
         """Return the canonical string representation of the field list."""
         return ''.join(
-            [ self.fld_delim + f[0] + f[1].encode( 'utf-8' )
-              for f in self.fields ]
+            [ self.fld_delim + f[0] + ( f[1] or '' )
+              for f in self ]
             ).strip()
 
 
     def append( self, code, val ):
         """Append the subfield <code> and <val> to the present list."""
-        self.fields.append( ( code, val ) )
+        self.codes += code
+        self.vals.append( val )
 
 
     def join( self, sep = ' ', fields = [] ):
-        """Return a string composed of subfield code values in <fields> (defaults to all codes in the tag)
-        joined by <sep>.  Undefined subfield codes are ignored.  Returns the empty string if no
-        subfields in <fields> (either default or explicit) are defined.
+        """Return a string composed of subfield code values in <fields> (defaults to all subfields in the
+        tag, in order) joined by <sep>.  Undefined subfield codes are ignored.  Returns the empty
+        string if no subfields in <fields> (either default or explicit) are defined.
 
         """
-        # if no subfield codes specified, construct a list of all
-        # subfield codes.
+        # If no subfield codes specified, join all the values.
         #
         if len( fields ) == 0:
-            fields = [ sf[ 0 ] for sf in self.fields ]
+            vals = [ v for v in self.vals if v is not None ]
 
         # Join values for all codes in the field list.
         #
-        vals = []
-        for code in fields:
-            try: vals.append( self[ code ] )
-            except KeyError: continue
+        else:
+            vals = []
+            for code in fields:
+                try: vals.append( self[ code ] )
+                except KeyError: continue
         if len( vals ) > 0:
             return sep.join( vals )
         else:
@@ -123,19 +126,24 @@ class fieldlist( list ):
 class tag( object ):
     """MARC 21 numbered tag"""
 
+    __slots__ = ( 'tag', 'seq', 'ind', 'fields' )
+
     def __init__( self,
                   tag = '000',
                   ind = '  ',
                   seq = 1,
                   str = '' ):
 
-        self.tag         = tag    # 3-digit MARC tag
-        self.seq         = seq    # position, for duplicate tags
-        self.ind         = ind    # 2-char MARC indicator group
+        # Tag names and indicators come from a small vocabulary, so each distinct one is stored
+        # once, in the interpreter's table of interned strings.
+        #
+        self.tag         = intern( tag )    # 3-digit MARC tag
+        self.seq         = seq              # position, for duplicate tags
+        self.ind         = intern( ind )    # 2-char MARC indicator group
         self.fields      = fieldlist()
 
         # This overrides the individual args.
-        if str is not '':
+        if str != '':
             self.parse_canonical_string( str )
 
 
@@ -161,8 +169,8 @@ class tag( object ):
         indicator, and fields as appropriate.
 
         """
-        self.tag   = s[:3]
-        self.ind   = s[4:6]
+        self.tag   = intern( s[:3] )
+        self.ind   = intern( s[4:6] )
 
         values     = s[7:].rstrip()
 
@@ -203,6 +211,68 @@ class tag( object ):
 
 
 
+class taglist( list ):
+    """List of the tags in a record.  It keeps an index from tag name to the tags having that name, in
+    list order, so that finding a tag doesn't mean scanning the whole record.  The index is built on
+    the first lookup and thrown away by any change to the list.  Changing the name or sequence of a
+    tag already in the list isn't noticed; call reindex() after doing that.
+
+    """
+
+    __slots__ = ( 'index', )
+
+    def __init__( self, *args ):
+        super( taglist, self ).__init__( *args )
+        self.index = None
+
+
+    def reindex( self ):
+        """Discard the index.  It is rebuilt on the next lookup."""
+        self.index = None
+
+
+    def by_tag( self ) -> dict:
+        """Return the index, building it if necessary."""
+        if self.index is None:
+            self.index = {}
+            for t in self:
+                try:
+                    self.index[ t.tag ].append( t )
+                except KeyError:
+                    self.index[ t.tag ] = [ t ]
+        return self.index
+
+
+    def find( self, key, seq = 1 ):
+        """Return the first tag named <key> having sequence number <seq>, or None."""
+        for t in self.by_tag().get( key, () ):
+            if t.seq == seq:
+                return t
+        return None
+
+
+    def filter( self, key ) -> list:
+        """Return a list of the tags named <key>, in list order."""
+        return list( self.by_tag().get( key, () ) )
+
+
+    # Every operation that changes the list invalidates the index.
+    #
+    def append( self, t ):       self.index = None; super( taglist, self ).append( t )
+    def extend( self, ts ):      self.index = None; super( taglist, self ).extend( ts )
+    def insert( self, i, t ):    self.index = None; super( taglist, self ).insert( i, t )
+    def remove( self, t ):       self.index = None; super( taglist, self ).remove( t )
+    def pop( self, i = -1 ):     self.index = None; return super( taglist, self ).pop( i )
+    def clear( self ):           self.index = None; super( taglist, self ).clear()
+    def sort( self, **kwargs ):  self.index = None; super( taglist, self ).sort( **kwargs )
+    def reverse( self ):         self.index = None; super( taglist, self ).reverse()
+    def __setitem__( self, i, t ): self.index = None; super( taglist, self ).__setitem__( i, t )
+    def __delitem__( self, i ):    self.index = None; super( taglist, self ).__delitem__( i )
+    def __iadd__( self, ts ):    self.index = None; return super( taglist, self ).__iadd__( ts )
+    def __imul__( self, n ):     self.index = None; return super( taglist, self ).__imul__( n )
+
+
+
 class record( object ):
 
     # Normally defers to MARC_tag.fld_delim but for output's sake etc. this takes precedence.
@@ -216,13 +286,22 @@ class record( object ):
         """
         self.leader     = '';   # MARC 21 leader
         self.ctl_fields = {}    # Control fields, 00X tags
-        self.tags       = []    # list of MARC_tag objects
+        self.tags       = []    # list of MARC_tag objects, as a taglist
         self.seqs       = {}    # tag-indexed sequence counters
 
         if data != '':
             self.parse_canonical_string( data )
 
 
+    @property
+    def tags( self ) -> taglist:
+        return self._tags
+
+    @tags.setter
+    def tags( self, val: list ):
+        self._tags = val if isinstance( val, taglist ) else taglist( val )
+
+
     def ctl_num( self ):
         """Return the record control number"""
         #   XXX: technically the control number namespace should be
@@ -247,18 +326,25 @@ class record( object ):
 
     def split_spec( self, spec ):
         """For the given spec string, return the tag and a field list."""
-        fields = []
-        map( fields.extend, spec[3:] )
-        return spec[:3], fields
+        return spec[:3], list( spec[3:] )
 
 
-    def update_timestamp( self ):
+    def update_timestamp( self, after: str = None ):
         """Update the 005 control field (Date and Time of Last Transaction) with the current date and time.
+        If <after> is given, it's an earlier 005 value, and the new one is made later than it even
+        if the clock says otherwise, so that every change to a record gets a distinct 005.
 
         """
-        self.ctl_fields[ '005' ] = datetime.now().strftime(
-            '%Y%m%d%H%M%S'
-            ) + '.0'
+        def stamp( t ):
+            return t.strftime( '%Y%m%d%H%M%S' ) + '.{}'.format( t.microsecond // 100000 )
+
+        s = stamp( datetime.now() )
+        if after is not None and s <= after:
+            try:
+                s = stamp( datetime.strptime( after, '%Y%m%d%H%M%S.%f' ) + timedelta( milliseconds = 100 ) )
+            except ValueError:
+                pass
+        self.ctl_fields[ '005' ] = s
 
 
     def parse_canonical_string( self, s ):
@@ -271,6 +357,10 @@ class record( object ):
 
         for line in lines:
 
+            # Skip blank lines, e.g., after a trailing newline.
+            if line.strip() == '':
+                continue
+
             # Initialize sequence number if necessary.
             try:
                 self.seqs[ line[:3] ] += 1
@@ -297,10 +387,7 @@ class record( object ):
         if no such tag is in the record.
 
         """
-        for t in self.tags:
-            if t.tag == key and t.seq == seq:
-                return t
-        return None
+        return self.tags.find( key, seq )
 
 
     def filter( self, key ):
@@ -308,19 +395,13 @@ class record( object ):
         objects.  Returns empty list if no such tag(s) are in the record.
 
         """
-        results = []
-        for t in self.tags:
-            if t.tag == key:
-                results.append( t )
-        return results
+        return self.tags.filter( key )
 
 
     def strip_900s( self ):
         """Remove all 9xx tags.  These are internal Library of Congress tags. """
-        T900_regex = re.compile( '^9[\digit]{2}$' )
-        for t in self.tags:
-            if T900_regex.match( t.tag ):
-                self.tags.remove( t )
+        T900_regex = re.compile( r'^9\d{2}$' )
+        self.tags[:] = [ t for t in self.tags if not T900_regex.match( t.tag ) ]
 
 
     def __str__( self ):
@@ -329,17 +410,115 @@ class record( object ):
         delimiter.  Individual tags are separated by the newline.
 
         """
-        tag.fld_delim = MARC_record.fld_delim
-        s = 'LDR    ' + self.leader + "\n"
+        fieldlist.fld_delim = record.fld_delim
+        lines = [ 'LDR    ' + self.leader ]
         for f in sorted( self.ctl_fields.keys() ):
-            s += "%03s    %s\n" % ( f, self.ctl_fields[ f ] )
-        for t in self.tags:
-            s += t.__str__() + "\n"
-        return s.rstrip()
+            lines.append( "%03s    %s" % ( f, self.ctl_fields[ f ] ) )
+        for t in sorted( self.tags, key = lambda t: ( t.tag, t.seq ) ):
+            lines.append( t.__str__() )
+        return "\n".join( lines ).rstrip()
+
+
+    def digest( self, with_900s: bool = True ) -> str:
+        """Return a digest of the content of the record as 32 hex digits.  Records with the same content
+        have the same digest however their tags are ordered.  Things that change without the
+        content changing are left out: the 005 (Date and Time of Last Transaction) and the record
+        length and base address in the leader, which depend on how the record is serialized.
+        Unless <with_900s>, so are the 9xx tags, as they are when the record is stored.
 
+        The leader, control fields, and tags are fed to the hash one at a time, separated by the
+        Z39.2 delimiters, rather than formatted into one big string first.
+
+        """
+        h = hashlib.blake2b( digest_size = 16 )
+        leader = self.leader or ''
+        h.update( ( leader[ 5:12 ] + leader[ 17: ] ).encode( 'utf-8' ) )
+        for f in sorted( self.ctl_fields.keys() ):
+            if f == '005': continue
+            h.update( ( '\x1e' + f + ( self.ctl_fields[ f ] or '' ) ).encode( 'utf-8' ) )
+        for t in sorted( self.tags, key = lambda t: ( t.tag, t.seq ) ):
+            if not with_900s and t.tag[ 0 ] == '9': continue
+            h.update( ( '\x1e' + t.tag + ( t.ind + '  ' )[ 0:2 ] +
+                        ''.join( [ '\x1f' + code + ( val or '' ) for code, val in t.fields ] ) ).
+                      encode( 'utf-8' ) )
+        return h.hexdigest()
+
+
+    def diff( self, edited ) -> list:
+        """Return the changes that turn this record into <edited>, as a list of operations on the rows
+        a record is stored as.  Each operation is a tuple whose first element names it:
+
+            ( 'update_leader',        val )
+            ( 'insert_control_field', tag, val )
+            ( 'update_control_field', tag, val )
+            ( 'delete_control_field', tag )
+            ( 'insert_indicators',    tag, seq, ind )
+            ( 'update_indicators',    tag, seq, ind )
+            ( 'delete_indicators',    tag, seq )
+            ( 'insert_field',         tag, seq, code, pos, val )
+            ( 'update_field',         tag, seq, code, pos, val )
+            ( 'delete_field',         tag, seq, code, pos )
+
+        Tags are matched by tag and sequence number, and subfields by position (counting from 1)
+        within their tag.  A subfield whose code changes is deleted and inserted again.  Deletions
+        come first.  The list is empty if the records are the same.
+
+        """
+        deletes = []
+        changes = []
+
+        if edited.leader != self.leader:
+            changes.append( ( 'update_leader', edited.leader ) )
+
+        for t in sorted( self.ctl_fields.keys() ):
+            if t not in edited.ctl_fields:
+                deletes.append( ( 'delete_control_field', t ) )
+            elif edited.ctl_fields[ t ] != self.ctl_fields[ t ]:
+                changes.append( ( 'update_control_field', t, edited.ctl_fields[ t ] ) )
+        for t in sorted( edited.ctl_fields.keys() ):
+            if t not in self.ctl_fields:
+                changes.append( ( 'insert_control_field', t, edited.ctl_fields[ t ] ) )
+
+        def ind( t ):
+            return ( t.ind + '  ' )[ 0:2 ]
+
+        old = { ( t.tag, t.seq ) : t for t in self.tags }
+        new = { ( t.tag, t.seq ) : t for t in edited.tags }
+
+        for key in sorted( old.keys() ):
+            t = old[ key ]
+            if key not in new:
+                deletes.append( ( 'delete_indicators', ) + key )
+                for pos, f in enumerate( t.fields ):
+                    deletes.append( ( 'delete_field', ) + key + ( f[0], pos + 1 ) )
+                continue
 
-    def digest( self ) -> str:
-        return hashlib.md5( self.__str__() ).hexdigest()
+            e = new[ key ]
+            if ind( e ) != ind( t ):
+                changes.append( ( 'update_indicators', ) + key + ( ind( e ), ) )
+            before = t.fields.fields
+            after  = e.fields.fields
+            for pos in range( max( len( before ), len( after ) ) ):
+                b = before[ pos ] if pos < len( before ) else None
+                a = after[ pos ]  if pos < len( after )  else None
+                if b is not None and ( a is None or a[0] != b[0] ):
+                    deletes.append( ( 'delete_field', ) + key + ( b[0], pos + 1 ) )
+                    b = None
+                if a is None:
+                    continue
+                if b is None:
+                    changes.append( ( 'insert_field', ) + key + ( a[0], pos + 1, a[1] ) )
+                elif a[1] != b[1]:
+                    changes.append( ( 'update_field', ) + key + ( a[0], pos + 1, a[1] ) )
+
+        for key in sorted( new.keys() ):
+            if key not in old:
+                e = new[ key ]
+                changes.append( ( 'insert_indicators', ) + key + ( ind( e ), ) )
+                for pos, f in enumerate( e.fields ):
+                    changes.append( ( 'insert_field', ) + key + ( f[0], pos + 1, f[1] ) )
+
+        return deletes + changes
 
 
     class iterator():
@@ -355,20 +534,16 @@ class record( object ):
             #
             # Yes, I'm going to hell for this.  This is a list of
             # indices. It starts as a simple range over all the indices,
-            # list-comprehensively, then sorted according to the tag
-            # values combined with sequence numbers as in TTTS.
+            # then sorted according to the tag values combined with
+            # sequence numbers as in ( TTT, S ).
             #
 
             self.indices = sorted(
-                [ i for i in xrange( len( self.rec.tags ) ) ],
-                key = lambda i: int(
-                    self.rec.tags[i].tag + '{:d}'.format(
-                        self.rec.tags[i].seq
-                        )
-                    )
+                range( len( self.rec.tags ) ),
+                key = lambda i: ( self.rec.tags[i].tag, self.rec.tags[i].seq )
                 )
 
-        def next( self ):
+        def __next__( self ):
             try:
                 # Double-dereference the tags
                 t = self.rec.tags[ self.indices[ self.i ] ]
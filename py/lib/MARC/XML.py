@@ -12,6 +12,13 @@
 import os
 import sys
 import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
+
+# lxml is optional.  If it's installed, it's the fastest backend; otherwise expat is.
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
 
 from MARC import MARC
 
@@ -19,6 +26,53 @@ from MARC import MARC
 def tag( suffix ): return '{http://www.loc.gov/zing/srw/}' + suffix
 def ns( suffix ):  return '{http://www.loc.gov/MARC21/slim}' + suffix
 
+MARC_NS    = 'http://www.loc.gov/MARC21/slim'
+CHUNK_SIZE = 1 << 16        # bytes fed at a time to the event-driven backends
+
+
+def parse_record( data: ET.Element ) -> MARC.record:
+    """Parse a single MARC-XML <record> element representing an entire MARC21 record and return a new
+    MARC.record object embodying it.  The element's own namespace (the MARC21 slim namespace, or none
+    at all) qualifies its children.
+
+    """
+    mrec = MARC.record()
+    if data is None: return mrec
+    prefix = data.tag[ : -len( 'record' ) ]
+
+    # Find the (hopefully single) leader element.
+    leader = data.find( prefix + 'leader' )
+    if leader is not None:
+        mrec.leader = leader.text
+
+    # Find all the control (00x) fields.
+    for f in data.iterfind( prefix + 'controlfield' ):
+        mrec.ctl_fields[ f.attrib['tag'] ] = f.text
+
+    # Find all the data tags.
+    for f in data.iterfind( prefix + 'datafield' ):
+
+        # Initialize or increment the sequence count for this tag.
+        #
+        tag_name = f.attrib[ 'tag' ]
+        try:
+            mrec.seqs[ tag_name ] += 1
+        except KeyError:
+            mrec.seqs[ tag_name ] = 1
+
+        # Tag, sequence, and indicators.
+        mtag = MARC.tag( tag = tag_name,
+                         ind = f.attrib['ind1'] + f.attrib['ind2'],
+                         seq = mrec.seqs[ tag_name ] )
+
+        # Subfields.
+        for sf in f:
+            mtag.fields.append( sf.attrib['code'], sf.text )
+
+        mrec.tags.append( mtag )
+
+    return mrec
+
 
 def parse_tree( root: ET ) -> list:
     """Return a list of MARC record objects contained in the ElementTree <root>.  Ostensibly this should
@@ -30,58 +84,195 @@ def parse_tree( root: ET ) -> list:
 
     if root is None: return records
 
-    # Parse a single XML element representing an entire MARC21 record and return a new MARC.record
-    # object embodying it.  Returns None on error.
+    reclist = root.find( tag('records') )
+    if reclist is None: return records
+
+    # Not really accustomed to the MARC21 namespace prefixes, but this is how it seems to be.
+    for rec in reclist:
+        records.append( parse_record( rec.find( tag('recordData') ).find( ns('record') ) ) )
+
+    return records
+
+
+def iter_records( source, backend: str = None ):
+    """Generate the MARC.record objects in the MARC-XML file <source>, which may be a path or a file
+    object.  Both SRU responses and bare <collection> files are understood; any MARC21 <record>
+    element is converted wherever it appears, and memory stays flat no matter how large the file is.
+
+    <backend> names one of the BACKENDS.  By default the fastest one available is used.
+
+    """
+    if backend is None: backend = DEFAULT_BACKEND
+    return BACKENDS[ backend ]( source )
+
+
+def iter_etree( source ):
+    """ElementTree backend for iter_records().  Each record is converted as soon as its end tag is
+    parsed, and everything parsed so far is then cleared from the tree.
+
+    """
+    # Keep the open elements on a stack so that, once a record is converted, everything parsed so far
+    # can be cleared out of its ancestors.  (Clearing only the root, as mds_parse.py does, would leave
+    # converted records hanging off a detached SRU <records> element.)
     #
-    def parse_record( rec: ET ) -> MARC.record:
-        mrec = MARC.record()
+    stack = []
+    for ev, elt in ET.iterparse( source, events = ( 'start', 'end' ) ):
+        if ev == 'start':
+            stack.append( elt )
+            continue
+        stack.pop()
+        if is_record( elt.tag ):
+            yield parse_record( elt )
+            elt.clear()
+            for e in stack:
+                e.clear()
 
-        # Not really accustomed to the MARC21 namespace prefixes, but this is how it seems to be.
-        data = rec.find( tag('recordData') ).find( ns('record') )
-        if data is None: return mrec
 
-        # Find the (hopefully single) leader element.
-        mrec.leader = data.find( ns('leader') ).text
+class record_builder( object ):
+    """Parser target that builds MARC.record objects directly from start, end, and character data
+    events, without building an element tree.  It implements the target interface of ElementTree
+    parsers, and its methods double as expat handlers.  Completed records accumulate in
+    self.records until the caller takes them.
 
-        # Find all the control (00x) fields.
-        ctl_fields = data.findall( ns('controlfield') )
-        if ctl_fields is not None:
-            for f in ctl_fields:
-                mrec.ctl_fields[ f.attrib['tag'] ] = f.text
+    Element names may be qualified either as {uri}local (ElementTree) or as uri}local (expat with '}'
+    as the namespace separator).
 
-        # Find all the data tags.
-        data_fields = data.findall( ns('datafield') )
-        if data_fields is not None:
-            for f in data_fields:
+    """
 
-                # Initialize or increment the sequence count for this tag.
-                #
-                tag_name = f.attrib[ 'tag' ]
-                try:
-                    mrec.seqs[ tag_name ] += 1
-                except KeyError:
-                    mrec.seqs[ tag_name ] = 1
+    def __init__( self ):
+        self.records = []
+        self.rec     = None     # record being built
+        self.tag     = None     # data tag being built
+        self.attrib  = None     # attributes of the element whose text is being collected
+        self.text    = None     # character data of that element, or None if not collecting
+        self.names   = {}       # qualified element name -> local name, memoized
 
-                # Tag, sequence, and indicators.
-                mtag = MARC.tag( tag = tag_name,
-                                 ind = f.attrib['ind1'] + f.attrib['ind2'],
-                                 seq = mrec.seqs[ tag_name ] )
+    def local( self, name: str ) -> str:
+        """Return the local part of a qualified element name, or None if the element is in some
+        namespace other than MARC21's.  Names repeat endlessly, so the answers are memoized.
 
-                # Subfields.
-                for sf in f:
-                    mtag.fields.append( sf.attrib['code'], sf.text )
+        """
+        try:
+            return self.names[ name ]
+        except KeyError:
+            uri, sep, local = name.rpartition( '}' )
+            if uri.lstrip( '{' ) not in ( MARC_NS, '' ):
+                local = None
+            self.names[ name ] = local
+            return local
 
-                mrec.tags.append( mtag )
+    def start( self, name: str, attrib: dict ):
+        local = self.local( name )
+        if self.rec is None:
+            if local == 'record':
+                self.rec = MARC.record()
+        elif local == 'datafield':
+            tag_name = attrib[ 'tag' ]
+            try:
+                self.rec.seqs[ tag_name ] += 1
+            except KeyError:
+                self.rec.seqs[ tag_name ] = 1
+            self.tag = MARC.tag( tag = tag_name,
+                                 ind = attrib['ind1'] + attrib['ind2'],
+                                 seq = self.rec.seqs[ tag_name ] )
+        else:
+            self.attrib = attrib
+            self.text   = []
 
-        return mrec
+    def data( self, text: str ):
+        if self.text is not None:
+            self.text.append( text )
 
-    reclist = root.find( tag('records') )
-    if reclist is None: return records
+    def end( self, name: str ):
+        if self.rec is None: return
+        local = self.local( name )
 
-    for rec in reclist:
-        records.append( parse_record( rec ) )
+        # Empty elements have no text, same as in an element tree.
+        text = ''.join( self.text ) if self.text else None
+        self.text = None
 
-    return records
+        if local == 'subfield':
+            self.tag.fields.append( self.attrib['code'], text )
+        elif local == 'datafield':
+            self.rec.tags.append( self.tag )
+            self.tag = None
+        elif local == 'controlfield':
+            self.rec.ctl_fields[ self.attrib['tag'] ] = text
+        elif local == 'leader':
+            self.rec.leader = text
+        elif local == 'record':
+            self.records.append( self.rec )
+            self.rec = None
+
+    def close( self ):
+        return self.records
+
+
+def feed_chunks( source, feed, builder: record_builder ):
+    """Read <source> in chunks, pass each to the parser's <feed> function, and generate the records
+    the <builder> completes along the way.
+
+    """
+    if isinstance( source, ( str, bytes, os.PathLike ) ):
+        with open( source, 'rb' ) as f:
+            yield from feed_chunks( f, feed, builder )
+        return
+
+    while True:
+        chunk = source.read( CHUNK_SIZE )
+        if not chunk: break
+        feed( chunk )
+        if builder.records:
+            yield from builder.records
+            builder.records.clear()
+
+
+def iter_expat( source ):
+    """expat backend for iter_records(), driving a record_builder from expat's handlers."""
+    builder = record_builder()
+    parser = expat.ParserCreate( namespace_separator = '}' )
+    parser.buffer_text          = True
+    parser.StartElementHandler  = builder.start
+    parser.EndElementHandler    = builder.end
+    parser.CharacterDataHandler = builder.data
+
+    yield from feed_chunks( source, parser.Parse, builder )
+    parser.Parse( b'', True )
+    yield from builder.records
+
+
+def iter_lxml( source ):
+    """lxml backend for iter_records().  lxml filters the events down to MARC21 <record> end tags
+    before they ever reach Python, and its elements support the same find() interface as
+    ElementTree's, so each record is converted by parse_record().  Converted records and their
+    preceding siblings, at every level, are then deleted from the tree.
+
+    """
+    for ev, elt in lxml.etree.iterparse( source,
+                                         events = ( 'end', ),
+                                         tag = ( ns( 'record' ), 'record' ),
+                                         huge_tree = True ):
+        yield parse_record( elt )
+        elt.clear()
+        for e in [ elt ] + list( elt.iterancestors() ):
+            while e.getprevious() is not None:
+                del e.getparent()[ 0 ]
+
+
+# Backends for iter_records() by name.  ElementTree is always available as a fallback.
+BACKENDS = {
+    'etree' : iter_etree,
+    'expat' : iter_expat,
+    }
+if lxml is not None:
+    BACKENDS[ 'lxml' ] = iter_lxml
+
+DEFAULT_BACKEND = 'lxml' if lxml is not None else 'expat'
+
+
+def is_record( name: str ) -> bool:
+    """True if the qualified element name is a MARC21 <record>, as opposed to, e.g., the SRU wrapper."""
+    return name == ns( 'record' ) or name == 'record'
 
 
 # @todo should probably figure out how to merge with the file-based function, since the distinction
@@ -96,10 +287,8 @@ def parse_str( s: str ) -> list:
 
 
 def parse_file( path: str ) -> list:
-    """Open the named file and attempt to parse its contents as XML. Returns an ElementTruee on success
-    and None on failure.
+    """Open the named file and parse its contents as MARC-XML.  Returns the list of records it
+    contains, which is empty if there are none.  See iter_records().
 
     """
-    tree = ET.parse( path )
-    if tree is None: return None
-    return parse_tree( tree.getroot() )
+    return list( iter_records( path ) )
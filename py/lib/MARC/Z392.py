@@ -19,165 +19,485 @@
 
 """
 
+import array
 import base64
+import mmap
+import os
+import struct
+import sys
 from MARC import MARC
+from misc import atomic_file
 
 FT = '\x1E'        # field terminator   : after each tag data sequence
 US = '\x1F'        # unit separator     : between tag subfields
 RT = '\x1D'        # record terminator  : after the record
 
+FT_byte = ord( FT )
+
+DIR_ENTRY_LEN = 12          # MARC 21 directory entry: 3-digit tag, 4-digit length, 5-digit address
+CHUNK_SIZE    = 1 << 20     # bytes read at a time when streaming a file
+INDEX_SUFFIX  = '.idx'      # sidecar offset index written next to a mapped file
+INDEX_MAGIC   = b'Z392IDX2'
+INDEX_HEADER  = struct.Struct( '<8sQqQ' )   # magic, file size, file mtime in ns, record count
+
+UNICODE = 'a'               # Leader/09, character coding scheme, for UCS/Unicode.  Blank is MARC-8.
+
+
+class encoding_error( ValueError ):
+    """ Record is in a character coding scheme other than Unicode, i.e., MARC-8 """
+    pass
+
 
 def parse_str( s: str ) -> MARC.record:
     """Parse <s> as a Z39.2 wire protocol datagram and return the equivalent MARC.record.  Returns None
-    if an error occurs.
+    if an error occurs.  Directory lengths and addresses count bytes, not characters, so the string
+    is encoded as UTF-8 and handed to parse_bytes().
 
     """
-    if len( s ) < 24: return None
-    rec = MARC.record()
-    rec.leader = s[:24]
+    return parse_bytes( s.encode( 'utf-8' ) )
 
-    #-----------------------------------------------------------------
-    # Parse the directory segment, returning a list of dictionaries
-    # with the keys
-    #
-    #   tag:  the tag name
-    #   len:  length of the segment data, including the terminator
-    #   addr: offset from the beginning of the data segment.
+
+def parse_bytes( b ) -> MARC.record:
+    """Parse the bytes-like object <b> as a Z39.2 wire protocol datagram and return the equivalent
+    MARC.record.  Returns None if an error occurs.
+
+    Only Unicode records (Leader/09 'a') are read.  MARC-8 would come out garbled if it were decoded
+    as UTF-8, so for any other coding scheme encoding_error is raised instead.
+
+    The record length (Leader/00-04) and base address of data (Leader/12-16) locate the record and
+    its data segment, and fields are sliced out of a memoryview over <b> without copying.  Nothing
+    but the leader and the directory is decoded here; see lazy_record.
+
+    """
+    mv = memoryview( b )
+    if len( mv ) < 24: return None
+    leader = str( mv[:24], 'ascii', 'replace' )
+    if leader[9] != UNICODE:
+        raise encoding_error( 'Leader/09 is {!r}, not Unicode'.format( leader[9] ) )
+
+    # Honour the record length, but don't trust it beyond the end of the buffer.
+    try:
+        length = min( int( leader[0:5] ), len( mv ) )
+    except ValueError:
+        length = len( mv )
+
+    # The base address is the offset of the data segment, just past the directory's field
+    # terminator.  If it's garbled, find the terminator instead.
     #
-    # Argument <s> is the Z39.2 string with the leader removed
+    try:
+        base = int( leader[12:17] )
+        if base <= 24 or base > length or mv[ base - 1 ] != FT_byte:
+            raise ValueError
+    except ValueError:
+        base = bytes( mv[ :length ] ).find( FT_byte, 24 ) + 1
+        if base <= 0: return None
+
+    dir = parse_directory( bytes( mv[ 24 : base - 1 ] ) )
+    if len( dir ) == 0: return None
+
+    return lazy_record( leader, mv[ :length ], base, dir )
+
+
+def parse_directory( s: bytes ) -> list:
+    """Parse the directory segment <s> of a Z39.2 record, without the leader and without its field
+    terminator.  Return a list of ( tag, len, addr ) tuples where
+
+      tag:  the tag name
+      len:  length in bytes of the segment data, including the terminator
+      addr: offset in bytes from the beginning of the data segment.
+
+    Entries are located by offset arithmetic rather than by re-slicing the remaining directory, so
+    the cost is linear in the number of entries.  If an entry is malformed, return what we have.
+
+    """
+    dir = []
+
+    # Z39.2 specifies a 3-digit tag.  But the directory entry field widths are specified in Leader/20
+    # and Leader/21.  For MARC 21 these are "hard wired" to 4-digit lengths and 5-digit addresses.
     #
-    def parse_directory( self, s ) -> list:
-        dir = []
+    try:
+        for i in range( 0, len( s ) - DIR_ENTRY_LEN + 1, DIR_ENTRY_LEN ):
+            dir.append( ( s[ i : i + 3 ].decode( 'ascii' ),    # 3-digit tag
+                          int( s[ i + 3 : i + 7 ] ),           # 4-digit length
+                          int( s[ i + 7 : i + 12 ] ) ) )       # 5-digit address
+    except ValueError:
+        pass
+    return dir
+
 
-        # If any of the slicing goes bad during the parsing, return what we have.
+class lazy_record( MARC.record ):
+    """MARC.record backed by a Z39.2 buffer.  Tags are decoded from the buffer the first time they are
+    touched, so a caller that only reads 001, 020, and 245 never pays to decode the rest of the
+    record.  Data is decoded as UTF-8; parse_bytes() doesn't hand out MARC-8 records.
+
+    """
+
+    def __init__( self, leader: str, data: memoryview, base: int, dir: list ):
+        """<data> is the whole record, <base> the offset of its data segment, and <dir> its directory
+        as produced by parse_directory().
+
+        """
+        super( lazy_record, self ).__init__()
+        self.leader      = leader
+        self.data        = data
+        self.base        = base
+        self._ctl_fields = None
+
+        # Undecoded directory entries ( tag, seq, len, addr ), in directory order, and the tags
+        # decoded from them so far, keyed by ( tag, seq ).
         #
-        try:
+        self.pending = []
+        self.decoded = {}
+        for t, l, a in dir:
+            if t[0:2] != '00':
+                try:
+                    self.seqs[ t ] += 1
+                except KeyError:
+                    self.seqs[ t ] = 1
+            self.pending.append( ( t, self.seqs.get( t, 0 ), l, a ) )
 
-            # Z39.2 specifies a 3-digit tag.  But the directory entry field widths are specified in
-            # Leader/20 and Leader/21.  For MARC 21 these are "hard wired" to 4-digit lengths and
-            # 5-digit addresses.
-            #
-            while s[0] != FT:
-                t = s[0:3]               # 3-digit tag
-                l = int( s[3:7]  )       # 4-digit length
-                a = int( s[7:12] )       # 5-digit address
-
-                # Save the directory entry and strip 12 characters from the front of the data
-                # string.
-                #
-                dir.append( { 'tag':t, 'len':l, 'addr':a } );
-                s = s[12:]
-
-        except IndexError:
+
+    def field_str( self, l: int, a: int ) -> str:
+        """Decode the field data at address <a> having length <l>, less its field terminator."""
+        start = self.base + a
+        return str( self.data[ start : start + l - 1 ], 'utf-8', 'replace' )
+
+
+    def decode_tag( self, t: str, seq: int, l: int, a: int ) -> MARC.tag:
+        """Return the tag object for a directory entry, decoding it if it hasn't been already."""
+        try:
+            return self.decoded[ ( t, seq ) ]
+        except KeyError:
             pass
-        return dir
+        text = self.field_str( l, a )
+        mtag = MARC.tag( tag = t, ind = text[0:2], seq = seq )
 
+        # Split the fields by the unit separator.  First character of each list element is the
+        # subfield code.
+        #
+        for f in text[2:].split( US )[1:]:
+            if f != '':
+                mtag.fields.append( f[0], f[1:] )
+        self.decoded[ ( t, seq ) ] = mtag
+        return mtag
 
-    # Get the directory.
-    dir = parse_directory( s[24:] )
-    if len( dir ) == 0: return None
 
-    #-----------------------------------------------------------------
-    # Use the directory to parse the data segment.
-    #
-    #   s        The data segment -- the Z39.2 string with the 24
-    #            characters of the leader and the directory (with its
-    #            field terminator) removed
-    #
-    #   dir      Representation of the directory as produced by
-    #            parse_directory
+    # Control fields are few and short, so the first access decodes all of them.  Any access to the
+    # full tag list decodes every tag and releases the buffer.
     #
-    def parse_data( s: str, dir: list ):
-        for d in dir:
-            try:
+    @property
+    def ctl_fields( self ) -> dict:
+        if self._ctl_fields is None:
+            self._ctl_fields = {}
+            for t, seq, l, a in self.pending:
+                if t[0:2] == '00':
+                    self._ctl_fields[ t ] = self.field_str( l, a )
+        return self._ctl_fields
+
+    @ctl_fields.setter
+    def ctl_fields( self, val: dict ):
+        self._ctl_fields = val
+
+
+    @property
+    def tags( self ) -> list:
+        if self.pending is not None:
+            self.ctl_fields
+            self._tags.extend( [ self.decode_tag( *d ) for d in self.pending if d[0][0:2] != '00' ] )
+            self.pending = None
+            self.decoded = None
+            self.data    = None
+        return self._tags
+
+    @tags.setter
+    def tags( self, val: list ):
+        MARC.record.tags.fset( self, val )
+
+
+    def find( self, key, seq = 1 ):
+        if self.pending is None:
+            return super( lazy_record, self ).find( key, seq )
+        for d in self.pending:
+            if d[0] == key and d[1] == seq:
+                return self.decode_tag( *d )
+        return None
+
+
+    def filter( self, key ):
+        if self.pending is None:
+            return super( lazy_record, self ).filter( key )
+        return [ self.decode_tag( *d ) for d in self.pending if d[0] == key ]
+
+
+def iter_file( source, chunk_size: int = CHUNK_SIZE, on_reject = None ):
+    """Generate the MARC.record objects encoded in the Z39.2 file <source>, which may be a path or a
+    file object opened in binary mode.  The file is read in chunks of <chunk_size> bytes and split on
+    the record terminator, so memory use is bounded by the chunk size plus the largest record no
+    matter how large the file is.  Records that cannot be parsed are skipped.  So are records that
+    aren't in Unicode, but if <on_reject> is given, it's called for each of those with the record's
+    bytes and the encoding_error.
 
-                # Slice the data based on the directory entry.
-                data = s[ d['addr'] : d['addr'] + d['len'] - 1 ]
-
-                # Control fields don't get further parsed.
-                if d['tag'][0:2] == '00':
-                    rec.ctl_fields[ d['tag'] ] = data
-                    continue
-
-                # Make a tag and store the tag name, indicator, and
-                # subfields
-                #
-                else:
-                    t = MARC.tag()
-                    t.tag = d['tag']
-                    t.ind = data[0:2]
-
-                    # Split the fields by the unit separator.  First
-                    # character of each list element is the subfield
-                    # code.
-                    #
-                    fields = data[3:].split( US )
-                    for f in fields:
-                        t.fields.append( f[0], f[1:] )
-                    rec.tags.append( t )
-
-            except:
-                pass
+    """
+    if isinstance( source, ( str, bytes, os.PathLike ) ):
+        with open( source, 'rb' ) as f:
+            yield from iter_file( f, chunk_size, on_reject )
+        return
 
+    def parse( data ):
+        try:
+            return parse_bytes( data.lstrip( b'\r\n' ) )
+        except encoding_error as e:
+            if on_reject is not None:
+                on_reject( data, e )
+            return None
+
+    RT_bytes = RT.encode( 'ascii' )
+    pending = b''
+    while True:
+        chunk = source.read( chunk_size )
+        if not chunk: break
+
+        # Everything up to the last record terminator in the buffer is a run of complete records.
+        # The remainder is the front part of a record continued in the next chunk.
+        #
+        buf = pending + chunk
+        last = buf.rfind( RT_bytes )
+        if last < 0:
+            pending = buf
+            continue
+        pending = buf[ last + 1: ]
+        for data in buf[ :last ].split( RT_bytes ):
+            rec = parse( data )
+            if rec is not None: yield rec
+
+    # A trailing record without its terminator is still worth a try.
+    if pending.strip():
+        rec = parse( pending )
+        if rec is not None: yield rec
+
+
+class mapped_file( object ):
+    """Random access by control number to the records in a Z39.2 file.  The file is memory-mapped and
+    indexed by MARC.record.ctl_num(); looking a record up slices it straight out of the map and
+    returns it as a lazy_record, so nothing is read or decoded until it's touched.
+
+    The index maps each control number to the ( offset, length ) of its record and is saved in a
+    sidecar file next to the dump.  The sidecar remembers the size and modification time of the file
+    it describes, and is reused as long as those still match, so only the first run against a given
+    dump pays for the scan.  Records without a control number, and MARC-8 records, are not indexed.
+    If a control number repeats, the first record having it wins.
+
+      with Z392.mapped_file( 'lc.mrc' ) as f:
+          rec = f[ 'DLC17211323' ]
 
-    # Find the field terminator after the directory and parse the rest of it as tag data, accordgin
-    # to the directory.
-    #
-    base_idx = s.index( FT )
-    parse_data( rec, s[base_idx + 1:], dir )
+    """
 
-    return rec
+    def __init__( self, path: str, index_path: str = None ):
+        self.path       = path
+        self.index_path = index_path if index_path is not None else path + INDEX_SUFFIX
+        self.file       = open( path, 'rb' )
+        stat            = os.fstat( self.file.fileno() )
+        self.stamp      = ( stat.st_size, stat.st_mtime_ns )
+
+        # mmap refuses to map an empty file.
+        if stat.st_size > 0:
+            self.map = mmap.mmap( self.file.fileno(), 0, access = mmap.ACCESS_READ )
+        else:
+            self.map = b''
+
+        self.index = self.load_index()
+        if self.index is None:
+            self.index = self.build_index()
+            self.save_index()
+
+
+    def build_index( self ) -> dict:
+        """Scan the whole file and return a dictionary mapping control numbers to ( offset, length )."""
+        index = {}
+        view = memoryview( self.map )
+        pos = 0
+        end = len( self.map )
+        RT_bytes = RT.encode( 'ascii' )
+        while pos < end:
+            stop = self.map.find( RT_bytes, pos )
+            if stop < 0: stop = end
+
+            # Skip line breaks some tools put between records.
+            while pos < stop and self.map[ pos ] in b'\r\n':
+                pos += 1
 
+            try:
+                rec = parse_bytes( view[ pos : stop ] )
+                if rec is not None:
+                    index.setdefault( rec.ctl_num(), ( pos, stop - pos ) )
+            except ( AttributeError, KeyError, encoding_error ):
+                pass
+            pos = stop + 1
+        return index
 
-def render( rec: MARC.record, base_64 = False ) -> str:
-    """Return a string containing the record in Z39.2 format.  Optionally encode it in base-64."""
-    data = ''
-    dir  = ''
-
-    #-----------------------------------------------------------------
-    # Traverse the MARC record and accumulate the data segment and
-    # directory segment simultaneously.  The single traversal makes
-    # the accumulation deterministic.
+
+    # The sidecar is plain data, so that whoever can write next to a dump can at worst spoil
+    # lookups, not run code in the job reading it:
     #
-    def traverse( rec: MARC.record ):
-        base_addr = 0
+    #   INDEX_HEADER
+    #   the offsets, as unsigned 64-bit integers, little-endian
+    #   the lengths, likewise
+    #   the control numbers in UTF-8, each followed by the field terminator, which no field can
+    #   contain, so that a sidecar cut short can't pass for a whole one
+    #
+    def load_index( self ) -> dict:
+        """Return the index from the sidecar file, or None if there isn't one or it's stale."""
+        try:
+            with open( self.index_path, 'rb' ) as f:
+                data = f.read()
+            magic, size, mtime, count = INDEX_HEADER.unpack_from( data )
+            if magic != INDEX_MAGIC or ( size, mtime ) != self.stamp:
+                return None
+
+            pos = INDEX_HEADER.size
+            offsets = array.array( 'Q', data[ pos : pos + 8 * count ] )
+            pos += 8 * count
+            lengths = array.array( 'Q', data[ pos : pos + 8 * count ] )
+            pos += 8 * count
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+                lengths.byteswap()
+            ctl_nums = data[ pos: ].decode( 'utf-8' ).split( FT )
+            if ctl_nums.pop() != '':
+                return None
+            if len( ctl_nums ) != count or len( lengths ) != count:
+                return None
+            return dict( zip( ctl_nums, zip( offsets, lengths ) ) )
+        except ( OSError, ValueError, struct.error ):
+            return None
+
+
+    def save_index( self ):
+        """Write the index to the sidecar file, replacing it in one step (see misc.atomic_file) so
+        that a concurrent reader never sees a partial index.  Failure to write it (e.g., a
+        read-only directory) only costs a rescan next time.
+
+        """
+        offsets = array.array( 'Q', [ offset for offset, length in self.index.values() ] )
+        lengths = array.array( 'Q', [ length for offset, length in self.index.values() ] )
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            lengths.byteswap()
+        try:
+            with atomic_file.replacing( self.index_path ) as f:
+                f.write( INDEX_HEADER.pack( INDEX_MAGIC, *self.stamp, len( self.index ) ) )
+                f.write( offsets.tobytes() )
+                f.write( lengths.tobytes() )
+                f.write( ''.join( ctl_num + FT for ctl_num in self.index ).encode( 'utf-8' ) )
+        except OSError:
+            pass
+
+
+    def __getitem__( self, ctl_num: str ) -> MARC.record:
+        """Return the record having the given control number.  Raises KeyError if there is none."""
+        offset, length = self.index[ ctl_num ]
+        return parse_bytes( memoryview( self.map )[ offset : offset + length ] )
 
-        # Add control fields.  These don't have subfield codes.
-        for k in sorted( rec.ctl_fields.keys() ):
-            dir += "%03s" % k          # tag name, no indicators
+    def get( self, ctl_num: str, default = None ) -> MARC.record:
+        try:
+            return self[ ctl_num ]
+        except KeyError:
+            return default
 
-            val = rec.ctl_fields[ k ] + FT
-            data += val
+    def __contains__( self, ctl_num: str ) -> bool: return ctl_num in self.index
+    def __len__( self ): return len( self.index )
+    def __iter__( self ): return iter( self.index )
+    def keys( self ): return self.index.keys()
 
-            length = len( val )
-            dir += "%04d" % length    # add length
-            dir += "%05d" % base_addr # add base address
-            base_addr += length
 
-        # Add data tags to the directory.
-        for t in rec:
-            dir += "%03s" % t.tag      # tag name
-            field_data = t.ind[:2]     # indicators
+    def close( self ):
+        """Unmap and close the file.  Records still holding undecoded data keep the map alive; in that
+        case it is released when they are.
 
-            # Add each field with its code.
-            for f in t.fields:
-                field_data += "%c%c%s" % ( US, f[ 0 ], f[ 1 ] )
+        """
+        try:
+            if isinstance( self.map, mmap.mmap ):
+                self.map.close()
+        except BufferError:
+            pass
+        self.file.close()
 
-            # Terminate the tag.
-            field_data += FT
-            data += field_data
+    def __enter__( self ): return self
+    def __exit__( self, *args ): self.close()
 
-            length = len( field_data )
-            dir += "%04d" % length     # add length to directory
-            dir += "%05d" % base_addr  # add base address to directory
-            base_addr += length
 
-        # Terminate the directory.
-        self.dir += FT
+def render( rec: MARC.record, base_64 = False ) -> str:
+    """Return a string containing the record in Z39.2 format.  Optionally encode it in base-64.  Lengths
+    and addresses count the bytes of the UTF-8 encoding, so write the string out as UTF-8 (or use
+    render_bytes() to skip the round trip).
 
-    traverse( rec )
-    s = rec.leader + dir + data + RT
+    """
+    b = render_bytes( rec )
     if base_64:
-        return base64.b64encode( s )
+        return base64.b64encode( b ).decode( 'ascii' )
     else:
-        return s
+        return b.decode( 'utf-8' )
+
+
+def render_bytes( rec: MARC.record ) -> bytes:
+    """Return the record encoded as a Z39.2 datagram.  Control fields are emitted in tag order and then
+    the data tags in tag and sequence order.  The record length, base address, and entry map in the
+    leader are recomputed from the content, and the coding scheme is set to Unicode.  Raises
+    ValueError if the record is too large for the MARC 21 directory field widths.
+
+    """
+    dir    = []
+    fields = []
+    addr   = 0
+
+    # Accumulate the directory and data segments in a single traversal, which makes the addresses
+    # deterministic.  Each field is encoded once and measured in bytes.
+    #
+    def add( t: str, field: str ):
+        nonlocal addr
+        b = field.encode( 'utf-8' )
+        if len( b ) > 9999:
+            raise ValueError( 'tag {} too long for Z39.2 directory'.format( t ) )
+        dir.append( b'%3s%04d%05d' % ( t.encode( 'ascii' ), len( b ), addr ) )
+        fields.append( b )
+        addr += len( b )
+
+    # Control fields don't have indicators or subfield codes.
+    for k in sorted( rec.ctl_fields.keys() ):
+        add( k, ( rec.ctl_fields[ k ] or '' ) + FT )
+
+    # Data tags: indicators, then each subfield with its code.
+    for t in rec:
+        add( t.tag,
+             '{:2.2}'.format( t.ind or '' )
+             + ''.join( [ US + f[0] + ( f[1] or '' ) for f in t.fields ] )
+             + FT )
+
+    # Terminate the directory.
+    dir.append( FT.encode( 'ascii' ) )
+
+    base   = 24 + DIR_ENTRY_LEN * ( len( dir ) - 1 ) + 1
+    length = base + addr + 1
+    if addr > 99999 or length > 99999:
+        raise ValueError( 'record too long for Z39.2' )
+
+    # Leader/00-04 is the record length, Leader/09 the character coding scheme, which is Unicode since
+    # the fields were encoded as UTF-8, Leader/10-11 the indicator and subfield code counts,
+    # Leader/12-16 the base address of data, and Leader/20-23 the entry map.
+    #
+    leader = '{:24.24}'.format( rec.leader or '' )
+    leader = '%05d%s%s22%05d%s4500' % ( length, leader[5:9], UNICODE, base, leader[17:20] )
+
+    return b''.join( [ leader.encode( 'ascii', 'replace' ) ] + dir + fields + [ RT.encode( 'ascii' ) ] )
+
+
+def write_records( fileobj, records ) -> int:
+    """Render each record in the iterable <records> and write it to the binary file object <fileobj>.
+    Return the number of records written.
+
+    """
+    n = 0
+    for rec in records:
+        fileobj.write( render_bytes( rec ) )
+        n += 1
+    return n
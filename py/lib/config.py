@@ -26,6 +26,26 @@ CREDENTIALS = {
     }
 
 
+# Connection pool settings, per database.  See db.mysql.driver.pool.
+#
+DB_POOL = {
+    'min_size'         : 1,
+    'max_size'         : 10,
+    'idle_timeout'     : 300,          # seconds
+    'check_after'      : 5,            # seconds idle before a connection is pinged on checkout
+    'checkout_timeout' : 30            # seconds
+    }
+
+
+# Bibliographic record cache settings.  See db.cache.cache.
+#
+BIB_CACHE = {
+    'size'     : 10000,             # records kept in memory
+    'ttl'      : 300,               # seconds
+    'path'     : None               # sqlite file shared between processes, if any
+    }
+
+
 REST = {
     'host'     : 'localhost',
     'port'     : '1138',
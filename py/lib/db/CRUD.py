@@ -20,6 +20,10 @@ class not_found( Exception ):
     """ Object not found """
     pass
 
+class conflict( Exception ):
+    """ Object changed by someone else since it was read """
+    pass
+
 
 class base( ABC ):
     """Readers and writers for Model objects must implmement the following operations."""
@@ -48,7 +52,8 @@ class base( ABC ):
         object to be updated.  Otherwise the implementation may derive the primary key from th e
         object.  Raises exception 'not_found' if the object doesn't exist in the persistent store.
         The implementation may selectively update only the portions of the persistent store that it
-        detects have changed.
+        detects have changed.  An implementation that detects concurrent changes raises 'conflict'
+        if the object was changed in the persistent store since it was read.
 
         """
         pass
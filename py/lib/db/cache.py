@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              cache.py
+#  Description:       Read-through cache for bibliographic records
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:30:00 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Read-through cache for bibliographic records
+
+   Wraps a CRUD implementation for MARC records, such as db.mysql.bib, and implements the same
+   operations.  Reads are answered from a bounded in-process LRU if possible, then from an optional
+   sqlite file that several processes can share, and only then from the wrapped store.  Whatever
+   the store returns is put in both.  Every entry expires <ttl> seconds after it was read from the
+   store.
+
+   Creating, updating, deleting, or committing an edit through the cache drops the record from
+   both tiers.  Changes made some other way, e.g., by the batch loader or by another process
+   sharing the sqlite file but not this process's LRU, show up once the entry expires, so the TTL
+   is how stale a read can be.
+
+   A record read from the store just before someone else changed it mustn't be cached after the
+   change has dropped it.  Within a process, a count of invalidations guards against that.  The
+   sqlite file keeps a count per record, bumped by every process that drops it, and a record read
+   from the store goes in the file only if its count is unchanged since before the read.  These
+   counts are never deleted, so the file keeps a small row for every record ever changed through
+   a cache using it.
+
+       bibs = cache.cache( bib.bib( config.CREDENTIALS['database']['franklin'] ),
+                           **config.BIB_CACHE )
+       rec = bibs.read( ctl_num )
+       ...
+       bibs.stats      # hits, misses, ...
+
+   Entries are kept under ctl_key() of the control number, so that a record is found, and dropped,
+   under any control number the store would match it by.
+
+   Records are held serialized, so each read gets its own copy to edit.  The serialization keeps
+   tag sequence numbers as they are in the store, which Z39.2 wouldn't, because the changes an
+   update writes are worked out by tag and sequence number.
+
+"""
+
+import collections
+import json
+import sqlite3
+import threading
+import time
+
+from db             import CRUD
+from db.mysql.MARC  import ctl_key
+from MARC           import MARC
+
+
+def encode( rec: MARC.record ) -> str:
+    """Return the record serialized as JSON."""
+    return json.dumps(
+        [ rec.leader,
+          rec.ctl_fields,
+          [ [ t.tag, t.seq, t.ind, t.fields.codes, t.fields.vals ] for t in rec.tags ] ],
+        ensure_ascii = False,
+        separators = ( ',', ':' ) )
+
+
+def decode( s: str ) -> MARC.record:
+    """Return the record serialized in <s> by encode()."""
+    leader, ctl_fields, tags = json.loads( s )
+    rec = MARC.record()
+    rec.leader     = leader
+    rec.ctl_fields = ctl_fields
+    for tag, seq, ind, codes, vals in tags:
+        t = MARC.tag( tag = tag, seq = seq, ind = ind )
+        t.fields.codes = codes
+        t.fields.vals  = vals
+        rec.tags.append( t )
+        rec.seqs[ tag ] = max( seq, rec.seqs.get( tag, 0 ) )
+    return rec
+
+
+class cache( CRUD.base ):
+    """Caching wrapper around the CRUD implementation <store>.
+
+    At most <size> records are kept in memory.  If <path> is given, it's the sqlite file for the
+    shared tier, which is created if need be.  Entries are good for <ttl> seconds.
+
+    """
+
+    # Expired rows are cleared out of the sqlite file after this many writes to it.
+    PURGE_EVERY = 1000
+
+    # Most IDs counts() looks up in one query.
+    COUNT_CHUNK = 500
+
+    # The ID under which the sqlite file counts clear(), which drops every record.
+    CLEARED = ''
+
+    def __init__( self,
+                  store : CRUD.base,
+                  size  : int   = 10000,
+                  ttl   : float = 300,
+                  path  : str   = None ):
+
+        self.store = store
+        self.size  = size
+        self.ttl   = ttl
+
+        self.lock       = threading.Lock()
+        self.entries    = collections.OrderedDict()    # ID -> ( expires, encoded ), LRU first
+        self.generation = 0                             # bumped on every invalidation
+        self.writes     = 0                             # writes to the sqlite file since a purge
+        self.stats = {
+            'hits'      : 0,    # reads answered from memory or the sqlite file
+            'disk_hits' : 0,    # ... of which from the sqlite file
+            'misses'    : 0,    # reads that went to the store
+            'expired'   : 0,    # entries found past their TTL
+            'evictions' : 0,    # entries pushed out of memory to make room
+            }
+
+        self.disk = None
+        if path is not None:
+            self.disk = sqlite3.connect( path, timeout = 30, isolation_level = None,
+                                         check_same_thread = False )
+            self.disk.execute( 'PRAGMA journal_mode = WAL' )
+            self.disk.execute( """CREATE TABLE IF NOT EXISTS records (
+                                      ID       TEXT PRIMARY KEY,
+                                      expires  REAL NOT NULL,
+                                      data     TEXT NOT NULL )""" )
+            self.disk.execute( """CREATE TABLE IF NOT EXISTS invalidations (
+                                      ID       TEXT PRIMARY KEY,
+                                      count    INTEGER NOT NULL )""" )
+            self.purge()
+
+
+    def close( self ):
+        """Close the sqlite file and the store."""
+        with self.lock:
+            if self.disk is not None:
+                self.disk.close()
+                self.disk = None
+        self.store.close()
+
+
+    #-------------------------------------------------------------------
+    # CRUD.  Reads go through the cache; everything else goes straight to the store and invalidates.
+
+    def create( self, obj: MARC.record, ID = None ):
+        ID = self.store.create( obj, ID )
+        self.invalidate( ID )
+        return ID
+
+
+    def read( self, ID: str ):
+        rec = self.get( ID )
+        if rec is not None:
+            return rec
+
+        with self.lock:
+            generation = self.generation
+            counts = self.counts( [ ID ] )
+        rec = self.store.read( ID )
+        self.put( ID, rec, generation, counts )
+        return rec
+
+
+    def read_many( self, IDs: list ) -> list:
+        """Read the records having the given control numbers, in the order requested, fetching those
+        not cached from the store all at once.  Control numbers not in the store are left out.
+
+        """
+        recs = {}
+        wanted = []
+        for ID in dict.fromkeys( IDs ):
+            if ctl_key( ID ) in recs: continue
+            rec = self.get( ID )
+            if rec is not None:
+                recs[ ctl_key( ID ) ] = rec
+            else:
+                wanted.append( ID )
+
+        if len( wanted ) > 0:
+            with self.lock:
+                generation = self.generation
+                counts = self.counts( wanted )
+            for rec in self.store.read_many( wanted ):
+                ID = rec.ctl_num()
+                recs[ ctl_key( ID ) ] = rec
+                self.put( ID, rec, generation, counts )
+
+        return [ recs[ ctl_key( ID ) ] for ID in IDs if ctl_key( ID ) in recs ]
+
+
+    def update( self, obj: MARC.record, ID = None, base: MARC.record = None, version: str = None ):
+        # A conflict may mean the caller edited a stale copy, so invalidate even on failure.
+        ID = ID or obj.ctl_num()
+        try:
+            return self.store.update( obj, ID, base, version )
+        finally:
+            self.invalidate( ID )
+
+
+    def delete( self, ID: str ):
+        try:
+            self.store.delete( ID )
+        finally:
+            self.invalidate( ID )
+
+
+    def edit_commit( self, rec: MARC.record, checksum: str ):
+        ID = rec.ctl_num()
+        try:
+            self.store.edit_commit( rec, checksum )
+        finally:
+            self.invalidate( ID )
+
+
+    #-------------------------------------------------------------------
+    # The tiers.
+
+    def get( self, ID: str ) -> MARC.record:
+        """Return a copy of the cached record having the given ID, or None if it isn't cached or has
+        expired.
+
+        """
+        ID = ctl_key( ID )
+        now = time.time()
+        data = None
+        with self.lock:
+            entry = self.entries.get( ID )
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end( ID )
+                    data = entry[1]
+                else:
+                    del self.entries[ ID ]
+                    self.stats[ 'expired' ] += 1
+
+            if data is None and self.disk is not None:
+                row = self.disk.execute( 'SELECT expires, data FROM records WHERE ID = ?',
+                                         ( ID, ) ).fetchone()
+                if row is not None:
+                    if row[0] > now:
+                        self.remember( ID, row )
+                        self.stats[ 'disk_hits' ] += 1
+                        data = row[1]
+                    else:
+                        self.stats[ 'expired' ] += 1
+
+            self.stats[ 'hits' if data is not None else 'misses' ] += 1
+
+        # Decoding is most of the work of a hit, and needn't hold up other readers.
+        return decode( data ) if data is not None else None
+
+
+    def put( self, ID: str, rec: MARC.record, generation: int, counts: dict ):
+        """Cache the record having the given ID, as read from the store when this process's
+        invalidation count was <generation> and the sqlite file's were <counts>, as returned by
+        counts().  If the record has been invalidated since, here or in another process, it may be
+        out of date already, so it's left out.
+
+        """
+        ID = ctl_key( ID )
+        entry = ( time.time() + self.ttl, encode( rec ) )
+        with self.lock:
+            if generation != self.generation: return
+            if self.disk is not None:
+                self.disk.execute( 'BEGIN IMMEDIATE' )
+                try:
+                    current = self.counts( [ ID ] )
+                    if any( current[ k ] != counts.get( k, 0 ) for k in current ):
+                        self.disk.execute( 'ROLLBACK' )
+                        return
+                    self.disk.execute(
+                        'INSERT OR REPLACE INTO records ( ID, expires, data ) VALUES ( ?, ?, ? )',
+                        ( ID, ) + entry )
+                    self.disk.execute( 'COMMIT' )
+                except:
+                    self.disk.execute( 'ROLLBACK' )
+                    raise
+                self.writes += 1
+                if self.writes >= self.PURGE_EVERY:
+                    self.purge()
+            self.remember( ID, entry )
+
+
+    def counts( self, IDs: list ) -> dict:
+        """Return a dictionary mapping the ctl_key() of each of <IDs>, and CLEARED, to its
+        invalidation count in the sqlite file, or an empty one if there's no sqlite file.  Call
+        with the lock held.
+
+        """
+        if self.disk is None: return {}
+        keys = list( dict.fromkeys( [ self.CLEARED ] + [ ctl_key( ID ) for ID in IDs ] ) )
+        counts = dict.fromkeys( keys, 0 )
+        for i in range( 0, len( keys ), self.COUNT_CHUNK ):
+            chunk = keys[ i : i + self.COUNT_CHUNK ]
+            counts.update( self.disk.execute(
+                'SELECT ID, count FROM invalidations WHERE ID IN ( {} )'.format(
+                    ', '.join( '?' * len( chunk ) ) ),
+                chunk ).fetchall() )
+        return counts
+
+
+    def remember( self, ID: str, entry: tuple ):
+        """Put <entry> in memory as the most recently used, evicting the least recently used if need
+        be.  Call with the lock held.
+
+        """
+        self.entries[ ID ] = entry
+        self.entries.move_to_end( ID )
+        while len( self.entries ) > self.size:
+            self.entries.popitem( last = False )
+            self.stats[ 'evictions' ] += 1
+
+
+    def purge( self ):
+        """Delete the expired rows from the sqlite file."""
+        self.disk.execute( 'DELETE FROM records WHERE expires <= ?', ( time.time(), ) )
+        self.writes = 0
+
+
+    def invalidate( self, ID: str ):
+        """Drop the record having the given ID from both tiers."""
+        ID = ctl_key( ID )
+        with self.lock:
+            self.generation += 1
+            self.entries.pop( ID, None )
+            if self.disk is not None:
+                self.drop( ID, 'DELETE FROM records WHERE ID = ?', ( ID, ) )
+
+
+    def clear( self ):
+        """Drop everything from both tiers."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            if self.disk is not None:
+                self.drop( self.CLEARED, 'DELETE FROM records' )
+
+
+    def drop( self, ID: str, query: str, params = () ):
+        """Bump the invalidation count of <ID> in the sqlite file and run <query> to drop rows, in
+        one transaction.  Call with the lock held.
+
+        """
+        self.disk.execute( 'BEGIN IMMEDIATE' )
+        try:
+            self.disk.execute( 'INSERT OR IGNORE INTO invalidations ( ID, count ) VALUES ( ?, 0 )',
+                               ( ID, ) )
+            self.disk.execute( 'UPDATE invalidations SET count = count + 1 WHERE ID = ?', ( ID, ) )
+            self.disk.execute( query, params )
+            self.disk.execute( 'COMMIT' )
+        except:
+            self.disk.execute( 'ROLLBACK' )
+            raise
@@ -33,4 +33,8 @@ class IND( CRUD.base ):
         pass
 
     def delete( self, ID: str ):
-        self.db.delete( self.name, 'ID', ID )
+        self.db.delete( self.table, 'ID', ID )
+
+    def close( self ):
+        """Return the database connection to the pool."""
+        self.db.close()
@@ -9,56 +9,174 @@
 # -----------------------------------------------------------------------
 """CRUD implementation for MySQL storage of MARC 21 records."""
 
+import heapq
+import itertools
 import os
 import sys
 
 import MySQLdb as mdb
 
 from misc.switch          import switch
+from misc                 import keywords
 from db                   import CRUD
-from MARC                 import MARC
+from MARC                 import MARC as MARC21
 from db.mysql             import driver
-from db.mysql.driver      import esc
+
+
+def ctl_key( ctl_num: str ) -> str:
+    """Return the form of <ctl_num> by which the database tells control numbers apart.  The columns
+    are CHAR, which drops trailing spaces, in a case-insensitive collation, so a control number
+    asked for may match a stored one without being equal to it.
+
+    """
+    return ctl_num.rstrip( ' ' ).casefold()
+
+
+def restore_timestamp( rec: MARC21.record, stamp: str ):
+    """Put back <stamp>, the 005 the record had before a failed write, or None if it had none."""
+    if stamp is None:
+        rec.ctl_fields.pop( '005', None )
+    else:
+        rec.ctl_fields[ '005' ] = stamp
 
 
 class MARC( CRUD.base ):
     """ Translate CRUD operations into MySQL driver operations. """
 
+    # Most control numbers read_many() puts in one IN ( ... ) list.
+    READ_CHUNK = 500
+
     def __init__( self, conn_data ):
-        # @todo Does this need to access a global pool of database connections?
-        # Attempt to connect to database.
+        # The driver checks a connection out of the process-wide pool.
         conn_data['db'] = 'franklin'
         self.db = driver.reader_writer( conn_data )
+        self.clear_rows()
+
+        # An in-memory keyword index to keep up to date along with bib_keywords, if any.
+        self.keyword_index = None
+
+
+    def close( self ):
+        """Return the database connection to the pool."""
+        self.db.close()
 
 
-    def create( self, obj: MARC.record, ID = None ):
+    def create( self, obj: MARC21.record, ID = None ):
+        return self.create_many( [ obj ] )[ 0 ]
+
+
+    def create_many( self, recs: list ) -> list:
+        """Store all the records in <recs> in a single transaction, with one multi-row insert per table.
+        Return the list of control numbers of the stored records.  Raises CRUD.duplicate if any of
+        the records is already in the data store, in which case none of them are stored.
+
+        """
+        ctl_nums = [ rec.ctl_num() for rec in recs ]
         try:
-            self.insert_leader( obj.ctl_num(), obj.leader )
-            self.add_tags( obj )
-            return obj.ctl_num()
+            self.db.execute_many(
+                self.INSERT_LEADER,
+                [ ( ctl_num, rec.leader, rec.digest( with_900s = False ) )
+                  for ctl_num, rec in zip( ctl_nums, recs ) ] )
+            for rec, ctl_num in zip( recs, ctl_nums ):
+                self.add_tags( rec, ctl_num )
+                self.add_keywords( rec, ctl_num )
+            self.flush_rows()
+            self.db.commit()
+            if self.keyword_index is not None:
+                for rec, ctl_num in zip( recs, ctl_nums ):
+                    self.keyword_index.add( ctl_num, keywords.record_keywords( rec ) )
         except mdb.IntegrityError:
+            self.db.rollback()
+            self.clear_rows()
             raise CRUD.duplicate
+        except:
+            self.db.rollback()
+            self.clear_rows()
+            raise
+        return ctl_nums
 
 
     def read( self, ID: str ):
-        rec = MARC.record()
-        rec.leader = self.get_leader( ID )
-        if rec.leader is None:
+        recs = self.build_records( [ ID ] )
+        if len( recs ) == 0:
             raise CRUD.not_found
-        self.build_record( rec, ID )
-        return rec
+        return next( iter( recs.values() ) )
 
 
-    def update( self, obj: MARC.record, ID = None ):
-        pass
+    def read_many( self, IDs: list ) -> list:
+        """Read the records having the given control numbers, in a fixed number of queries per
+        READ_CHUNK records.  Return them in the order requested.  Control numbers not in the data
+        store are left out.  The records are matched up with the control numbers asked for the way
+        the database matches them, by ctl_key().
 
+        """
+        wanted = list( dict.fromkeys( IDs ) )
+        recs = {}
+        for i in range( 0, len( wanted ), self.READ_CHUNK ):
+            for ctl_num, rec in self.build_records( wanted[ i : i + self.READ_CHUNK ] ).items():
+                recs[ ctl_key( ctl_num ) ] = rec
+        return [ recs[ ctl_key( ID ) ] for ID in IDs if ctl_key( ID ) in recs ]
 
-    def delete( self, ID: str ):
+
+    def update(
+            self,
+            obj     : MARC21.record,
+            ID              = None,
+            base    : MARC21.record = None,
+            version : str   = None ):
+        """Store the edited record <obj> over the stored one.
+
+        The record's 005 (Date and Time of Last Transaction), as it was when the record was read,
+        is its version.  The stored 005 is swapped for a new one only if it still has that value,
+        which also locks the record for the rest of the transaction.  If it doesn't, someone else
+        has saved the record in the meantime and CRUD.conflict is raised without writing anything.
+        On success <obj> carries its new 005; on any failure it keeps the one it had.
+
+        Only the rows that differ are written.  If <base>, the record as it was read before
+        editing, is given, the changes are worked out against it without reading the stored
+        record.  If <version> is given, it's the 005 to check for instead, e.g., for a record
+        that didn't come from the catalog in the first place.
+
+        """
+        ctl_num = ID or obj.ctl_num()
+        if version is None:
+            version = ( base or obj ).ctl_fields.get( '005' )
+        if version is None:
+            raise ValueError( '{}: no 005 to check for conflicting changes'.format( ctl_num ) )
+
+        stamp = obj.ctl_fields.get( '005' )
+        obj.update_timestamp( version )
         try:
-            self.delete_leader( ID )
+            if self.swap_version( ctl_num, version, obj.ctl_fields[ '005' ] ) == 0:
+                if self.get_leader( ctl_num ) is None:
+                    raise CRUD.not_found
+                raise CRUD.conflict
+            if base is None:
+                base = self.read( ctl_num )
+            reindex = self.apply_diff( ctl_num, base, obj, version_written = True )
             self.db.commit()
-        except db.IntegrityError:
-            raise not_found
+        except:
+            self.db.rollback()
+            self.clear_rows()
+            restore_timestamp( obj, stamp )
+            raise
+
+        if reindex and self.keyword_index is not None:
+            self.keyword_index.add( ctl_num, keywords.record_keywords( obj ) )
+        return ctl_num
+
+
+    def delete( self, ID: str ):
+        # Everything else goes with the leader by cascade, but the keyword table isn't always the one
+        # the foreign key was declared on, so clear its rows explicitly.
+        #
+        self.delete_keywords( ID )
+        if self.delete_leader( ID ) == 0:
+            self.db.rollback()
+            raise CRUD.not_found
+        self.db.commit()
+        if self.keyword_index is not None:
+            self.keyword_index.remove( ID )
 
 
 
@@ -68,86 +186,212 @@ class MARC( CRUD.base ):
     # record prior to editing.  If the submitted checksum does not match
     # the checksum computed on the existing record, the commit fails.
     #
+    # Only the rows that differ from the stored record are written, as
+    # worked out by MARC.diff(), all in one transaction.  Keywords are
+    # redone only if something they come from has changed.
+    #
+    # The 005 of the record that was checked is swapped for a new one
+    # first, as in update(), so that the record stays locked while the
+    # rest is written.  If someone saved it between the check and the
+    # swap, CRUD.conflict is raised without writing anything.
+    #
     def edit_commit( self, rec, checksum ):
 
         # Get the original record and compute its checksum.
-        base_rec = self.view( rec.ctl_num() )
+        ctl_num = rec.ctl_num()
+        base_rec = self.read( ctl_num )
         sum = base_rec.digest()
         if sum != checksum: raise ValueError( 'stale checksum' )
 
-        # Cannot delete MARC Leader because of foreign key constraints.
-        # Update the Leader instead.
-        #
-        self.update_leader( rec.ctl_num(), rec.leader )
+        version = base_rec.ctl_fields.get( '005' )
+        if version is None:
+            raise ValueError( '{}: no 005 to check for conflicting changes'.format( ctl_num ) )
+
+        stamp = rec.ctl_fields.get( '005' )
+        rec.update_timestamp( version )
+        try:
+            if self.swap_version( ctl_num, version, rec.ctl_fields[ '005' ] ) == 0:
+                raise CRUD.conflict
+            reindex = self.apply_diff( ctl_num, base_rec, rec, version_written = True )
+            self.db.commit()
+        except:
+            self.db.rollback()
+            self.clear_rows()
+            restore_timestamp( rec, stamp )
+            raise
+
+        if reindex and self.keyword_index is not None:
+            self.keyword_index.add( ctl_num, keywords.record_keywords( rec ) )
 
-        # Delete all the subordinate information from the data store,
-        # then re-add it.
-        #
-        self.delete_all_indicators(     rec.ctl_num() )
-        self.delete_all_control_fields( rec.ctl_num() )
-        self.delete_all_fields(         rec.ctl_num() )
-        rec.update_timestamp()
-        self.add_tags( rec )
 
-        self.commit()
+    def apply_diff(
+            self,
+            ctl_num         : str,
+            base            : MARC21.record,
+            rec             : MARC21.record,
+            version_written : bool = False ) -> bool:
+        """Write the rows that differ between <base>, the stored record, and <rec>, its edited version,
+        store its digest, and redo the keywords if anything they come from has changed.  Return
+        whether they were.  If <version_written>, the new 005 is already stored.  Doesn't commit.
 
+        """
+        for op in base.diff( rec ):
+            # 9xx tags aren't stored.
+            if op[0] != 'update_leader' and op[1][0] == '9':
+                continue
+            if version_written and op[0:2] == ( 'update_control_field', '005' ):
+                continue
+            getattr( self, op[0] )( ctl_num, *op[1:] )
+
+        # Written every time, so that a digest missing from a row stored before there were any gets
+        # filled in.
+        self.update_digest( ctl_num, rec.digest( with_900s = False ) )
+
+        reindex = keywords.record_values( base ) != keywords.record_values( rec )
+        if reindex:
+            self.delete_keywords( ctl_num )
+            self.add_keywords( rec, ctl_num )
+            self.flush_rows()
+        return reindex
+
+
+    def reindex_keywords( self, rec: MARC21.record ):
+        """Replace the keywords stored for the record with those it has now.  Doesn't commit."""
+        self.delete_keywords( rec.ctl_num() )
+        self.add_keywords( rec )
+        self.flush_rows()
+        if self.keyword_index is not None:
+            self.keyword_index.add( rec.ctl_num(), keywords.record_keywords( rec ) )
+
+
+    def search(
+            self,
+            query      : str,
+            namespaces : list = None,
+            limit      : int  = 20,
+            offset     : int  = 0 )     -> list:
+        """Search the keywords for the words in <query>.  Return a list of ( ctl_num, score ) for the
+        best matching records, best first, as ranked by keywords.score().  If <namespaces> is
+        given, only keywords in those namespaces count.
+
+        Only the keywords.SEARCH_CANDIDATES records having the most distinct terms, in the best
+        namespace, are scored (see keyword_candidates()), so a record with fewer terms but a better
+        score can be left out.  Results are paged over that fixed set: <offset> results are skipped
+        and no more than <limit> returned, and nothing past the first SEARCH_CANDIDATES results
+        ever is.  The order is fixed for a given catalog, ties going by control number, so
+        successive pages don't overlap.
 
-    def add_tags( self, rec: MARC.record ):
-        """ Add all the tags for this record. """
+        """
+        terms = keywords.tokenize( query )
+        limit = min( limit, keywords.SEARCH_CANDIDATES - offset )
+        if len( terms ) == 0 or limit <= 0: return []
+        namespaces = list( namespaces or [] )
+
+        candidates = self.keyword_candidates(
+            list( dict.fromkeys( terms ) ),
+            namespaces,
+            keywords.SEARCH_CANDIDATES )
+
+        postings = {}
+        for i in range( 0, len( candidates ), self.READ_CHUNK ):
+            for row in self.get_keywords( candidates[ i : i + self.READ_CHUNK ], terms, namespaces ):
+                postings.setdefault( row[0], [] ).append( row[1:] )
+
+        ranked = sorted(
+            ( ( ctl_num, keywords.score( terms, postings.get( ctl_num, [] ) ) )
+              for ctl_num in candidates ),
+            key = lambda r: ( -r[1], r[0] ) )
+        return ranked[ offset : offset + limit ]
+
+
+    def add_tags( self, rec: MARC21.record, ctl_num: str = None ):
+        """Queue rows for all the tags of this record.  Nothing is written until flush_rows()."""
+        if ctl_num is None: ctl_num = rec.ctl_num()
         for tag in rec.ctl_fields.keys():
-            self.insert_control_field(
-                rec.ctl_num(),
-                tag,
-                rec.ctl_fields[ tag ] )
+            self.rows[ 'control' ].append( ( ctl_num, tag, rec.ctl_fields[ tag ] ) )
         for t in rec.tags:
             if t.tag[ 0 ] != '9':
-                self.insert_indicators(
-                    rec.ctl_num(),
-                    t.tag,
-                    t.seq,
-                    t.ind )
-                for pos, f in enumerate( t.fields.fields ):
-                    self.insert_field(
-                        rec.ctl_num(),
-                        t.tag,
-                        t.seq,
-                        f[ 0 ],
-                        pos + 1,
-                        f[ 1 ] )
-        self.db.commit()
+                self.rows[ 'indicators' ].append(
+                    ( ctl_num, t.tag, t.seq, t.ind[0:1], t.ind[1:2] ) )
+                for pos, f in enumerate( t.fields ):
+                    self.rows[ 'fields' ].append(
+                        ( ctl_num, t.tag, t.seq, f[ 0 ], pos + 1, f[ 1 ] ) )
 
 
-    def build_record( self, rec: MARC.record, ctl_num: str ):
-        """Populates a record with information from the dataabase.  This ensures all records are built
-        uniformly.
+    def add_keywords( self, rec: MARC21.record, ctl_num: str = None ):
+        """Queue rows for all the search keywords of this record.  Nothing is written until
+        flush_rows().
 
         """
+        if ctl_num is None: ctl_num = rec.ctl_num()
+        for kw in keywords.record_keywords( rec ):
+            self.rows[ 'keywords' ].append( ( ctl_num, ) + kw )
+
+
+    def flush_rows( self ):
+        """Write the rows queued by add_tags() and add_keywords(), one multi-row insert per table."""
+        self.db.execute_many( self.INSERT_CONTROL_FIELD, self.rows[ 'control' ] )
+        self.db.execute_many( self.INSERT_INDICATORS,    self.rows[ 'indicators' ] )
+        self.db.execute_many( self.INSERT_FIELD,         self.rows[ 'fields' ] )
+        self.db.execute_many( self.INSERT_KEYWORD,       self.rows[ 'keywords' ] )
+        self.clear_rows()
+
 
-        # Retreive control fields.
-        for f in self.get_control_fields( ctl_num ):
-            rec.ctl_fields[ f[0] ] = f[1]
+    def clear_rows( self ):
+        self.rows = { 'control': [], 'indicators': [], 'fields': [], 'keywords': [] }
 
-        # Retrieve tags.  Assumes tags are returned in tag and
-        # sequence order.  There is a row returned for each subfield,
-        # so sequences of rows may contain the same tag and sequence.
+
+    def build_records( self, ctl_nums: list ) -> dict:
+        """Build the records for the given control numbers from the database, in two queries no matter
+        how many tags they have.  Return a dictionary mapping control numbers to records.  Control
+        numbers not in the database are absent from it.  This ensures all records are built
+        uniformly.
+
+        """
+        recs = {}
+
+        # Leaders and control fields.  There is a row for each control field, or a single row with
+        # no tag for a record that has none.
         #
-        #   f[ 0 ] = tag
-        #   f[ 1 ] = seq
-        #   f[ 2 ] = code
-        #   f[ 3 ] = pos      Do not use as index
+        #   f[ 0 ] = ctl_num
+        #   f[ 1 ] = leader
+        #   f[ 2 ] = tag
+        #   f[ 3 ] = val
+        #
+        for f in self.get_leaders_and_control_fields( ctl_nums ):
+            try:
+                rec = recs[ f[0] ]
+            except KeyError:
+                rec = recs[ f[0] ] = MARC21.record()
+                rec.leader = f[1]
+            if f[2] is not None:
+                rec.ctl_fields[ f[2] ] = f[3]
+
+        # Tags.  There is a row returned for each subfield, in record, tag, sequence, and position
+        # order, so runs of rows belong to the same tag.  Indicators ride along on every row.
+        #
+        #   f[ 0 ] = ctl_num
+        #   f[ 1 ] = tag
+        #   f[ 2 ] = seq
+        #   f[ 3 ] = code
         #   f[ 4 ] = val
+        #   f[ 5 ] = ind_1
+        #   f[ 6 ] = ind_2
         #
-        last_tag = ''
-        last_seq = 0
-        for f in self.get_fields( ctl_num ):
-            if ( f[0] != last_tag ) or ( f[1] != last_seq ):
-                t = MARC_tag( tag = f[0],
-                              seq = f[1],
-                              ind = self.get_indicators( ctl_num, f[0], f[1] ) )
+        last = None
+        for f in self.get_tags( ctl_nums ):
+            if f[0:3] != last:
+                rec = recs.get( f[0] )
+                if rec is None: continue
+                t = MARC21.tag( tag = f[1],
+                                seq = f[2],
+                                ind = ( f[5] or ' ' ) + ( f[6] or ' ' ) )
                 rec.tags.append( t )
-                last_tag = f[0]
-                last_seq = f[1]
-            t.fields.append( f[ 2 ], f[ 4 ] )
+                rec.seqs[ f[1] ] = max( f[2], rec.seqs.get( f[1], 0 ) )
+                last = f[0:3]
+            t.fields.append( f[ 3 ], f[ 4 ] )
+
+        return recs
 
 
     # Everything above here is database independent and could be factored into a higher-level API.
@@ -155,13 +399,69 @@ class MARC( CRUD.base ):
     # database.
 
 
+    # Parameterized inserts for the bulk path.  The driver folds each of these into a multi-row
+    # INSERT for however many rows it is given.
+    #
+    INSERT_LEADER = """
+        INSERT INTO MARC_leader ( `ctl_num`, `val`, `digest` )
+        VALUES ( %s, %s, %s )"""
+
+    INSERT_CONTROL_FIELD = """
+        INSERT INTO MARC_control_fields ( `ctl_num`, `tag`, `val` )
+        VALUES ( %s, %s, %s )"""
+
+    INSERT_INDICATORS = """
+        INSERT INTO MARC_indicators ( `ctl_num`, `tag`, `seq`, `ind_1`, `ind_2` )
+        VALUES ( %s, %s, %s, %s, %s )"""
+
+    INSERT_FIELD = """
+        INSERT INTO MARC_fields ( `ctl_num`, `tag`, `seq`, `code`, `pos`, `val` )
+        VALUES ( %s, %s, %s, %s, %s, %s )"""
+
+    INSERT_KEYWORD = """
+        INSERT INTO bib_keywords ( `ctl_num`, `keyword`, `namespace`, `instance`, `offset` )
+        VALUES ( %s, %s, %s, %s, %s )"""
+
+    INSERT_NEW_KEYWORD = """
+        INSERT IGNORE INTO bib_keywords_new ( `ctl_num`, `keyword`, `namespace`, `instance`, `offset` )
+        VALUES ( %s, %s, %s, %s, %s )"""
+
+
+    def get_digests( self, ctl_nums: list ) -> dict:
+        """Return a dictionary mapping those control numbers in <ctl_nums> that are already in the data
+        store to ( digest, 005 ) for the stored record.  Either may be None.
+
+        """
+        if len( ctl_nums ) == 0: return {}
+        return { row[0] : ( row[1], row[2] ) for row in self.db.row_array(
+            """SELECT    l.ctl_num, l.digest, c.val
+               FROM      MARC_leader l
+                         LEFT JOIN MARC_control_fields c
+                           ON     c.ctl_num = l.ctl_num
+                              AND c.tag     = '005'
+               WHERE     l.ctl_num IN ( {} );""".
+            format( driver.in_list( len( ctl_nums ) ) ),
+            list( ctl_nums ) ) }
+
+
+    def existing( self, ctl_nums: list ) -> set:
+        """Return the set of those control numbers in <ctl_nums> that are already in the data store."""
+        if len( ctl_nums ) == 0: return set()
+        return set( [ row[0] for row in self.db.row_array(
+            """SELECT  ctl_num
+               FROM    MARC_leader
+               WHERE   ctl_num IN ( {} );""".
+            format( driver.in_list( len( ctl_nums ) ) ),
+            list( ctl_nums ) ) ] )
+
+
     def get_leader( self, ctl_num: str ) -> str:
         """Get the MARC leader for the given control number, or None if no such record exists."""
         return self.db.single_value(
             """SELECT   val
             FROM     MARC_leader
-            WHERE    ctl_num = '{}';""".
-            format( ctl_num ) )
+            WHERE    ctl_num = %s;""",
+            ( ctl_num, ) )
 
 
     def get_control_fields( self, ctl_num ) -> list:
@@ -173,8 +473,8 @@ class MARC( CRUD.base ):
         return self.db.row_array(
             """SELECT  tag, val
             FROM    MARC_control_fields
-            WHERE   ctl_num = '{}';""".
-            format( ctl_num ) )
+            WHERE   ctl_num = %s;""",
+            ( ctl_num, ) )
 
 
     def get_indicators(
@@ -193,12 +493,10 @@ class MARC( CRUD.base ):
                FROM
                  MARC_indicators
                WHERE
-                     ctl_num = '{ctl_num_val}'
-                 AND tag     = '{tag_val}'
-                 AND seq     = {seq_val};""".
-            format( ctl_num_val = ctl_num,
-                    tag_val     = tag,
-                    seq_val     = seq ) )
+                     ctl_num = %s
+                 AND tag     = %s
+                 AND seq     = %s;""",
+            ( ctl_num, tag, seq ) )
         if len( data ) > 0:
             ind = "%1s%1s" % ( data[0] )
         return ind
@@ -218,59 +516,108 @@ class MARC( CRUD.base ):
                FROM
                  MARC_fields
                WHERE
-                 ctl_num = '{}'
-               ORDER BY     tag
-                        AND seq
-                        AND pos;""".
-            format( ctl_num ) )
+                 ctl_num = %s
+               ORDER BY tag, seq, pos;""",
+            ( ctl_num, ) )
+
+
+    def get_leaders_and_control_fields( self, ctl_nums: list ) -> list:
+        """Get the leaders and control fields for the records having the given control numbers.  Each
+        array element is (ctl_num, leader, tag, val), one per control field, ordered by control
+        number and tag.  A record having no control fields yields a single element whose tag and val
+        are None.  Records not in the data store yield nothing.
+
+        """
+        return self.db.row_array(
+            """SELECT
+                 l.ctl_num, l.val, c.tag, c.val
+               FROM
+                 MARC_leader l
+                 LEFT JOIN MARC_control_fields c
+                   ON c.ctl_num = l.ctl_num
+               WHERE
+                 l.ctl_num IN ( {} )
+               ORDER BY l.ctl_num, c.tag;""".
+            format( driver.in_list( len( ctl_nums ) ) ),
+            list( ctl_nums ) )
+
+
+    def get_tags( self, ctl_nums: list ) -> list:
+        """Get the tag subfields, with their tags' indicators, for the records having the given control
+        numbers.  Each array element is (ctl_num, tag, seq, code, val, ind_1, ind_2), where the
+        indicators are None if the tag has no indicator row.  Elements are ordered by control
+        number, tag, sequence, and position.
+
+        """
+        return self.db.row_array(
+            """SELECT
+                 f.ctl_num, f.tag, f.seq, f.code, f.val, i.ind_1, i.ind_2
+               FROM
+                 MARC_fields f
+                 LEFT JOIN MARC_indicators i
+                   ON     i.ctl_num = f.ctl_num
+                      AND i.tag     = f.tag
+                      AND i.seq     = f.seq
+               WHERE
+                 f.ctl_num IN ( {} )
+               ORDER BY f.ctl_num, f.tag, f.seq, f.pos;""".
+            format( driver.in_list( len( ctl_nums ) ) ),
+            list( ctl_nums ) )
 
 
     def insert_leader(
             self,
             ctl_num : str,
-            val     : str ):
-        self.db.execute(
-            """INSERT INTO MARC_leader (
-                 `ctl_num`,
-                  `val`
-               ) VALUES (
-                 '{ctl_num}',
-                 '{val}' );""".
-            format( ctl_num = ctl_num, val = val ) )
+            val     : str,
+            digest  : str = None ):
+        self.db.execute( self.INSERT_LEADER, ( ctl_num, val, digest ) )
 
     def update_leader(
             self,
             ctl_num : str,
-            val     : str ):
-        self.db.execute(
+            val     : str ) -> int:
+        return self.db.execute(
             """UPDATE  MARC_leader
-               SET     `val` = '{val}'
-               WHERE   `ctl_num` = '{ctl_num}';""".
-            format( ctl_num = ctl_num, val = val ) )
+               SET     `val` = %s
+               WHERE   `ctl_num` = %s;""",
+            ( val, ctl_num ) )
 
-    def delete_leader( self, ctl_num: str ):
+    def update_digest(
+            self,
+            ctl_num : str,
+            digest  : str ):
         self.db.execute(
-            "DELETE FROM MARC_leader WHERE `ctl_num` = '{ctl_num}';"
-            .format( ctl_num = ctl_num ) )
+            """UPDATE  MARC_leader
+               SET     `digest` = %s
+               WHERE   `ctl_num` = %s;""",
+            ( digest, ctl_num ) )
+
+    def fill_digest(
+            self,
+            ctl_num : str,
+            digest  : str ) -> int:
+        """Store the digest of a record stored without one.  A digest stored in the meantime, by an
+        update that also changed the record, is left alone.  Return how many rows were changed.
+
+        """
+        return self.db.execute(
+            """UPDATE  MARC_leader
+               SET     `digest` = %s
+               WHERE       `ctl_num` = %s
+                       AND `digest` IS NULL;""",
+            ( digest, ctl_num ) )
+
+    def delete_leader( self, ctl_num: str ) -> int:
+        return self.db.execute(
+            "DELETE FROM MARC_leader WHERE `ctl_num` = %s;",
+            ( ctl_num, ) )
 
     def insert_control_field(
             self,
             ctl_num : str,
             tag     : str,
             val     : str ):
-        self.db.execute(
-            """INSERT INTO MARC_control_fields (
-                 `ctl_num`,
-                 `tag`,
-                 `val`
-               ) VALUES (
-                 '{ctl_num}',
-                 '{tag}',
-                 '{val}'
-               );""".
-            format( ctl_num = ctl_num,
-                    tag     = tag,
-                    val     = val ) )
+        self.db.execute( self.INSERT_CONTROL_FIELD, ( ctl_num, tag, val ) )
 
     def update_control_field(
             self,
@@ -279,12 +626,24 @@ class MARC( CRUD.base ):
             val     : str ):
         self.db.execute(
             """UPDATE MARC_control_fields
-               SET `val` = '{val}'
-               WHERE     `ctl_num` = '{ctl_num}'
-                     AND `tag`     = '{tag}';""".
-            format( ctl_num = ctl_num,
-                    tag     = tag,
-                    val     = val ) )
+               SET `val` = %s
+               WHERE     `ctl_num` = %s
+                     AND `tag`     = %s;""",
+            ( val, ctl_num, tag ) )
+
+    def swap_version(
+            self,
+            ctl_num : str,
+            old     : str,
+            new     : str ) -> int:
+        """Replace the 005 of the record with <new> if it's <old>.  Return 1 if it was, or 0."""
+        return self.db.execute(
+            """UPDATE MARC_control_fields
+               SET `val` = %s
+               WHERE     `ctl_num` = %s
+                     AND `tag`     = '005'
+                     AND `val`     = %s;""",
+            ( new, ctl_num, old ) )
 
     def delete_control_field(
             self,
@@ -292,16 +651,15 @@ class MARC( CRUD.base ):
             tag     : str ):
         self.db.execute(
             """DELETE FROM MARC_control_fields
-               WHERE     `ctl_num` = '{ctl_num}'
-                     AND `tag`     = '{tag}';""".
-            format( ctl_num = ctl_num,
-                    tag_val = tag ) )
+               WHERE     `ctl_num` = %s
+                     AND `tag`     = %s;""",
+            ( ctl_num, tag ) )
 
     def delete_all_control_fields( self, ctl_num: str ):
         self.db.execute(
             """DELETE FROM MARC_control_fields
-               WHERE `ctl_num` = '{ctl_num}';""".
-            format( ctl_num = ctl_num ) )
+               WHERE `ctl_num` = %s;""",
+            ( ctl_num, ) )
 
     def insert_indicators(
             self,
@@ -309,25 +667,7 @@ class MARC( CRUD.base ):
             tag     : str,
             seq     : int,
             ind     : str ):
-        self.db.execute(
-            """INSERT INTO MARC_indicators (
-                 `ctl_num`,
-                 `tag`,
-                 `seq`,
-                 `ind_1`,
-                 `ind_2`
-               ) VALUES (
-                 '{ctl_num}',
-                 '{tag}',
-                  {seq},
-                 '{ind_1}',
-                 '{ind_2}'
-               );""".
-            format( ctl_num = ctl_num,
-                    tag     = tag,
-                    seq     = seq,
-                    ind_1   = ind[0:1],
-                    ind_2   = ind[1:2] ) )
+        self.db.execute( self.INSERT_INDICATORS, ( ctl_num, tag, seq, ind[0:1], ind[1:2] ) )
 
     def update_indicators(
             self,
@@ -338,16 +678,12 @@ class MARC( CRUD.base ):
         self.db.execute(
             """UPDATE MARC_indicators
                SET
-                 `ind_1` = '{ind_1}',
-                 `ind_2` = '{ind_2}'
-               WHERE     `ctl_num` = '{ctl_num}'
-                     AND `tag`     = '{tag}'
-                     AND `seq`     = {seq};""".
-            format( ctl_num = ctl_num,
-                    tag   = tag,
-                    seq   = seq,
-                    ind_1 = ind[0:1],
-                    ind_2 = ind[1:2] ) )
+                 `ind_1` = %s,
+                 `ind_2` = %s
+               WHERE     `ctl_num` = %s
+                     AND `tag`     = %s
+                     AND `seq`     = %s;""",
+            ( ind[0:1], ind[1:2], ctl_num, tag, seq ) )
 
     def delete_indicators(
             self,
@@ -356,18 +692,16 @@ class MARC( CRUD.base ):
             seq     : int ):
         self.db.execute(
             """DELETE FROM MARC_indicators
-               WHERE     `ctl_num` = '{ctl_num}'
-                     AND `tag`     = '{tag}'
-                     AND `seq`     =  {seq};""".
-            format( ctl_num = ctl_num,
-                    tag     = tag,
-                    seq     = seq ) )
+               WHERE     `ctl_num` = %s
+                     AND `tag`     = %s
+                     AND `seq`     = %s;""",
+            ( ctl_num, tag, seq ) )
 
     def delete_all_indicators( self, ctl_num: str ):
         self.db.execute(
             """DELETE FROM MARC_indicators
-               WHERE `ctl_num` = '{ctl_num}';""".
-            format( ctl_num = ctl_num ) )
+               WHERE `ctl_num` = %s;""",
+            ( ctl_num, ) )
 
     def insert_field(
             self,
@@ -377,28 +711,7 @@ class MARC( CRUD.base ):
             code    : str,
             pos     : str,
             val     : str ):
-        self.db.execute(
-            """INSERT INTO MARC_fields (
-                 `ctl_num`,
-                 `tag`,
-                 `seq`,
-                 `code`,
-                 `pos`,
-                 `val`
-               ) VALUES (
-                 '{ctl_num}',
-                 '{tag}',
-                  {seq},
-                 '{code}',
-                 '{pos}',
-                 '{val}'
-               );""".
-            format( ctl_num = ctl_num,
-                    tag     = tag,
-                    seq     = seq,
-                    code    = code,
-                    pos     = pos,
-                    val     = esc( val ) ) )
+        self.db.execute( self.INSERT_FIELD, ( ctl_num, tag, seq, code, pos, val ) )
 
     def update_field(
             self,
@@ -410,18 +723,13 @@ class MARC( CRUD.base ):
             val     : str ):
         self.db.execute(
             """UPDATE MARC_fields
-               SET `val` = '{val}'
-               WHERE     `ctl_num` = '{ctl_num}'
-                     AND `tag`  = '{tag}'
-                     AND  seq   = {seq}
-                     AND `code` = '{code}'
-                     AND `pos`  = '{pos}';""".
-            format( ctl_num = ctl_num,
-                    tag     = tag,
-                    seq     = seq,
-                    code    = code,
-                    pos     = pos,
-                    val     = esc( val ) ) )
+               SET `val` = %s
+               WHERE     `ctl_num` = %s
+                     AND `tag`  = %s
+                     AND  seq   = %s
+                     AND `code` = %s
+                     AND `pos`  = %s;""",
+            ( val, ctl_num, tag, seq, code, pos ) )
 
     def delete_field(
             self,
@@ -432,80 +740,235 @@ class MARC( CRUD.base ):
             pos     : str ):
         self.db.execute(
             """DELETE FROM MARC_fields
-               WHERE     `ctl_num` = '{ctl_num}'
-                     AND `tag`  = '{tag}'
-                     AND  seq   =  {seq}
-                     AND `code` = '{code}'
-                     AND `pos`  = '{pos}';""".
-            format( ctl_num = ctl_num,
-                    tag     = tag,
-                    seq     = seq,
-                    code    = code,
-                    pos     = pos ) )
+               WHERE     `ctl_num` = %s
+                     AND `tag`  = %s
+                     AND  seq   = %s
+                     AND `code` = %s
+                     AND `pos`  = %s;""",
+            ( ctl_num, tag, seq, code, pos ) )
 
     def delete_all_fields( self, ctl_num: str ):
         self.db.execute(
             """DELETE FROM MARC_fields
-               WHERE `ctl_num` = '{ctl_num}';""".
-            format( ctl_num = ctl_num ) )
+               WHERE `ctl_num` = %s;""",
+            ( ctl_num, ) )
 
 
-    # XXX Do this and the next two functions via an iterator because
-    # these lists could be very large.
-    def get_all_titles( self ) -> list:
-        return self.db.row_array(
+    # Whole-catalog scans for rebuilding keywords.  These return generators that stream the rows from
+    # the server rather than lists, so memory use doesn't grow with the catalog.  Rows come in
+    # control number order.
+    #
+    def get_all_titles( self ):
+        """Generate ( ctl_num, val ) for the 245 $a of every record."""
+        return self.db.iter_rows(
             """SELECT ctl_num, val
                FROM MARC_fields
                WHERE     tag  = '245'
-                     AND code = 'a' """ )
+                     AND code = 'a'
+               ORDER BY ctl_num, seq, pos""" )
 
-    def get_all_subjects( self ) -> list:
-        return self.db.row_array(
+    def get_all_subjects( self ):
+        """Generate ( ctl_num, code, val ) for every 650 subfield of every record."""
+        return self.db.iter_rows(
             """SELECT ctl_num, code, val
                FROM MARC_fields
-               WHERE tag = '650' """ )
+               WHERE tag = '650'
+               ORDER BY ctl_num, seq, pos""" )
 
-    def get_all_authorg36s( self ) -> list:
-        return self.db.row_array(
+    def get_all_authors( self ):
+        """Generate ( ctl_num, tag, val ) for the 1xx $a of every record."""
+        return self.db.iter_rows(
             """SELECT ctl_num, tag, val
                FROM MARC_fields
                WHERE     tag LIKE '1%'
-                     AND code =   'a' """ )
+                     AND code =   'a'
+               ORDER BY ctl_num, tag, seq, pos""" )
+
+
+    def scan_keyword_values( self ):
+        """Generate ( ctl_num, [ ( namespace, value ), ... ] ) for every record having any values to
+        take keywords from, by merging the title, author, and subject scans in control number order.
+
+        """
+        titles   = ( ( r[0], 'T', r[1] ) for r in self.get_all_titles() )
+        authors  = ( ( r[0], 'A', r[2] ) for r in self.get_all_authors() )
+        subjects = ( ( r[0], 'S', r[2] ) for r in self.get_all_subjects() )
+        merged = heapq.merge( titles, authors, subjects, key = lambda r: r[0] )
+        for ctl_num, rows in itertools.groupby( merged, key = lambda r: r[0] ):
+            yield ctl_num, [ ( ns, val ) for c, ns, val in rows if val is not None ]
+
+    def scan_keywords( self ):
+        """Generate ( ctl_num, [ ( keyword, namespace, instance, offset ), ... ] ) for every record
+        having stored keywords, in control number order.
+
+        """
+        rows = self.db.iter_rows(
+            """SELECT ctl_num, keyword, namespace, instance, `offset`
+               FROM bib_keywords
+               ORDER BY ctl_num""" )
+        for ctl_num, group in itertools.groupby( rows, key = lambda r: r[0] ):
+            yield ctl_num, [ tuple( r[1:] ) for r in group ]
 
 
     def clear_keywords( self ):
         self.db.execute( 'DELETE FROM bib_keywords' )
 
+    def delete_keywords( self, ctl_num: str ):
+        self.db.execute(
+            """DELETE FROM bib_keywords
+               WHERE `ctl_num` = %s;""",
+            ( ctl_num, ) )
+
+
+    # A full rebuild of the keywords goes into bib_keywords_new, which then replaces bib_keywords in
+    # a single RENAME so that searches never see a partial set.  CREATE TABLE ... LIKE doesn't copy
+    # foreign keys, which is why delete() clears keywords itself.
+    #
+    def create_new_keywords( self ):
+        self.db.execute( 'DROP TABLE IF EXISTS bib_keywords_new' )
+        self.db.execute( 'CREATE TABLE bib_keywords_new LIKE bib_keywords' )
+
+    def insert_new_keywords( self, rows: list ):
+        """Add ( ctl_num, keyword, namespace, instance, offset ) rows to bib_keywords_new, ignoring
+        any already there.
+
+        """
+        self.db.execute_many( self.INSERT_NEW_KEYWORD, rows )
+
+    def swap_new_keywords( self ):
+        # A rebuild that died between the RENAME and the DROP leaves bib_keywords_old behind.
+        self.db.execute( 'DROP TABLE IF EXISTS bib_keywords_old' )
+        self.db.execute(
+            """RENAME TABLE bib_keywords     TO bib_keywords_old,
+                            bib_keywords_new TO bib_keywords""" )
+        self.db.execute( 'DROP TABLE bib_keywords_old' )
+
+    def delete_orphan_keywords( self ) -> int:
+        """Delete keywords of records no longer in the catalog.  Return how many there were."""
+        return self.db.execute(
+            """DELETE FROM bib_keywords
+               WHERE ctl_num NOT IN ( SELECT ctl_num FROM MARC_leader );""" )
+
+    def unindexed( self ) -> list:
+        """Return the control numbers of the records having no keywords at all."""
+        return [ row[0] for row in self.db.row_array(
+            """SELECT  l.ctl_num
+               FROM    MARC_leader l
+               WHERE   NOT EXISTS ( SELECT 1 FROM bib_keywords k WHERE k.ctl_num = l.ctl_num )
+               ORDER BY l.ctl_num;""" ) ]
+
+
+    def keyword_candidates(
+            self,
+            terms      : list,
+            namespaces : list,
+            limit      : int )      -> list:
+        """Return the control numbers of up to <limit> records having any of the keywords in <terms>,
+        in any of <namespaces> (or any namespace if it's empty), those having the most of them
+        first and then those having them in the best namespace, by keywords.NAMESPACE_WEIGHTS.
+
+        """
+        params = list( terms )
+        namespace_phrase = ''
+        if len( namespaces ) > 0:
+            namespace_phrase = 'AND namespace IN ( {} )'.format( driver.in_list( len( namespaces ) ) )
+            params += namespaces
+        params.append( limit )
+        return [ row[0] for row in self.db.row_array(
+            """SELECT   ctl_num
+               FROM     bib_keywords
+               WHERE    keyword IN ( {} )
+                        {}
+               GROUP BY ctl_num
+               ORDER BY COUNT( DISTINCT keyword ) DESC,
+                        MAX( CASE namespace {} ELSE 1 END ) DESC,
+                        ctl_num
+               LIMIT    %s;""".
+            format( driver.in_list( len( terms ) ), namespace_phrase,
+                    ' '.join( "WHEN '{}' THEN {}".format( ns, w )
+                              for ns, w in keywords.NAMESPACE_WEIGHTS.items() ) ),
+            params ) ]
+
+
+    def get_keywords(
+            self,
+            ctl_nums   : list,
+            terms      : list,
+            namespaces : list )     -> list:
+        """Get the stored keywords among <terms> for the records having the given control numbers, in
+        any of <namespaces> (or any namespace if it's empty).  Each array element is ( ctl_num,
+        keyword, namespace, instance, offset ).
+
+        """
+        terms = list( dict.fromkeys( terms ) )
+        params = list( ctl_nums ) + terms
+        namespace_phrase = ''
+        if len( namespaces ) > 0:
+            namespace_phrase = 'AND namespace IN ( {} )'.format( driver.in_list( len( namespaces ) ) )
+            params += namespaces
+        return self.db.row_array(
+            """SELECT   ctl_num, keyword, namespace, instance, `offset`
+               FROM     bib_keywords
+               WHERE        ctl_num IN ( {} )
+                        AND keyword IN ( {} )
+                        {};""".
+            format( driver.in_list( len( ctl_nums ) ),
+                    driver.in_list( len( terms ) ),
+                    namespace_phrase ),
+            params )
+
+
+    def changed_since( self, stamp: str ) -> list:
+        """Return the control numbers of the records whose 005 (Date and Time of Last Transaction) is
+        at or after <stamp>, which is in the same YYYYMMDDHHMMSS.F form or a prefix of it.
+
+        """
+        return [ row[0] for row in self.db.row_array(
+            """SELECT  ctl_num
+               FROM    MARC_control_fields
+               WHERE       tag = '005'
+                       AND val >= %s
+               ORDER BY ctl_num;""",
+            ( stamp, ) ) ]
+
 
     def match_keywords(
             self,
             key_list       : list,
             namespace_list : list,
             limit          : int )      -> list:
-        limit_phrase = ''
-        if limit > 0: limit_phrase = ' LIMIT {}'.format( limit )
+        """Return ( ctl_num, count ) for the records having any of the keywords in <key_list>, most
+        matches first.  The keys are normalized the same way the stored keywords were, so they can
+        be words as the user typed them.  If <namespace_list> isn't empty, only keywords in those
+        namespaces count.  If <limit> is positive, no more than that many are returned.
+
+        """
+        key_list = [ w for words in keywords.tokenize_many( key_list ) for w in words ]
+        if len( key_list ) == 0: return []
+        params = list( key_list )
         namespace_phrase = ''
         if len( namespace_list ) > 0:
             namespace_phrase = ' AND namespace IN ( {} )'.format(
-                ','.join( map( lambda x: "'" + x + "'", namespace_list ) )
-                )
-        key_phrase = ' WHERE keyword IN ( {} )'.format(
-            ','.join( map( lambda x: "'" + x + "'", key_list ) )
-            )
+                driver.in_list( len( namespace_list ) ) )
+            params += list( namespace_list )
+        limit_phrase = ''
+        if limit > 0:
+            limit_phrase = ' LIMIT %s'
+            params.append( limit )
         SQL ="""
           SELECT
             ctl_num,
             COUNT(*) AS count
           FROM
             bib_keywords
-          {key_phrase}
+          WHERE keyword IN ( {key_phrase} )
           {namespace_phrase}
           GROUP BY
             ctl_num
           ORDER BY count DESC
           {limit_phrase};""".format(
-            key_phrase        = key_phrase,
-            namespace_phrase  = domain_phrase,
+            key_phrase        = driver.in_list( len( key_list ) ),
+            namespace_phrase  = namespace_phrase,
             limit_phrase      = limit_phrase )
 
-        return [ tuple( row ) for row in self.db.row_array( SQL ) ]
+        return [ tuple( row ) for row in self.db.row_array( SQL, params ) ]
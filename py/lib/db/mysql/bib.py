@@ -24,8 +24,17 @@ class bib( CRUD.base ):
     def read( self, ID: str ):
         return self.MARC.read( ID )
 
-    def update( self, obj: bib, ID = None ):
-        self.MARC.update( bib )
+    def read_many( self, IDs: list ) -> list:
+        return self.MARC.read_many( IDs )
+
+    def update( self, obj: bib, ID = None, base: bib = None, version: str = None ):
+        return self.MARC.update( obj, ID, base, version )
 
     def delete( self, ID: str ):
         self.MARC.delete( ID )
+
+    def edit_commit( self, obj: bib, checksum: str ):
+        self.MARC.edit_commit( obj, checksum )
+
+    def close( self ):
+        self.MARC.close()
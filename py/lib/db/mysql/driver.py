@@ -9,30 +9,266 @@
 # -----------------------------------------------------------------------
 """Low-lovel MySQL driver"""
 
+import functools
 import os
+import re
 import sys
 import string
+import threading
+import time
 import MySQLdb as mdb
+import MySQLdb.cursors
 from db.CRUD import not_found, duplicate
 
-def esc( s: str ) -> str:
-    """Escape the string for use as a single-quoted value in an INSERT statement."""
-    if isinstance( s, str ):
-        return s.replace( "'", "\\'" )
-    else:
-        return s
+import config
+
+# Table and column names can't be passed as parameters, so those that are spliced into statement
+# text have to look like plain identifiers.
+#
+IDENTIFIER = re.compile( r'^[A-Za-z_][A-Za-z0-9_]*$' )
+
+def ident( name: str ) -> str:
+    """Return <name> quoted for use as a table or column name.  Raises ValueError if it isn't a plain
+    identifier.
+
+    """
+    if not isinstance( name, str ) or IDENTIFIER.match( name ) is None:
+        raise ValueError( 'bad SQL identifier: {!r}'.format( name ) )
+    return '`' + name + '`'
+
+
+@functools.lru_cache( maxsize = 64 )
+def in_list( n: int ) -> str:
+    """Return the placeholder list for an IN ( ... ) clause of <n> values.  The text is cached, so a
+    query over the same number of values is always the same statement.
+
+    """
+    return ', '.join( [ '%s' ] * n )
+
+
+class pool( object ):
+    """Thread-safe pool of connections to one database.
+
+    get() checks out a connection and put() returns it.  Idle connections are reused most recently
+    used first.  A connection that has sat idle for more than check_after seconds is pinged before
+    it's handed out, and replaced if it has gone away.  Connections idle for more than idle_timeout
+    seconds are closed, except that min_size of them are kept open.  No more than max_size
+    connections are open at once; get() waits up to checkout_timeout seconds for one to come back
+    before raising TimeoutError.
+
+    """
+
+    def __init__( self,
+                  conn_data        : dict,
+                  min_size         : int   = 1,
+                  max_size         : int   = 10,
+                  idle_timeout     : float = 300,
+                  check_after      : float = 5,
+                  checkout_timeout : float = 30 ):
+
+        self.conn_data        = conn_data
+        self.min_size         = min_size
+        self.max_size         = max_size
+        self.idle_timeout     = idle_timeout
+        self.check_after      = check_after
+        self.checkout_timeout = checkout_timeout
+
+        self.cond  = threading.Condition()
+        self.idle  = []         # ( connection, time returned ), least recently used first
+        self.size  = 0          # connections open, idle or checked out
+        self.stats = {
+            'checkouts'     : 0,    # connections handed out
+            'created'       : 0,    # connections opened
+            'closed'        : 0,    # connections closed as idle, broken, or discarded
+            'failed_checks' : 0,    # idle connections found dead on checkout
+            'waits'         : 0,    # checkouts that had to wait for a connection
+            'timeouts'      : 0,    # checkouts that gave up waiting
+            }
+
+
+    def count( self, stat: str ):
+        """Bump one of the statistics counters.  The lock is reentrant, so this is safe with it held."""
+        with self.cond:
+            self.stats[ stat ] += 1
+
+
+    def connect( self ):
+        """Open a new connection to the database."""
+        conn = mdb.connect(
+            self.conn_data['host'],
+            self.conn_data['user'],
+            self.conn_data['pass'],
+            self.conn_data['db'],
+            charset = 'utf8',
+            use_unicode = True )
+        self.count( 'created' )
+        return conn
+
+
+    def get( self ):
+        """Check out a connection."""
+        with self.cond:
+            self.reap()
+            deadline = time.monotonic() + self.checkout_timeout
+            waited = False
+            while len( self.idle ) == 0 and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.count( 'timeouts' )
+                    raise TimeoutError( 'no database connection available' )
+                waited = True
+                self.cond.wait( remaining )
+            if waited:
+                self.count( 'waits' )
+            self.count( 'checkouts' )
+
+            if len( self.idle ) > 0:
+                conn, since = self.idle.pop()
+            else:
+                conn, since = None, None
+                self.size += 1
+
+        # Connect or check health outside the lock.  The slot is already accounted for.
+        #
+        try:
+            if conn is not None and time.monotonic() - since > self.check_after:
+                try:
+                    conn.ping()
+                except mdb.Error:
+                    self.count( 'failed_checks' )
+                    self.close_conn( conn )
+                    conn = None
+            if conn is None:
+                conn = self.connect()
+        except:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+        return conn
+
+
+    def put( self, conn ):
+        """Return a checked-out connection to the pool.  Anything left uncommitted is rolled back."""
+        try:
+            conn.rollback()
+        except mdb.Error:
+            self.discard( conn )
+            return
+        with self.cond:
+            self.idle.append( ( conn, time.monotonic() ) )
+            self.cond.notify()
+
+
+    def discard( self, conn ):
+        """Close a checked-out connection instead of returning it to the pool."""
+        self.close_conn( conn )
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+
+    def reap( self ):
+        """Close connections that have been idle too long, keeping at least min_size open.  Call with
+        the lock held.
+
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        while ( len( self.idle ) > 0
+                and self.idle[0][1] < cutoff
+                and self.size > self.min_size ):
+            conn, since = self.idle.pop( 0 )
+            self.size -= 1
+            self.close_conn( conn )
+
+
+    def close_conn( self, conn ):
+        try:
+            conn.close()
+        except mdb.Error:
+            pass
+        self.count( 'closed' )
+
+
+    def statistics( self ) -> dict:
+        """Return the pool counters along with the number of connections open, idle, and in use."""
+        with self.cond:
+            stats = dict( self.stats )
+            stats[ 'open' ]   = self.size
+            stats[ 'idle' ]   = len( self.idle )
+            stats[ 'in_use' ] = self.size - len( self.idle )
+        return stats
+
+
+    def close( self ):
+        """Close all the idle connections.  Checked-out connections are closed when returned."""
+        with self.cond:
+            for conn, since in self.idle:
+                self.close_conn( conn )
+            self.size -= len( self.idle )
+            self.idle = []
+            self.min_size = 0
+
+
+# Pools by database, shared by everything in the process.
+#
+pools      = {}
+pools_lock = threading.Lock()
+
+def get_pool( conn_data: dict ) -> pool:
+    """Return the pool of connections for the database described by <conn_data>, creating it with the
+    settings in config.DB_POOL if necessary.
+
+    """
+    key = ( conn_data['host'], conn_data['user'], conn_data['db'] )
+    with pools_lock:
+        try:
+            return pools[ key ]
+        except KeyError:
+            p = pools[ key ] = pool( dict( conn_data ), **config.DB_POOL )
+            return p
 
 
 class base( object ):
+    """Holds a connection checked out of the shared pool until close() is called or the object is
+    garbage-collected.  Can be used as a context manager.
+
+    """
 
     def __init__( self, conn_data: dict ):
-        self.db = mdb.connect(
-            conn_data['host'],
-            conn_data['user'],
-            conn_data['pass'],
-            conn_data['db'],
-            charset = 'utf8',
-            use_unicode = True )
+        self.pool = get_pool( conn_data )
+        self.db   = self.pool.get()
+        self.cur  = None
+
+    def cursor( self ):
+        """Return the cursor kept for this connection, opening it on first use.  Every statement on the
+        connection goes through the same cursor rather than setting up a new one each time.
+
+        """
+        if self.cur is None:
+            self.cur = self.db.cursor()
+        return self.cur
+
+    def close( self ):
+        """Return the connection to the pool.  The object can't be used afterward."""
+        if getattr( self, 'db', None ) is not None:
+            if self.cur is not None:
+                try:
+                    self.cur.close()
+                except mdb.Error:
+                    pass
+                self.cur = None
+            self.pool.put( self.db )
+            self.db = None
+
+    def __del__( self ):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__( self ): return self
+    def __exit__( self, *args ): self.close()
 
 
 class reader( base ):
@@ -41,37 +277,37 @@ class reader( base ):
     def __init__( self, conn_data: dict ):
         super( reader, self ).__init__( conn_data )
 
-    def single_value( self, query: str ):
+    def single_value( self, query: str, params = None ):
         """Return a single value that is the single row and single column resulting from the given
         query. Returns None if the query produces no value.
 
         """
-        cur = self.db.cursor()
-        cur.execute( query )
+        cur = self.cursor()
+        cur.execute( query, params )
         data = cur.fetchone()
         if data is None: return None
         return data[0]
 
 
-    def row_array( self, query: str ) -> list:
+    def row_array( self, query: str, params = None ) -> list:
         """Return a list of database rows that result from the given query.  Queries that return no rows
         return an empty list.
 
         """
-        cur = self.db.cursor()
-        cur.execute( query )
+        cur = self.cursor()
+        cur.execute( query, params )
         data = cur.fetchall()
         return data
 
 
-    def row_dict( self, query: str ) -> list:
+    def row_dict( self, query: str, params = None ) -> list:
         """Return an array of dictionaries that result from the given query, where the keys of each
         dictionary are the column names in the result and the values are the corresponding retrieve
         values.
 
         """
-        cur = self.db.cursor()
-        cur.execute( query )
+        cur = self.cursor()
+        cur.execute( query, params )
         data = cur.fetchall()
         results = []
         cols = tuple( [ d[ 0 ] for d in cur.description ] )
@@ -80,22 +316,65 @@ class reader( base ):
         return results
 
 
+    def iter_rows( self, query: str, params = None, batch_size: int = 1000 ):
+        """Generate the rows that result from the given query without holding them all in memory.  The
+        rows are read from an unbuffered server-side cursor, <batch_size> at a time.
+
+        An unbuffered cursor ties up its connection until every row is read, so the query runs on a
+        second connection checked out of the pool for the purpose.  This one stays free for other
+        statements while the rows are being consumed.
+
+        """
+        conn = self.pool.get()
+        done = False
+        try:
+            cur = conn.cursor( MySQLdb.cursors.SSCursor )
+            cur.execute( query, params )
+            while True:
+                rows = cur.fetchmany( batch_size )
+                if len( rows ) == 0: break
+                yield from rows
+            cur.close()
+            done = True
+        finally:
+            # A connection abandoned partway through the results would have to read the rest of
+            # them before it could be used again, so close it instead.
+            if done:
+                self.pool.put( conn )
+            else:
+                self.pool.discard( conn )
+
+
     def get_dict_by_ID( self, table: str, ID: str ) -> dict:
         """Return a row in dict form from a table having a designated ID field, by the ID."""
-        query = "SELECT * FROM {table} WHERE `ID` = '{ID}';".format( table = table, ID = ID )
-        vals = self.row_dict( query )
+        vals = self.row_dict(
+            "SELECT * FROM {table} WHERE `ID` = %s;".format( table = ident( table ) ),
+            ( ID, ) )
         if len( vals ) == 0:
             raise not_found
         return vals[ 0 ]
 
 
-    def execute( self, query: str ):
+    def execute( self, query: str, params = None ) -> int:
         """Execute a query.  Results are stored in the cursor object associated with the connection
-        object.
+        object.  <params>, if given, are the values for the query's %s placeholders, which the
+        driver quotes and escapes.  Return the number of rows affected.
+
+        """
+        cur = self.cursor()
+        cur.execute( query, params )
+        return cur.rowcount
+
+
+    def execute_many( self, query: str, rows: list ):
+        """Execute a parameterized query once for each tuple of parameters in <rows>.  For an INSERT
+        ... VALUES statement the rows are sent as a single multi-row insert (split only as needed to
+        fit the server's packet size limit).  Does nothing if there are no rows.
 
         """
-        cur = self.db.cursor()
-        cur.execute( query )
+        if len( rows ) == 0: return
+        cur = self.cursor()
+        cur.executemany( query, rows )
 
 
 
@@ -111,18 +390,15 @@ class reader_writer( reader ):
         dictionary values are intended row contents.
 
         """
-        indices = dict.keys()
-        values = dict.values()
+        indices = list( dict.keys() )
         try:
             self.execute(
                 "INSERT INTO {table} ( {indices} ) VALUES ( {values} );"
                 .format(
-                    table = table,
-                    indices = ', '.join( map( esc, indices ) ),
-                    values = ', '.join( map(
-                        lambda x:
-                        "'{}'".format( esc( x ) ),
-                        values ) ) ) )
+                    table   = ident( table ),
+                    indices = ', '.join( map( ident, indices ) ),
+                    values  = in_list( len( indices ) ) ),
+                [ dict[ idx ] for idx in indices ] )
             self.commit()
 
         except mdb.IntegrityError:
@@ -134,32 +410,31 @@ class reader_writer( reader ):
         key is the primary key column name.
 
         """
-        indices = values.keys()
+        indices = list( values.keys() )
         self.execute(
-            "UPDATE {table} SET {assigns} WHERE `{key}` = '{val}';".format(
-                table = table,
-                assigns = ', '.join( map(
-                    lambda idx:
-                       "`{col}`='{val}'".format(
-                           col = idx,
-                           val = esc( values[ idx ] ) ),
-                    indices ) ),
-                key = key,
-                val = values[ key ] ) )
+            "UPDATE {table} SET {assigns} WHERE {key} = %s;".format(
+                table   = ident( table ),
+                assigns = ', '.join( [ ident( idx ) + ' = %s' for idx in indices ] ),
+                key     = ident( key ) ),
+            [ values[ idx ] for idx in indices ] + [ values[ key ] ] )
         self.commit()
 
 
     def delete( self, table: str, keyname: str, keyvalue: str ):
         """Delete the row having the given kay value for the given key name"""
         self.execute(
-            "DELETE FROM {table} WHERE `{name}` = '{value}';".format(
-                table = table,
-                name  = keyname,
-                value = keyvalue ) )
+            "DELETE FROM {table} WHERE {name} = %s;".format(
+                table = ident( table ),
+                name  = ident( keyname ) ),
+            ( keyvalue, ) )
         self.commit()
 
 
-
     def commit( self ):
         """Commit any pending transactions."""
         self.db.commit()
+
+
+    def rollback( self ):
+        """Discard any pending transactions."""
+        self.db.rollback()
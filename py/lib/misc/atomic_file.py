@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              atomic_file.py
+#  Description:       Replacing a file in one step
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:58:38 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Replacing a file in one step
+
+   For files such as saved indexes that other processes may be reading, or writing, at the same
+   time.  The new contents go to a temporary file of its own in the same directory, which is moved
+   into place only once it's complete, so a reader never sees a partial file and two writers don't
+   write over each other; the last one to finish wins.
+
+       with atomic_file.replacing( path ) as f:
+           f.write( data )
+
+"""
+
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def replacing( path: str ):
+    """Open a new file, for writing in binary, that takes the place of the one at <path> when the
+    block ends.  If the block raises, or the file can't be written or moved into place, the
+    temporary file is deleted and the exception passed on; whatever was at <path> is untouched.
+
+    """
+    fd, tmp = tempfile.mkstemp( dir = os.path.dirname( os.path.abspath( path ) ),
+                                prefix = os.path.basename( path ) + '.' )
+    try:
+        with os.fdopen( fd, 'wb' ) as f:
+            yield f
+        os.replace( tmp, path )
+    except BaseException:
+        try:
+            os.unlink( tmp )
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              keyword_index.py
+#  Description:       In-memory inverted index of catalog keywords
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:22:49 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""In-memory inverted index of catalog keywords
+
+   Holds the same information as bib_keywords, so that searches can be answered without a trip to
+   the database.  Each record gets an ordinal, in the order records are added.  Each keyword has a
+   posting list of the records it appears in, sorted by ordinal and packed into bytes as
+
+     varint( ordinal - previous ordinal )
+     varint( length of what follows )
+     varint( instance * 4 + namespace ), varint( offset ), ...      for each occurrence
+
+   A record that changes gets a new ordinal, so its postings can be appended to the lists, and the
+   old ordinal is marked removed.  Once enough ordinals are dead, the lists are rewritten without
+   them.  The index can be saved to a file and loaded from it, and brought up to date from the
+   catalog afterward.
+
+       idx = keyword_index.index.build( db )
+       idx.save( path )
+       ...
+       idx = keyword_index.index.load( path )
+       idx.catch_up( db )
+       db.keyword_index = idx                  # db keeps it current from here on
+       idx.search( 'roman empire', mode = 'phrase' )
+
+   By default search() matches any of the terms, as db.mysql.MARC.search() does, and the two rank
+   the same records the same way.
+
+"""
+
+import array
+import bisect
+import collections
+import struct
+import sys
+import threading
+from datetime import datetime
+
+from misc import atomic_file, keywords
+
+
+NAMESPACES = '-TAS'                 # namespace codes, by their number in the posting lists
+NAMESPACE_CODES = { ns : i for i, ns in enumerate( NAMESPACES ) }
+
+FT = '\x1E'                         # separates the control numbers and keywords in a snapshot
+
+SNAPSHOT_MAGIC  = b'KWIDX002'
+SNAPSHOT_HEADER = struct.Struct( '<8s14sQQQQ' )
+# magic, 005 stamp, records, keywords, bytes of control numbers, bytes of keywords
+
+
+def put_varint( buf: bytearray, n: int ):
+    """Append the non-negative integer <n> to <buf>, seven bits per byte, low bits first."""
+    while n >= 0x80:
+        buf.append( ( n & 0x7F ) | 0x80 )
+        n >>= 7
+    buf.append( n )
+
+
+def get_varint( buf, i: int ) -> tuple:
+    """Return the integer encoded at <buf>[ <i> ] and the position following it."""
+    b = buf[ i ]
+    if b < 0x80:
+        return b, i + 1
+    n = b & 0x7F
+    shift = 7
+    while True:
+        i += 1
+        b = buf[ i ]
+        n |= ( b & 0x7F ) << shift
+        if b < 0x80:
+            return n, i + 1
+        shift += 7
+
+
+def now() -> str:
+    """Return the current time as a 005-style time stamp."""
+    return datetime.now().strftime( '%Y%m%d%H%M%S' )
+
+
+class index( object ):
+    """Inverted index from keywords to the records containing them.  Safe to use from several
+    threads.
+
+    """
+
+    # Posting lists decoded by decoded() that are kept on hand.
+    CACHE_SIZE = 1024
+
+    # Rewrite the posting lists when at least this share of ordinals are dead.
+    COMPACT_RATIO = 0.25
+
+    def __init__( self ):
+        self.lock     = threading.RLock()
+        self.ctl_nums = []              # ordinal -> ctl_num, or None if removed
+        self.ordinals = {}              # ctl_num -> ordinal
+        self.postings = {}              # keyword -> bytearray
+        self.last     = {}              # keyword -> last ordinal in its posting list
+        self.removed  = 0               # dead ordinals
+        self.stamp    = None            # 005 time stamp as of which the index is current
+        self.cache    = collections.OrderedDict()     # keyword -> decoded() of its posting list
+
+
+    def __len__( self ):
+        return len( self.ordinals )
+
+    def __contains__( self, ctl_num: str ):
+        return ctl_num in self.ordinals
+
+
+    #-------------------------------------------------------------------
+    # Building and updating.
+
+    def add( self, ctl_num: str, rows ):
+        """Index the record having the given control number, whose ( keyword, namespace, instance,
+        offset ) rows are <rows>.  Any earlier entry for the record is replaced.
+
+        """
+        occurrences = {}
+        for kw, ns, instance, offset in rows:
+            occurrences.setdefault( kw, [] ).append(
+                ( instance * 4 + NAMESPACE_CODES.get( ns, 0 ), offset ) )
+
+        with self.lock:
+            self.discard( ctl_num )
+            ordinal = len( self.ctl_nums )
+            self.ctl_nums.append( ctl_num )
+            self.ordinals[ ctl_num ] = ordinal
+            for kw, places in occurrences.items():
+                self.append( kw, ordinal, places )
+            self.maybe_compact()
+
+
+    def append( self, kw: str, ordinal: int, places: list ):
+        """Add an entry for <ordinal> to the end of the posting list for <kw>.  Call with the lock held."""
+        entry = bytearray()
+        for code, offset in sorted( places ):
+            put_varint( entry, code )
+            put_varint( entry, offset )
+        try:
+            buf = self.postings[ kw ]
+        except KeyError:
+            buf = self.postings[ kw ] = bytearray()
+        put_varint( buf, ordinal - self.last.get( kw, 0 ) )
+        put_varint( buf, len( entry ) )
+        buf += entry
+        self.last[ kw ] = ordinal
+        self.cache.pop( kw, None )
+
+
+    def remove( self, ctl_num: str ):
+        """Drop the record having the given control number from the index, if it's there."""
+        with self.lock:
+            self.discard( ctl_num )
+            self.maybe_compact()
+
+
+    def discard( self, ctl_num: str ):
+        """Mark the ordinal of the record dead.  Call with the lock held."""
+        ordinal = self.ordinals.pop( ctl_num, None )
+        if ordinal is not None:
+            self.ctl_nums[ ordinal ] = None
+            self.removed += 1
+
+
+    def maybe_compact( self ):
+        """Compact the index if enough of it is dead.  Call with the lock held."""
+        if self.removed > 0 and self.removed >= self.COMPACT_RATIO * len( self.ctl_nums ):
+            self.compact()
+
+
+    def compact( self ):
+        """Rewrite the posting lists without the dead ordinals, renumbering the live ones."""
+        with self.lock:
+            renumber = {}
+            ctl_nums = []
+            for ordinal, ctl_num in enumerate( self.ctl_nums ):
+                if ctl_num is not None:
+                    renumber[ ordinal ] = len( ctl_nums )
+                    ctl_nums.append( ctl_num )
+
+            postings = {}
+            last = {}
+            for kw, buf in self.postings.items():
+                out = bytearray()
+                prev = 0
+                for ordinal, start, end in self.entries( buf ):
+                    new = renumber.get( ordinal )
+                    if new is None: continue
+                    put_varint( out, new - prev )
+                    put_varint( out, end - start )
+                    out += buf[ start : end ]
+                    prev = new
+                if len( out ) > 0:
+                    postings[ kw ] = out
+                    last[ kw ] = prev
+
+            self.ctl_nums = ctl_nums
+            self.ordinals = { ctl_num : i for i, ctl_num in enumerate( ctl_nums ) }
+            self.postings = postings
+            self.last     = last
+            self.removed  = 0
+            self.cache.clear()
+
+
+    @classmethod
+    def build( cls, db, from_fields: bool = False ):
+        """Return an index of every record in the catalog accessed through <db>, a db.mysql.MARC.  The
+        keywords are read from bib_keywords, or, if <from_fields>, extracted from the records'
+        fields directly.
+
+        """
+        idx = cls()
+        idx.stamp = now()
+        if from_fields:
+            for ctl_num, values in db.scan_keyword_values():
+                idx.add( ctl_num, keywords.keyword_rows( values ) )
+        else:
+            for ctl_num, rows in db.scan_keywords():
+                idx.add( ctl_num, rows )
+        return idx
+
+
+    def catch_up( self, db ):
+        """Bring the index up to date with the catalog accessed through <db>: reindex records changed
+        since it was last current and drop those no longer there.
+
+        """
+        stamp = now()
+        ctl_nums = db.changed_since( self.stamp ) if self.stamp is not None else []
+        for i in range( 0, len( ctl_nums ), db.READ_CHUNK ):
+            for rec in db.read_many( ctl_nums[ i : i + db.READ_CHUNK ] ):
+                self.add( rec.ctl_num(), keywords.record_keywords( rec ) )
+
+        with self.lock:
+            known = list( self.ordinals )
+        for i in range( 0, len( known ), db.READ_CHUNK ):
+            chunk = known[ i : i + db.READ_CHUNK ]
+            present = db.existing( chunk )
+            for ctl_num in chunk:
+                if ctl_num not in present:
+                    self.remove( ctl_num )
+        self.stamp = stamp
+
+
+    #-------------------------------------------------------------------
+    # Snapshots.
+
+    # A snapshot is plain data, not a pickle, so that loading one runs no code:
+    #
+    #   SNAPSHOT_HEADER
+    #   the control numbers by ordinal, in UTF-8, separated by FT
+    #   the keywords, likewise
+    #   the last ordinal in each keyword's posting list, as unsigned 64-bit integers, little-endian
+    #   the length of each keyword's posting list, likewise
+    #   the posting lists, one after another
+    #
+    def save( self, path: str ):
+        """Write the index to the file at <path>, replacing it in one step (see misc.atomic_file)."""
+        with atomic_file.replacing( path ) as f, self.lock:
+            if self.removed > 0:
+                self.compact()
+            kws = list( self.postings )
+            ctl_bytes = FT.join( self.ctl_nums ).encode( 'utf-8' )
+            kw_bytes  = FT.join( kws ).encode( 'utf-8' )
+            last    = array.array( 'Q', [ self.last[ kw ] for kw in kws ] )
+            lengths = array.array( 'Q', [ len( self.postings[ kw ] ) for kw in kws ] )
+            if sys.byteorder != 'little':
+                last.byteswap()
+                lengths.byteswap()
+            stamp = ( self.stamp or '' ).encode( 'ascii' )
+            f.write( SNAPSHOT_HEADER.pack( SNAPSHOT_MAGIC, stamp, len( self.ctl_nums ),
+                                           len( kws ), len( ctl_bytes ), len( kw_bytes ) ) )
+            f.write( ctl_bytes )
+            f.write( kw_bytes )
+            f.write( last.tobytes() )
+            f.write( lengths.tobytes() )
+            for kw in kws:
+                f.write( self.postings[ kw ] )
+
+
+    @classmethod
+    def load( cls, path: str ):
+        """Return the index saved in the file at <path>.  Raises ValueError if it isn't one."""
+        with open( path, 'rb' ) as f:
+            data = memoryview( f.read() )
+        try:
+            magic, stamp, count, kw_count, ctl_size, kw_size = SNAPSHOT_HEADER.unpack_from( data )
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError( 'wrong magic number' )
+
+            pos = SNAPSHOT_HEADER.size
+            ctl_nums = str( data[ pos : pos + ctl_size ], 'utf-8' ).split( FT ) if count else []
+            pos += ctl_size
+            kws = str( data[ pos : pos + kw_size ], 'utf-8' ).split( FT ) if kw_count else []
+            pos += kw_size
+            last = array.array( 'Q' )
+            last.frombytes( data[ pos : pos + 8 * kw_count ] )
+            pos += 8 * kw_count
+            lengths = array.array( 'Q' )
+            lengths.frombytes( data[ pos : pos + 8 * kw_count ] )
+            pos += 8 * kw_count
+            if sys.byteorder != 'little':
+                last.byteswap()
+                lengths.byteswap()
+            if ( len( ctl_nums ) != count or len( kws ) != kw_count or
+                 len( lengths ) != kw_count or pos + sum( lengths ) != len( data ) ):
+                raise ValueError( 'truncated' )
+        except ( ValueError, struct.error ) as e:
+            raise ValueError( '{}: not a keyword index: {}'.format( path, e ) )
+
+        idx = cls()
+        idx.stamp    = stamp.rstrip( b'\0' ).decode( 'ascii' ) or None
+        idx.ctl_nums = ctl_nums
+        idx.ordinals = { ctl_num : i for i, ctl_num in enumerate( ctl_nums ) }
+        idx.last     = dict( zip( kws, last ) )
+        for kw, length in zip( kws, lengths ):
+            idx.postings[ kw ] = bytearray( data[ pos : pos + length ] )
+            pos += length
+        return idx
+
+
+    #-------------------------------------------------------------------
+    # Reading the posting lists.
+
+    @staticmethod
+    def entries( buf ):
+        """Generate ( ordinal, start, end ) for each entry in a posting list, where buf[ start : end ]
+        holds the entry's occurrences.
+
+        """
+        i = 0
+        n = len( buf )
+        ordinal = 0
+        while i < n:
+            delta, i = get_varint( buf, i )
+            length, i = get_varint( buf, i )
+            ordinal += delta
+            yield ordinal, i, i + length
+            i += length
+
+
+    def decoded( self, kw: str ) -> tuple:
+        """Return lists of the ordinals in the posting list for <kw>, dead ones included, and of the
+        start and end of each one's occurrences in the list.
+
+        """
+        with self.lock:
+            try:
+                self.cache.move_to_end( kw )
+                return self.cache[ kw ]
+            except KeyError:
+                pass
+            ordinals, starts, ends = [], [], []
+            buf = self.postings.get( kw )
+            if buf is not None:
+                for ordinal, start, end in self.entries( buf ):
+                    ordinals.append( ordinal )
+                    starts.append( start )
+                    ends.append( end )
+            d = self.cache[ kw ] = ( ordinals, starts, ends )
+            if len( self.cache ) > self.CACHE_SIZE:
+                self.cache.popitem( last = False )
+            return d
+
+
+    def docs( self, kw: str ) -> list:
+        """Return the ordinals in the posting list for <kw>, dead ones included, in order."""
+        return self.decoded( kw )[ 0 ]
+
+
+    def occurrences( self, kw: str, wanted = None, namespaces = None ) -> dict:
+        """Return a dictionary mapping ordinals to lists of ( namespace, instance, offset ) for the
+        occurrences of <kw>.  Only ordinals in <wanted> and namespaces in <namespaces> are
+        included, if they're given.
+
+        """
+        result = {}
+        with self.lock:
+            buf = self.postings.get( kw )
+            if buf is None: return result
+            ordinals, starts, ends = self.decoded( kw )
+
+            # Look up a few wanted ordinals directly rather than going through the whole list.
+            if wanted is None:
+                picks = range( len( ordinals ) )
+            elif len( wanted ) * 8 < len( ordinals ):
+                picks = []
+                for o in sorted( wanted ):
+                    k = bisect.bisect_left( ordinals, o )
+                    if k < len( ordinals ) and ordinals[ k ] == o:
+                        picks.append( k )
+            else:
+                picks = [ k for k, o in enumerate( ordinals ) if o in wanted ]
+
+            for k in picks:
+                places = []
+                i, end = starts[ k ], ends[ k ]
+                while i < end:
+                    code, i = get_varint( buf, i )
+                    offset, i = get_varint( buf, i )
+                    ns = NAMESPACES[ code & 3 ]
+                    if namespaces is None or ns in namespaces:
+                        places.append( ( ns, code >> 2, offset ) )
+                if len( places ) > 0:
+                    result[ ordinals[ k ] ] = places
+        return result
+
+
+    #-------------------------------------------------------------------
+    # Queries.
+
+    def match( self, terms: list, mode: str = 'and', namespaces = None ) -> list:
+        """Return the control numbers of the records matching the tokenized search <terms>, in index
+        order.  <mode> is 'and' for records having every term, 'or' for records having any, or
+        'phrase' for records having the terms next to each other and in order within a single
+        title, author, or subject.  If <namespaces> is given, only keywords in those namespaces
+        count.
+
+        """
+        if mode not in ( 'and', 'or', 'phrase' ):
+            raise ValueError( 'unknown search mode: {}'.format( mode ) )
+        if len( terms ) == 0: return []
+        distinct = list( dict.fromkeys( terms ) )
+
+        with self.lock:
+            if namespaces is None:
+                sets = [ set( self.docs( kw ) ) for kw in distinct ]
+            else:
+                sets = [ set( self.occurrences( kw, namespaces = namespaces ) ) for kw in distinct ]
+
+            if mode == 'or':
+                found = set().union( *sets )
+            else:
+                sets.sort( key = len )
+                found = sets[ 0 ].intersection( *sets[ 1: ] )
+
+            if mode == 'phrase' and len( terms ) > 1 and len( found ) > 0:
+                places = [ self.occurrences( kw, found, namespaces ) for kw in terms ]
+                found = set( o for o in found if self.has_phrase( o, places ) )
+
+            return [ self.ctl_nums[ o ] for o in sorted( found ) if self.ctl_nums[ o ] is not None ]
+
+
+    @staticmethod
+    def has_phrase( ordinal: int, places: list ) -> bool:
+        """True if the terms whose occurrences are <places> (one dictionary per term, as returned by
+        occurrences()) are consecutive somewhere in record <ordinal>.
+
+        """
+        following = [ set( p[ ordinal ] ) for p in places[ 1: ] ]
+        for ns, instance, offset in places[ 0 ][ ordinal ]:
+            if all( ( ns, instance, offset + k + 1 ) in s for k, s in enumerate( following ) ):
+                return True
+        return False
+
+
+    def search(
+            self,
+            query      : str,
+            mode       : str  = 'or',
+            namespaces        = None,
+            limit      : int  = 20,
+            offset     : int  = 0 )     -> list:
+        """Search for the words in <query>, matched according to <mode> as in match().  Return a list
+        of ( ctl_num, score ) for the best matching records, ranked and paged as with
+        db.mysql.MARC.search(), and with the default <mode> the same list.
+
+        """
+        terms = keywords.tokenize( query )
+        limit = min( limit, keywords.SEARCH_CANDIDATES - offset )
+        if len( terms ) == 0 or limit <= 0: return []
+        distinct = list( dict.fromkeys( terms ) )
+
+        with self.lock:
+            matched = self.match( terms, mode, namespaces )
+            if len( matched ) == 0: return []
+
+            # Take the candidates having the most terms, then those having them in the best
+            # namespace, as db.mysql.MARC.keyword_candidates() does, and score them.
+            if len( matched ) > keywords.SEARCH_CANDIDATES:
+                coverage = collections.Counter()
+                weight = {}
+                for kw in distinct:
+                    for ordinal, places in self.occurrences( kw, namespaces = namespaces ).items():
+                        coverage[ ordinal ] += 1
+                        weight[ ordinal ] = max(
+                            [ weight.get( ordinal, 1 ) ] +
+                            [ keywords.NAMESPACE_WEIGHTS.get( ns, 1 ) for ns, i, o in places ] )
+                matched.sort( key = lambda c: ( -coverage[ self.ordinals[ c ] ],
+                                                -weight[ self.ordinals[ c ] ], c ) )
+                matched = matched[ : keywords.SEARCH_CANDIDATES ]
+
+            wanted = set( self.ordinals[ c ] for c in matched )
+            postings = {}
+            for kw in distinct:
+                for ordinal, places in self.occurrences( kw, wanted, namespaces ).items():
+                    postings.setdefault( ordinal, [] ).extend(
+                        ( kw, ns, instance, off ) for ns, instance, off in places )
+
+            ranked = sorted(
+                ( ( c, keywords.score( terms, postings.get( self.ordinals[ c ], [] ) ) )
+                  for c in matched ),
+                key = lambda r: ( -r[1], r[0] ) )
+        return ranked[ offset : offset + limit ]
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              keywords.py
+#  Description:       Search keywords for bibliographic records
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:11:42 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Search keywords for bibliographic records
+
+   The keywords of a record come from its title (245 $a), its main entry (1xx $a), and its topical
+   subjects (650, every subfield), in the T, A, and S namespaces respectively.  Each of those values
+   is an instance within its namespace, numbered from 0 in tag, sequence, and subfield order, and
+   each keyword has an offset within its instance.  These are the rows of bib_keywords.
+
+   Searches tokenize their terms the same way, and score() ranks a record against them.
+
+"""
+
+import re
+import unicodedata
+
+
+# Words too common to be worth indexing.
+STOP_WORDS = frozenset( [
+    'and',
+    'etc',
+    'for',
+    'from',
+    'in',
+    'of',
+    'on',
+    'the',
+    'to',
+    ] )
+
+# Letters that have no decomposition but should still fold to plain ASCII.  Applied after
+# casefold(), so only the lowercase forms are needed.
+FOLDS = str.maketrans( {
+    '\u00e6' : 'ae',    # ae ligature
+    '\u00f0' : 'd',     # eth
+    '\u00f8' : 'o',     # o with stroke
+    '\u00fe' : 'th',    # thorn
+    '\u0111' : 'd',     # d with stroke
+    '\u0131' : 'i',     # dotless i
+    '\u0142' : 'l',     # l with stroke
+    '\u0153' : 'oe',    # oe ligature
+    '\u2019' : None,    # right single quotation mark, as an apostrophe
+    '\u02b9' : None,    # soft sign (modifier prime)
+    '\u02ba' : None,    # hard sign (modifier double prime)
+    } )
+
+# Combining marks left over when precomposed letters are decomposed.  MARC-8 puts a diacritic
+# before the letter it modifies and Unicode puts it after, but since they're dropped either way
+# both come out the same.
+COMBINING = re.compile( '[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]+' )
+
+# A word is a run of two or more letters and digits.  Single characters aren't worth indexing.
+WORD = re.compile( r'[^\W_]{2,}' )
+
+# Nor are stop words or numbers of two digits.
+DROP = STOP_WORDS | frozenset( '{:02d}'.format( n ) for n in range( 100 ) )
+
+
+def fold( s: str ) -> str:
+    """Return the casefolded string <s> with its diacritics removed and letters folded to ASCII
+    where that makes sense.
+
+    """
+    return COMBINING.sub( '', unicodedata.normalize( 'NFKD', s ) ).translate( FOLDS )
+
+
+def normalize( s: str ) -> str:
+    """Return <s> casefolded and folded, with the apostrophes and periods that join the parts of a word
+    dropped: "U.S." is "us" and "O'Brien" is "obrien".  Every other character that isn't a letter
+    or digit separates words.
+
+    """
+    s = s.casefold().replace( "'", '' ).replace( '.', '' )
+    if not s.isascii():
+        s = fold( s )
+    return s
+
+
+def tokenize( s: str ) -> list:
+    """Return the keywords in <s>, in order.  The position of a keyword in the list is its offset."""
+    return [ w for w in WORD.findall( normalize( s ) ) if w not in DROP ]
+
+
+def tokenize_many( strings ) -> list:
+    """Return the list of keywords for each of <strings>, as tokenize() would."""
+    findall = WORD.findall
+    return [ [ w for w in findall( normalize( s ) ) if w not in DROP ] for s in strings ]
+
+
+def namespace( tag: str, code: str ) -> str:
+    """Return the keyword namespace for subfield <code> of <tag>, or None if it isn't indexed."""
+    if tag == '245':
+        return 'T' if code == 'a' else None
+    if tag[ 0 ] == '1':
+        return 'A' if code == 'a' else None
+    if tag == '650':
+        return 'S'
+    return None
+
+
+def record_values( rec ) -> list:
+    """Return ( namespace, value ) for each indexed subfield of the record, in tag, sequence, and
+    subfield order.
+
+    """
+    values = []
+    for t in sorted( rec.tags, key = lambda t: ( t.tag, t.seq ) ):
+        for code, val in t.fields:
+            ns = namespace( t.tag, code )
+            if ns is not None and val is not None:
+                values.append( ( ns, val ) )
+    return values
+
+
+def keyword_rows( values ) -> list:
+    """Return ( keyword, namespace, instance, offset ) for the keywords in the ( namespace, value )
+    pairs of one record.
+
+    """
+    rows = []
+    instances = {}
+    for ( ns, val ), words in zip( values, tokenize_many( val for ns, val in values ) ):
+        instance = instances.get( ns, 0 )
+        instances[ ns ] = instance + 1
+        for offset, w in enumerate( words ):
+            rows.append( ( w, ns, instance, offset ) )
+    return rows
+
+
+def record_keywords( rec ) -> list:
+    """Return ( keyword, namespace, instance, offset ) for each keyword of the record."""
+    return keyword_rows( record_values( rec ) )
+
+
+# Most records a search scores.  Those matching the most distinct terms are taken first, then
+# those matching them in the best namespace by NAMESPACE_WEIGHTS, and results past this many
+# aren't returned.
+#
+SEARCH_CANDIDATES = 1000
+
+
+# Ranking.  A record's score is a weighted sum of three parts, each between 0 and 1:
+#
+#   coverage    the fraction of the search terms it has at all
+#   namespace   how good a place the terms were found in, by the weight of the best namespace for
+#               each term: title over author over subject
+#   proximity   the fraction of adjacent pairs of search terms that are adjacent, in the same
+#               order, within a single instance, by the weight of its namespace
+#
+# Coverage counts for most, so records having every term come ahead of those that don't except
+# when the terms are many and poorly placed.
+#
+NAMESPACE_WEIGHTS = { 'T' : 3, 'A' : 2, 'S' : 1, '-' : 1 }
+MAX_NAMESPACE_WEIGHT = max( NAMESPACE_WEIGHTS.values() )
+
+COVERAGE_WEIGHT  = 4.0
+NAMESPACE_WEIGHT = 1.0
+PROXIMITY_WEIGHT = 2.0
+
+
+def score( terms: list, postings ) -> float:
+    """Return the score of a record for the tokenized search <terms>, given its ( keyword, namespace,
+    instance, offset ) rows for those terms.
+
+    """
+    if len( terms ) == 0: return 0.0
+
+    best = {}           # keyword -> best namespace weight
+    places = {}         # ( namespace, instance ) -> keyword -> set of offsets
+    for kw, ns, instance, offset in postings:
+        w = NAMESPACE_WEIGHTS.get( ns, 1 )
+        if w > best.get( kw, 0 ):
+            best[ kw ] = w
+        places.setdefault( ( ns, instance ), {} ).setdefault( kw, set() ).add( offset )
+
+    distinct = len( set( terms ) )
+    coverage = len( best ) / distinct
+    namespace = sum( best.values() ) / ( distinct * MAX_NAMESPACE_WEIGHT )
+
+    proximity = 0.0
+    pairs = list( zip( terms, terms[ 1: ] ) )
+    if len( pairs ) > 0:
+        for ( ns, instance ), offsets in places.items():
+            adjacent = 0
+            for a, b in pairs:
+                if a in offsets and b in offsets:
+                    following = offsets[ b ]
+                    if any( o + 1 in following for o in offsets[ a ] ):
+                        adjacent += 1
+            p = adjacent / len( pairs ) * NAMESPACE_WEIGHTS.get( ns, 1 ) / MAX_NAMESPACE_WEIGHT
+            proximity = max( proximity, p )
+
+    return ( COVERAGE_WEIGHT  * coverage +
+             NAMESPACE_WEIGHT * namespace +
+             PROXIMITY_WEIGHT * proximity )
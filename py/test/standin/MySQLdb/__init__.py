@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              MySQLdb/__init__.py
+#  Description:       Stand-in for MySQLdb over sqlite3
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:44:05 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Stand-in for MySQLdb over sqlite3
+
+   Enough of the MySQLdb interface for db.mysql to run against a sqlite file, so that the database
+   layer can be tested and benchmarked on a machine without a MySQL server.  Put py/test/standin
+   ahead of site-packages on sys.path, create a database, and connect to it by the host name it was
+   created under:
+
+       import MySQLdb
+       MySQLdb.create( 'test' )
+       db = MARC.MARC( { 'host' : 'test', 'user' : 'u', 'pass' : 'p', 'db' : 'franklin' } )
+
+   The schema in schema.sql follows SQL/bib.sql, down to comparing control numbers the way the
+   utf8mb4_unicode_ci collation does: ignoring case and trailing spaces.  Each connection has its
+   own sqlite connection to a file in WAL mode, so transactions are isolated as they would be in
+   InnoDB.  Statements are rewritten where the dialects differ: %s placeholders, INSERT IGNORE,
+   CREATE TABLE ... LIKE, and RENAME TABLE.
+
+   Every statement executed is appended to <log>, so that tests can count round trips.
+
+"""
+
+import os
+import re
+import sqlite3
+import tempfile
+
+Error            = sqlite3.Error
+IntegrityError   = sqlite3.IntegrityError
+OperationalError = sqlite3.OperationalError
+
+SCHEMA = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'schema.sql' )
+
+databases = {}          # host name -> sqlite file
+log       = []          # statements executed, in order
+
+INSERT_IGNORE = re.compile( r'INSERT\s+IGNORE', re.I )
+CREATE_LIKE   = re.compile( r'\s*CREATE\s+TABLE\s+(\w+)\s+LIKE\s+(\w+)', re.I )
+RENAME        = re.compile( r'\s*RENAME\s+TABLE\s', re.I )
+RENAME_PAIR   = re.compile( r'(\w+)\s+TO\s+(\w+)', re.I )
+
+
+def mysql_ci( a: str, b: str ) -> int:
+    """Compare the way utf8mb4_unicode_ci does, near enough: case-blind, trailing spaces ignored."""
+    a = a.rstrip( ' ' ).casefold()
+    b = b.rstrip( ' ' ).casefold()
+    return ( a > b ) - ( a < b )
+
+
+def create( host: str, path: str = None ) -> str:
+    """Create an empty database from the schema, in the file at <path> or a new temporary file, and
+    make it the one connections to <host> open.  Return the path.
+
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp( prefix = 'franklin-', suffix = '.sqlite' )
+        os.close( fd )
+    with open( SCHEMA ) as f:
+        schema = f.read()
+    conn = Connection( path )
+    conn.raw.execute( 'PRAGMA journal_mode = WAL' )
+    conn.raw.executescript( schema )
+    conn.close()
+    databases[ host ] = path
+    return path
+
+
+def connect( host, user = None, passwd = None, db = None, **kwargs ):
+    try:
+        return Connection( databases[ host ] )
+    except KeyError:
+        raise OperationalError( "no stand-in database for host '{}'".format( host ) )
+
+
+class Connection( object ):
+
+    def __init__( self, path: str ):
+        self.raw = sqlite3.connect( path, timeout = 30, check_same_thread = False )
+        self.raw.create_collation( 'mysql_ci', mysql_ci )
+        self.raw.execute( 'PRAGMA foreign_keys = ON' )
+
+    def cursor( self, cls = None ):
+        return ( cls or Cursor )( self )
+
+    def commit( self ):             self.raw.commit()
+    def rollback( self ):           self.raw.rollback()
+    def close( self ):              self.raw.close()
+    def ping( self, *args ):        self.raw.execute( 'SELECT 1' )
+    def autocommit( self, on ):     self.raw.isolation_level = None if on else ''
+
+
+class Cursor( object ):
+
+    def __init__( self, conn: Connection ):
+        self.conn        = conn
+        self.cur         = conn.raw.cursor()
+        self.rowcount    = -1
+        self.description = None
+
+    def execute( self, query: str, params = None ):
+        log.append( query )
+        if RENAME.match( query ):
+            for old, new in RENAME_PAIR.findall( query ):
+                self.cur.execute( 'ALTER TABLE {} RENAME TO {}'.format( old, new ) )
+            return 0
+
+        m = CREATE_LIKE.match( query )
+        if m:
+            sql = self.conn.raw.execute( 'SELECT sql FROM sqlite_master WHERE name = ?',
+                                         ( m.group( 2 ), ) ).fetchone()[0]
+            self.cur.execute( sql.replace( m.group( 2 ), m.group( 1 ), 1 ) )
+            return 0
+
+        self.cur.execute( translate( query ), tuple( params or () ) )
+        self.rowcount    = self.cur.rowcount
+        self.description = self.cur.description
+        return self.rowcount
+
+    def executemany( self, query: str, rows ):
+        log.append( query )
+        self.cur.executemany( translate( query ), [ tuple( r ) for r in rows ] )
+        self.rowcount = self.cur.rowcount
+        return self.rowcount
+
+    def fetchone( self ):           return self.cur.fetchone()
+    def fetchall( self ):           return self.cur.fetchall()
+    def fetchmany( self, n ):       return self.cur.fetchmany( n )
+    def close( self ):              self.cur.close()
+    def __iter__( self ):           return iter( self.cur )
+
+
+def translate( query: str ) -> str:
+    """Rewrite a MySQL statement for sqlite."""
+    return INSERT_IGNORE.sub( 'INSERT OR IGNORE', query ).replace( '%s', '?' )
+
+
+from MySQLdb import cursors
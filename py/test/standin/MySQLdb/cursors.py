@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              MySQLdb/cursors.py
+#  Description:       Cursor classes for the MySQLdb stand-in
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:44:05 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Cursor classes for the MySQLdb stand-in.  sqlite reads rows as they're fetched, so the unbuffered
+   cursor is the plain one.
+
+"""
+
+from MySQLdb import Cursor
+
+SSCursor = Cursor
@@ -0,0 +1,68 @@
+-- -------------------------------------------------------------------------------------------------
+-- SQL/bib.sql, in sqlite's dialect, for the MySQLdb stand-in.  Keep the two in step.
+--
+-- Control numbers compare under mysql_ci, the stand-in's approximation of utf8mb4_unicode_ci.
+-- -------------------------------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS MARC_leader (
+       ctl_num      CHAR(32)          NOT NULL UNIQUE COLLATE mysql_ci,
+       val          CHAR(25),
+       digest       CHAR(32)
+);
+CREATE INDEX IF NOT EXISTS MARC_leader_digest ON MARC_leader ( ctl_num, digest );
+
+
+CREATE TABLE IF NOT EXISTS MARC_control_fields (
+       ctl_num      CHAR(32)          NOT NULL COLLATE mysql_ci,
+       tag          CHAR(3)           NOT NULL,
+       val          VARCHAR(128),
+
+       PRIMARY KEY ( ctl_num, tag ),
+       FOREIGN KEY ( ctl_num ) REFERENCES MARC_leader ( ctl_num )
+               ON DELETE CASCADE
+               ON UPDATE CASCADE
+);
+
+
+CREATE TABLE IF NOT EXISTS MARC_indicators (
+       ctl_num      CHAR(32)          NOT NULL COLLATE mysql_ci,
+       tag          CHAR(3)           NOT NULL,
+       seq          TINYINT           NOT NULL DEFAULT 1,
+       ind_1        CHAR                  NULL DEFAULT ' ',
+       ind_2        CHAR                  NULL DEFAULT ' ',
+
+       PRIMARY KEY ( ctl_num, tag, seq ),
+       FOREIGN KEY ( ctl_num ) REFERENCES MARC_leader ( ctl_num )
+               ON DELETE CASCADE
+               ON UPDATE CASCADE
+);
+
+
+CREATE TABLE IF NOT EXISTS MARC_fields (
+       ctl_num      CHAR(32)          NOT NULL COLLATE mysql_ci,
+       tag          CHAR(3)           NOT NULL,
+       seq          TINYINT           NOT NULL DEFAULT 1,
+       pos          TINYINT           NOT NULL DEFAULT 1,
+       code         CHAR              NOT NULL DEFAULT 'a',
+       val          VARCHAR(2048),
+
+       FOREIGN KEY ( ctl_num ) REFERENCES MARC_leader ( ctl_num )
+               ON DELETE CASCADE
+               ON UPDATE CASCADE
+);
+CREATE INDEX IF NOT EXISTS MARC_fields_tag ON MARC_fields ( ctl_num, tag, seq, pos );
+
+
+CREATE TABLE IF NOT EXISTS bib_keywords (
+       ctl_num      CHAR(32)          NOT NULL COLLATE mysql_ci,
+       keyword      VARCHAR(256)      NOT NULL,
+       namespace    CHAR(1)           DEFAULT '-' CHECK ( namespace IN ( '-', 'A', 'S', 'T' ) ),
+       instance     SMALLINT          DEFAULT 0,
+       offset       SMALLINT          DEFAULT 0,
+
+       UNIQUE ( ctl_num, namespace, keyword, instance, offset ),
+       FOREIGN KEY ( ctl_num ) REFERENCES MARC_leader ( ctl_num )
+               ON DELETE CASCADE
+               ON UPDATE CASCADE
+);
+CREATE INDEX IF NOT EXISTS bib_keywords_keyword ON bib_keywords ( keyword, namespace );
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              test_db_marc.py
+#  Description:       db.mysql.MARC against the sqlite stand-in
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:44:05 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""db.mysql.MARC against the sqlite stand-in for MySQLdb (see standin/MySQLdb)
+
+   Each test gets a database of its own.
+
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.insert( 0, os.path.join( HERE, 'standin' ) )
+sys.path.append( os.path.join( HERE, '..', 'lib' ) )
+sys.path.append( os.path.join( HERE, '..', 'batch' ) )
+
+import MySQLdb
+
+from MARC     import MARC as MARC21
+from db       import CRUD, cache
+from db.mysql import MARC
+from misc     import keyword_index, keywords
+
+import load_marc
+import rebuild_keywords
+
+TEST_MARC = os.path.join( HERE, '..', '..', 'test.marc' )
+
+
+def content( rec: MARC21.record ) -> tuple:
+    return ( rec.leader,
+             dict( rec.ctl_fields ),
+             [ ( t.tag, t.seq, t.ind, t.fields.fields )
+               for t in sorted( rec.tags, key = lambda t: ( t.tag, t.seq ) ) ] )
+
+
+def sample_record( ctl: str = '666', title: str = None ) -> MARC21.record:
+    """Return test.marc without its 9xx tags, with the given 001 and, optionally, 245 $a."""
+    with open( TEST_MARC ) as f:
+        rec = MARC21.record( f.read() )
+    rec.strip_900s()
+    rec.ctl_fields[ '001' ] = ctl
+    if title is not None:
+        rec.find( '245' ).fields[ 'a' ] = title
+    return rec
+
+
+class catalog( unittest.TestCase ):
+    """Base for tests needing a catalog.  self.db is a db.mysql.MARC on an empty database."""
+
+    count = 0
+
+    def setUp( self ):
+        catalog.count += 1
+        self.host = 'test-{}-{}'.format( os.getpid(), catalog.count )
+        self.path = MySQLdb.create( self.host )
+        self.conn_data = { 'host' : self.host, 'user' : 'test', 'pass' : '', 'db' : 'franklin' }
+        self.db = MARC.MARC( dict( self.conn_data ) )
+
+    def tearDown( self ):
+        self.db.close()
+        MARC.driver.get_pool( self.conn_data ).close()
+        for suffix in [ '', '-wal', '-shm' ]:
+            try:
+                os.remove( self.path + suffix )
+            except OSError:
+                pass
+
+
+class read( catalog ):
+
+    def test_two_queries( self ):
+        rec = sample_record()
+        self.db.create( rec )
+        del MySQLdb.log[:]
+        self.assertEqual( content( self.db.read( 'DLC666' ) ), content( rec ) )
+        self.assertEqual( len( MySQLdb.log ), 2 )
+
+    def test_not_found( self ):
+        with self.assertRaises( CRUD.not_found ):
+            self.db.read( 'DLC404' )
+
+    def test_collation( self ):
+        # The database matches control numbers regardless of case and trailing spaces.
+        self.db.create( sample_record() )
+        self.assertEqual( self.db.read( 'dlc666' ).ctl_num(), 'DLC666' )
+        self.assertEqual( self.db.read( 'DLC666  ' ).ctl_num(), 'DLC666' )
+        self.assertEqual( [ r.ctl_num() for r in self.db.read_many( [ 'dlc666', 'DLC404' ] ) ],
+                          [ 'DLC666' ] )
+
+    def test_read_many( self ):
+        self.db.create_many( [ sample_record( str( i ) ) for i in range( 1, 6 ) ] )
+        IDs = [ 'DLC3', 'DLC1', 'DLC9', 'DLC5', 'DLC3' ]
+        self.assertEqual( [ r.ctl_num() for r in self.db.read_many( IDs ) ],
+                          [ 'DLC3', 'DLC1', 'DLC5', 'DLC3' ] )
+
+
+class write( catalog ):
+
+    def test_create_duplicate( self ):
+        self.db.create( sample_record() )
+        with self.assertRaises( CRUD.duplicate ):
+            self.db.create_many( [ sample_record( '1' ), sample_record() ] )
+        self.assertEqual( self.db.existing( [ 'DLC1', 'DLC666' ] ), { 'DLC666' } )
+
+    def test_delete( self ):
+        self.db.create( sample_record() )
+        self.db.delete( 'DLC666' )
+        with self.assertRaises( CRUD.not_found ):
+            self.db.read( 'DLC666' )
+        with self.assertRaises( CRUD.not_found ):
+            self.db.delete( 'DLC666' )
+        self.assertEqual( self.db.search( 'poop' ), [] )
+
+    def test_update_conflict( self ):
+        self.db.create( sample_record() )
+        mine, theirs = self.db.read( 'DLC666' ), self.db.read( 'DLC666' )
+        theirs.find( '245' ).fields[ 'a' ] = 'Theirs /'
+        self.db.update( theirs )
+        mine.find( '245' ).fields[ 'a' ] = 'Mine /'
+        stamp = mine.ctl_fields[ '005' ]
+        with self.assertRaises( CRUD.conflict ):
+            self.db.update( mine )
+        self.assertEqual( mine.ctl_fields[ '005' ], stamp )
+        self.assertEqual( content( self.db.read( 'DLC666' ) ), content( theirs ) )
+
+    def test_edit_commit_conflict( self ):
+        # Someone else saves the record between edit_commit()'s checksum check and its write.
+        self.db.create( sample_record() )
+        mine = self.db.read( 'DLC666' )
+        checksum = mine.digest()
+        mine.find( '245' ).fields[ 'a' ] = 'Mine /'
+
+        other = MARC.MARC( dict( self.conn_data ) )
+        theirs = other.read( 'DLC666' )
+        theirs.find( '245' ).fields[ 'a' ] = 'Theirs /'
+        read = self.db.read
+        def read_then_save( ID ):
+            rec = read( ID )
+            other.update( theirs )
+            return rec
+        self.db.read = read_then_save
+        stamp = mine.ctl_fields[ '005' ]
+        with self.assertRaises( CRUD.conflict ):
+            self.db.edit_commit( mine, checksum )
+        del self.db.read
+        other.close()
+        self.assertEqual( mine.ctl_fields[ '005' ], stamp )
+        self.assertEqual( content( self.db.read( 'DLC666' ) ), content( theirs ) )
+
+    def test_update_through_cache( self ):
+        # A record from elsewhere carries its own 005, so the stored one is given as the version.
+        self.db.create( sample_record() )
+        stored = self.db.read( 'DLC666' )
+        rec = sample_record( title = 'Elsewhere /' )
+        rec.ctl_fields[ '005' ] = '19990101000000.0'
+        cached = cache.cache( self.db )
+        cached.update( rec, version = stored.ctl_fields[ '005' ] )
+        self.assertEqual( content( cached.read( 'DLC666' ) ), content( rec ) )
+
+    def test_digest( self ):
+        # The stored digest is of the record as stored, without its 9xx tags, and an update fills
+        # one in where there was none.
+        with open( TEST_MARC ) as f:
+            rec = MARC21.record( f.read() )
+        rec.ctl_fields[ '001' ] = '666'
+        self.db.create( rec )
+        digest = lambda: self.db.get_digests( [ 'DLC666' ] )[ 'DLC666' ][ 0 ]
+        self.assertEqual( digest(), self.db.read( 'DLC666' ).digest() )
+
+        self.db.db.execute( 'UPDATE MARC_leader SET digest = NULL' )
+        self.db.db.commit()
+        self.db.update( rec )
+        self.assertEqual( digest(), self.db.read( 'DLC666' ).digest() )
+
+        stored = self.db.read( 'DLC666' )
+        stored.find( '245' ).fields[ 'a' ] = 'Edited /'
+        self.db.edit_commit( stored, self.db.read( 'DLC666' ).digest() )
+        self.assertEqual( digest(), stored.digest() )
+
+    def test_search( self ):
+        self.db.create_many( [ sample_record( '1', 'Poop on this book! /' ),
+                               sample_record( '2', 'This book! /' ) ] )
+        # Both have "poop" as a subject, but only the first has it in the title.
+        self.assertEqual( [ c for c, s in self.db.search( 'poop' ) ], [ 'DLC1', 'DLC2' ] )
+        self.assertEqual( [ c for c, s in self.db.search( 'poop', namespaces = [ 'T' ] ) ],
+                          [ 'DLC1' ] )
+
+    def test_search_pages( self ):
+        self.db.create_many( [ sample_record( str( i ), 'Poop {} /'.format( 'poop ' * i ) )
+                               for i in range( 1, 6 ) ] )
+        with mock.patch.object( keywords, 'SEARCH_CANDIDATES', 3 ):
+            everything = self.db.search( 'poop', limit = 10 )
+            self.assertEqual( len( everything ), 3 )
+            pages = [ self.db.search( 'poop', limit = 2, offset = o ) for o in range( 0, 6, 2 ) ]
+            self.assertEqual( sum( pages, [] ), everything )
+
+    def test_search_candidates( self ):
+        # With more matches than candidates, those with a term in the title are taken first.
+        self.db.create_many( [ sample_record( str( i ), 'This book! /' ) for i in range( 1, 5 ) ] +
+                             [ sample_record( '9', 'Poop /' ) ] )
+        idx = keyword_index.index.build( self.db )
+        with mock.patch.object( keywords, 'SEARCH_CANDIDATES', 3 ):
+            self.assertEqual( [ c for c, s in self.db.search( 'poop' ) ],
+                              [ 'DLC9', 'DLC1', 'DLC2' ] )
+            self.assertEqual( idx.search( 'poop' ), self.db.search( 'poop' ) )
+
+    def test_index_search( self ):
+        # The in-memory index ranks the same records the same way as the database.
+        self.db.create_many( [ sample_record( str( i ), 'Poop {} book /'.format( 'poop ' * i ) )
+                               for i in range( 1, 6 ) ] +
+                             [ sample_record( '6', 'A book /' ) ] )
+        idx = keyword_index.index.build( self.db )
+        for query in [ 'poop', 'book', 'poop book', 'book poop' ]:
+            self.assertEqual( idx.search( query ), self.db.search( query ) )
+            self.assertEqual( idx.search( query, namespaces = [ 'T' ] ),
+                              self.db.search( query, namespaces = [ 'T' ] ) )
+        with mock.patch.object( keywords, 'SEARCH_CANDIDATES', 3 ):
+            self.assertEqual( idx.search( 'poop book', offset = 2 ),
+                              self.db.search( 'poop book', offset = 2 ) )
+
+    def test_index_snapshot( self ):
+        self.db.create_many( [ sample_record( str( i ) ) for i in range( 1, 4 ) ] )
+        idx = keyword_index.index.build( self.db )
+        idx.remove( 'DLC2' )
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join( d, 'keywords.idx' )
+            idx.save( path )
+            self.assertEqual( os.listdir( d ), [ 'keywords.idx' ] )
+            loaded = keyword_index.index.load( path )
+            with open( path, 'r+b' ) as f:
+                f.truncate( os.path.getsize( path ) - 1 )
+            with self.assertRaises( ValueError ):
+                keyword_index.index.load( path )
+        self.assertEqual( loaded.stamp, idx.stamp )
+        self.assertEqual( loaded.ctl_nums, [ 'DLC1', 'DLC3' ] )
+        self.assertEqual( loaded.postings, idx.postings )
+        self.assertEqual( loaded.last, idx.last )
+        self.assertEqual( loaded.search( 'poop' ), idx.search( 'poop' ) )
+
+
+class rebuild( catalog ):
+
+    def test_swap_after_crash( self ):
+        self.db.create( sample_record() )
+        self.db.db.execute( 'CREATE TABLE bib_keywords_old LIKE bib_keywords' )
+        rebuild_keywords.rebuild_all( self.db, 1 )
+        self.assertEqual( [ c for c, s in self.db.search( 'poop' ) ], [ 'DLC666' ] )
+
+    def test_created_during_rebuild( self ):
+        # A record created after the scan passed its place lands in the table being replaced.
+        self.db.create( sample_record( '1' ) )
+        scan = self.db.scan_keyword_values
+        def scan_then_create():
+            yield from scan()
+            self.db.create( sample_record( '2' ) )
+        self.db.scan_keyword_values = scan_then_create
+        rebuild_keywords.rebuild_all( self.db, 1 )
+        self.assertEqual( [ c for c, s in self.db.search( 'poop' ) ], [ 'DLC1', 'DLC2' ] )
+
+
+class shared_cache( catalog ):
+
+    def test_invalidated_during_read( self ):
+        # Process A reads a record from the store; before A caches it, process B updates it.  A
+        # mustn't put its copy in the sqlite file they share.
+        self.db.create( sample_record() )
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join( d, 'cache.sqlite' )
+            a = cache.cache( self.db, path = path )
+            b = cache.cache( MARC.MARC( dict( self.conn_data ) ), path = path )
+
+            read = self.db.read
+            def read_then_update( ID ):
+                rec = read( ID )
+                edited = b.read( ID )
+                edited.find( '245' ).fields[ 'a' ] = 'Changed /'
+                b.update( edited )
+                return rec
+            self.db.read = read_then_update
+            a.read( 'DLC666' )
+            del self.db.read
+
+            self.assertEqual( b.read( 'DLC666' ).find( '245' ).fields[ 'a' ], 'Changed /' )
+            self.assertEqual( b.stats[ 'disk_hits' ], 0 )
+            b.close()
+            a.disk.close()
+
+    def test_collation( self ):
+        # The cache finds and drops records under any control number the store matches them by.
+        self.db.create( sample_record() )
+        with tempfile.TemporaryDirectory() as d:
+            cached = cache.cache( self.db, path = os.path.join( d, 'cache.sqlite' ) )
+            self.assertEqual( [ r.ctl_num() for r in cached.read_many( [ 'dlc666', 'DLC404' ] ) ],
+                              [ 'DLC666' ] )
+            self.assertEqual( [ r.ctl_num() for r in cached.read_many( [ 'DLC666 ', 'dlc666' ] ) ],
+                              [ 'DLC666', 'DLC666' ] )
+            self.assertEqual( cached.stats[ 'hits' ], 1 )
+
+            edited = cached.read( 'DLC666' )
+            edited.find( '245' ).fields[ 'a' ] = 'Changed /'
+            cached.update( edited )
+            self.assertEqual( cached.read( 'dlc666' ).find( '245' ).fields[ 'a' ], 'Changed /' )
+            cached.disk.close()
+
+
+class load( catalog ):
+
+    def test_fill_digests( self ):
+        # Records stored without a digest are compared in full; only those that differ are updated.
+        self.db.create_many( [ sample_record( '1' ), sample_record( '2' ) ] )
+        self.db.db.execute( 'UPDATE MARC_leader SET digest = NULL' )
+        self.db.db.commit()
+        stamps = { c : self.db.read( c ).ctl_fields[ '005' ] for c in [ 'DLC1', 'DLC2' ] }
+
+        batch = [ sample_record( '1' ), sample_record( '2', 'Changed /' ) ]
+        loader = load_marc.loader( self.db, 10, update = True )
+        loader.store( [ ( rec.ctl_num(), rec ) for rec in batch ] )
+        self.assertEqual( ( loader.unchanged, loader.updated ), ( 1, 1 ) )
+        self.assertEqual( self.db.read( 'DLC1' ).ctl_fields[ '005' ], stamps[ 'DLC1' ] )
+        self.assertNotEqual( self.db.read( 'DLC2' ).ctl_fields[ '005' ], stamps[ 'DLC2' ] )
+        for c in [ 'DLC1', 'DLC2' ]:
+            rec = self.db.read( c )
+            self.assertEqual( self.db.get_digests( [ c ] )[ c ],
+                              ( rec.digest(), rec.ctl_fields[ '005' ] ) )
+
+    def test_collation( self ):
+        # Control numbers differing only in case or trailing spaces are the same record.
+        self.db.create( sample_record( '1' ) )
+        loader = load_marc.loader( self.db, 10, update = True )
+        loader.store( [ ( 'dlc1', sample_record( '1', 'Changed /' ) ),
+                        ( 'DLC1 ', sample_record( '1' ) ) ] )
+        self.assertEqual( ( loader.updated, loader.duplicates, loader.stored ), ( 1, 1, 0 ) )
+        self.assertEqual( self.db.read( 'DLC1' ).find( '245' ).fields[ 'a' ], 'Changed /' )
+
+
+if __name__ == "__main__":
+    unittest.main()
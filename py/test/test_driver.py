@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              test_driver.py
+#  Description:       db.mysql.driver connection pool
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:57:43 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""db.mysql.driver connection pool, against the sqlite stand-in for MySQLdb (see standin/MySQLdb)"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.insert( 0, os.path.join( HERE, 'standin' ) )
+sys.path.append( os.path.join( HERE, '..', 'lib' ) )
+
+import MySQLdb
+
+from db.mysql import driver
+
+
+class pool( unittest.TestCase ):
+
+    def setUp( self ):
+        self.host = 'test-pool-{}'.format( os.getpid() )
+        self.path = MySQLdb.create( self.host )
+        self.conn_data = { 'host' : self.host, 'user' : 'test', 'pass' : '', 'db' : 'franklin' }
+        self.pools = []
+
+    def tearDown( self ):
+        for p in self.pools:
+            p.close()
+        for suffix in [ '', '-wal', '-shm' ]:
+            try:
+                os.remove( self.path + suffix )
+            except OSError:
+                pass
+
+    def pool( self, **kwargs ) -> driver.pool:
+        p = driver.pool( self.conn_data, **kwargs )
+        self.pools.append( p )
+        return p
+
+
+    def test_reuse( self ):
+        p = self.pool()
+        conn = p.get()
+        p.put( conn )
+        self.assertIs( p.get(), conn )
+        self.assertEqual( p.statistics()[ 'created' ], 1 )
+
+    def test_checkout_timeout( self ):
+        p = self.pool( max_size = 1, checkout_timeout = 0.1 )
+        p.get()
+        start = time.monotonic()
+        with self.assertRaises( TimeoutError ):
+            p.get()
+        self.assertGreaterEqual( time.monotonic() - start, 0.1 )
+        stats = p.statistics()
+        self.assertEqual( ( stats[ 'timeouts' ], stats[ 'open' ], stats[ 'in_use' ] ), ( 1, 1, 1 ) )
+
+    def test_wakes_on_put( self ):
+        p = self.pool( max_size = 1, checkout_timeout = 10 )
+        conn = p.get()
+        threading.Timer( 0.1, p.put, ( conn, ) ).start()
+        start = time.monotonic()
+        self.assertIs( p.get(), conn )
+        self.assertLess( time.monotonic() - start, 5 )
+        self.assertEqual( p.statistics()[ 'waits' ], 1 )
+
+    def test_reap( self ):
+        p = self.pool( min_size = 1, idle_timeout = 0 )
+        conns = [ p.get() for i in range( 3 ) ]
+        for conn in conns:
+            p.put( conn )
+        time.sleep( 0.01 )
+
+        # The two least recently used are closed; the most recent one is kept and handed out.
+        self.assertIs( p.get(), conns[ -1 ] )
+        stats = p.statistics()
+        self.assertEqual( ( stats[ 'closed' ], stats[ 'open' ] ), ( 2, 1 ) )
+
+    def test_failed_ping( self ):
+        p = self.pool( check_after = 0 )
+        conn = p.get()
+        p.put( conn )
+        conn.raw.close()                # the server went away while it sat idle
+
+        fresh = p.get()
+        self.assertIsNot( fresh, conn )
+        fresh.ping()
+        stats = p.statistics()
+        self.assertEqual( ( stats[ 'failed_checks' ], stats[ 'closed' ], stats[ 'open' ] ),
+                          ( 1, 1, 1 ) )
+
+    def test_discard_broken( self ):
+        # A connection that can't even roll back is discarded, freeing its slot.
+        p = self.pool( max_size = 1, checkout_timeout = 0.1 )
+        conn = p.get()
+        conn.raw.close()
+        p.put( conn )
+        stats = p.statistics()
+        self.assertEqual( ( stats[ 'closed' ], stats[ 'open' ], stats[ 'idle' ] ), ( 1, 0, 0 ) )
+        self.assertIsNot( p.get(), conn )
+
+
+if __name__ == "__main__":
+    unittest.main()
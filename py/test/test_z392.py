@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+#  File:              test_z392.py
+#  Description:       Round trips through the Z39.2 renderer and parser
+#  Author:            Jay Windley <jwindley>
+#  Created:           Sun Oct 18 19:39:45 2026
+#  Copyright:         (c) 2026 Jay Windley
+#                     All rights reserved.
+# -----------------------------------------------------------------------
+"""Round trips through the Z39.2 renderer and parser
+
+   Runs under unittest or pytest from any directory:
+
+     python3 -m unittest discover py/test
+
+"""
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( os.path.join( HERE, '..', 'lib' ) )
+
+from MARC import MARC, Z392
+
+TEST_MARC = os.path.join( HERE, '..', '..', 'test.marc' )
+
+
+def content( rec: MARC.record ) -> tuple:
+    """Return everything about <rec> that a round trip has to keep, in a comparable form."""
+    return ( rec.leader[ 5:12 ] + rec.leader[ 17: ],
+             dict( rec.ctl_fields ),
+             [ ( t.tag, t.seq, t.ind, t.fields.fields )
+               for t in sorted( rec.tags, key = lambda t: ( t.tag, t.seq ) ) ] )
+
+
+def canonical( lines: list ) -> MARC.record:
+    return MARC.record( '\n'.join( lines ) + '\n' )
+
+
+class round_trip( unittest.TestCase ):
+
+    def check( self, rec: MARC.record ) -> MARC.record:
+        """Assert that <rec> survives render, parse, render, and return the parsed copy."""
+        b = Z392.render_bytes( rec )
+        parsed = Z392.parse_bytes( b )
+        self.assertIsNotNone( parsed )
+        self.assertEqual( content( parsed ), content( rec ) )
+        self.assertEqual( Z392.render_bytes( parsed ), b )
+
+        # The leader has to agree with what was written.
+        self.assertEqual( int( parsed.leader[ 0:5 ] ), len( b ) )
+        self.assertEqual( b[ int( parsed.leader[ 12:17 ] ) - 1 ], Z392.FT_byte )
+        return parsed
+
+
+    def test_test_marc( self ):
+        with open( TEST_MARC ) as f:
+            rec = MARC.record( f.read() )
+        parsed = self.check( rec )
+        self.assertEqual( parsed.ctl_num(), 'DLC666' )
+        self.assertEqual( parsed.find( '245' ).fields[ 'a' ], 'Poop on this book! /' )
+        self.assertEqual( [ t.fields[ 'a' ] for t in parsed.filter( '650' ) ],
+                          [ 'Poop', 'Defecation (Typography)', 'Diet ' ] )
+
+
+    def test_multibyte( self ):
+        rec = canonical( [
+            'LDR    00000cam a2200000 a 4500',
+            '001    12345',
+            '008    120315s2012    xx            000 0 rus d',
+            '040    |aDLC',
+            '100 1  |aDvořák, Antonín,|d1841-1904.',
+            '245 10 |aМосква и москвичи /|cГиляровский.',
+            '650  0 |aŁódź (Poland)|xHistory.',
+            '650  0 |a\U0001d11e Music — notation.',
+            ] )
+        parsed = self.check( rec )
+        self.assertEqual( parsed.find( '245' ).fields[ 'a' ], 'Москва и москвичи /' )
+
+        # Directory lengths count bytes, not characters.
+        b = Z392.render_bytes( rec )
+        self.assertGreater( len( b ), len( b.decode( 'utf-8' ) ) )
+
+
+    def test_many_repeats( self ):
+        lines = [ 'LDR    00000cam a2200000 a 4500', '001    777', '040    |aDLC' ]
+        lines += [ '650  0 |aSubject {}'.format( i ) for i in range( 1, 13 ) ]
+        rec = canonical( lines )
+        self.assertEqual( max( t.seq for t in rec.tags ), 12 )
+
+        parsed = self.check( rec )
+        self.assertEqual( [ t.fields[ 'a' ] for t in parsed.filter( '650' ) ],
+                          [ 'Subject {}'.format( i ) for i in range( 1, 13 ) ] )
+        self.assertEqual( parsed.find( '650', 10 ).fields[ 'a' ], 'Subject 10' )
+
+
+    def test_parse_str( self ):
+        with open( TEST_MARC ) as f:
+            rec = MARC.record( f.read() )
+        s = Z392.render( rec )
+        self.assertEqual( content( Z392.parse_str( s ) ), content( rec ) )
+        self.assertEqual( Z392.render( rec, base_64 = True ),
+                          Z392.render( Z392.parse_str( s ), base_64 = True ) )
+
+
+    def test_stream( self ):
+        with open( TEST_MARC ) as f:
+            rec = MARC.record( f.read() )
+        recs = [ rec, canonical( [ 'LDR    00000nam a2200000 a 4500', '001    2', '040    |aDLC',
+                                   '245 00 |aSecond.' ] ) ]
+
+        buf = io.BytesIO()
+        self.assertEqual( Z392.write_records( buf, recs * 3 ), 6 )
+
+        # A chunk size smaller than a record makes records straddle chunks.
+        read = list( Z392.iter_file( io.BytesIO( buf.getvalue() ), chunk_size = 100 ) )
+        self.assertEqual( [ content( r ) for r in read ], [ content( r ) for r in recs * 3 ] )
+
+
+    def test_marc8_refused( self ):
+        rec = canonical( [ 'LDR    00000cam  2200000 a 4500', '001    3', '040    |aDLC' ] )
+        b = bytearray( Z392.render_bytes( rec ) )
+        self.assertEqual( chr( b[9] ), Z392.UNICODE )
+
+        b[9] = ord( ' ' )
+        with self.assertRaises( Z392.encoding_error ):
+            Z392.parse_bytes( bytes( b ) )
+
+        rejected = []
+        read = list( Z392.iter_file( io.BytesIO( bytes( b ) * 2 ),
+                                     on_reject = lambda data, e: rejected.append( e ) ) )
+        self.assertEqual( read, [] )
+        self.assertEqual( len( rejected ), 2 )
+
+
+class sidecar( unittest.TestCase ):
+    """The index mapped_file saves next to a dump, and its reuse."""
+
+    def setUp( self ):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join( self.dir.name, 'dump.mrc' )
+        self.write( 3 )
+
+    def tearDown( self ):
+        self.dir.cleanup()
+
+    def write( self, count: int ):
+        recs = [ canonical( [ 'LDR    00000nam a2200000 a 4500', '001    {}'.format( i ),
+                              '040    |aDLC', '245 00 |aNumber {}.'.format( i ) ] )
+                 for i in range( 1, count + 1 ) ]
+        with open( self.path, 'wb' ) as f:
+            Z392.write_records( f, recs )
+
+    def open( self ) -> tuple:
+        """Return the dump opened as a mapped_file and whether it had to be scanned."""
+        with mock.patch.object( Z392.mapped_file, 'build_index', autospec = True,
+                                side_effect = Z392.mapped_file.build_index ) as build:
+            f = Z392.mapped_file( self.path )
+        self.addCleanup( f.close )
+        return f, build.called
+
+    def check( self, f: Z392.mapped_file, count: int ):
+        self.assertEqual( sorted( f.keys() ), sorted( 'DLC{}'.format( i )
+                                                      for i in range( 1, count + 1 ) ) )
+        self.assertEqual( f[ 'DLC2' ].find( '245' ).fields[ 'a' ], 'Number 2.' )
+
+
+    def test_warm( self ):
+        f, scanned = self.open()
+        self.assertTrue( scanned )
+        self.assertEqual( sorted( os.listdir( self.dir.name ) ), [ 'dump.mrc', 'dump.mrc.idx' ] )
+        f, scanned = self.open()
+        self.assertFalse( scanned )
+        self.check( f, 3 )
+
+    def test_stale( self ):
+        self.open()
+        self.write( 4 )
+        stat = os.stat( self.path )
+        os.utime( self.path, ns = ( stat.st_atime_ns, stat.st_mtime_ns + 10**9 ) )
+        f, scanned = self.open()
+        self.assertTrue( scanned )
+        self.check( f, 4 )
+
+    def test_truncated( self ):
+        self.open()
+        index = self.path + Z392.INDEX_SUFFIX
+        for size in [ os.path.getsize( index ) - 1, Z392.INDEX_HEADER.size + 4, 5, 0 ]:
+            with open( index, 'r+b' ) as f:
+                f.truncate( size )
+            f, scanned = self.open()
+            self.assertTrue( scanned )
+            self.check( f, 3 )
+
+    def test_garbage( self ):
+        self.open()
+        index = self.path + Z392.INDEX_SUFFIX
+        with open( index, 'rb' ) as f:
+            header = f.read( Z392.INDEX_HEADER.size )
+        for junk in [ b'\x80not an index' * 10, header + b'\xff' * 100 ]:
+            with open( index, 'wb' ) as f:
+                f.write( junk )
+            f, scanned = self.open()
+            self.assertTrue( scanned )
+            self.check( f, 3 )
+
+        # The rescan left a good sidecar behind.
+        f, scanned = self.open()
+        self.assertFalse( scanned )
+
+
+if __name__ == "__main__":
+    unittest.main()